@@ -1,53 +1,93 @@
+import textwrap
+from typing import Optional
+
 import rich
-import yaml
-from pygments import highlight
-from pygments.formatters.terminal import TerminalFormatter
-from pygments.lexers.data import YamlLexer
 
-import markdown_parser
+from approvals import ApprovalPolicy, HumanApproval
 from chat import ChatMessage, ChatWithCallback
-from common import ModuleDetails
+import markdown_parser
+from common import BOT_PREFIX, ModuleDetails
+from dag import Stage, StageGraph
+from examples import Example, analysis_yaml
+from replies import MODULE_SCHEMA, PACKAGE_MODULE_SCHEMA, ReplyError, module_name, parse_reply
+from terminal import print_code
+
+EXAMPLE_REQUIREMENT = 'Given a markdown file containing code blocks, I want to extract the code blocks.'
+EXAMPLE_MODULE = ModuleDetails(
+    name='markdown_utils',
+    description='A module for markdown-related utility functions',
+    api='''def extract_code_blocks(text: str) -> list[str]:
+    """
+    Extracts code blocks from a markdown text.
+
+    Args:
+    text: A string that may or may not contain markdown code blocks.
+
+    Returns:
+    All the code blocks identified in the given text. If no code blocks were found, return an empty list.
+    """
+''')
+EXAMPLE_PACKAGE_REQUIREMENT = 'I want to find the most frequent words in the markdown files of a directory.'
+EXAMPLE_PACKAGE = [
+    ModuleDetails(
+        name='word_counts',
+        description='Counts the words of a text',
+        api='''def count_words(text: str) -> dict[str, int]:
+    """
+    Counts the words of a text, ignoring their case and punctuation.
+    """
+'''),
+    ModuleDetails(
+        name='frequent_words',
+        description='Finds the most frequent words in the markdown files of a directory',
+        requires=['word_counts'],
+        api='''def most_frequent_words(directory: str, count: int) -> list[str]:
+    """
+    The count most frequent words in the .md files of the directory, most frequent first.
+    """
+'''),
+]
+
+
+def parse_and_print(content: str) -> ModuleDetails:
+    values = parse_reply(content, MODULE_SCHEMA)
+    module = ModuleDetails(name=module_name(values['name']), description=values['description'], api=values['api'])
+    rich.print('[light_goldenrod3]BOT:[/light_goldenrod3] Here is an overview of the module you required.')
+    print_code(analysis_yaml(module), 'yaml')
+    return module
 
 
-def parse_and_print(content: str) -> str:
-    blocks = markdown_parser.parse_code_blocks(content)
-    code = blocks[0].code
-    rich.print('[light_goldenrod3]BOT:[/light_goldenrod3] Here is an overview of the module you required.')
-    print(highlight(code, YamlLexer(), TerminalFormatter()))
-    return code
+def format_examples(examples: list[tuple[str, ModuleDetails]]) -> str:
+    sections = [f'given the following text:\n{requirement}\n\nThe answer may be:\n```yaml\n{analysis_yaml(module)}\n```'
+                for requirement, module in examples]
+    text = 'For example, ' + '\n\nAnother example, '.join(sections)
+    # The prompt is indented, and so must the examples be, beyond their first line
+    return textwrap.indent(text, ' ' * 8)[8:]
 
 
 class Analyzer:
-    def __init__(self, requirements: str):
+    """
+    Writes the api of a module from its requirements. The prompt shows the model the examples given, e.g. the modules
+    written for the most similar requirements in previous runs, or a default example.
+    """
+
+    def __init__(self, requirements: str, approval: Optional[ApprovalPolicy] = None,
+                 examples: Optional[list[Example]] = None):
         self.requirements = requirements
+        self.approval = approval or HumanApproval()
+        self.examples = examples or []
         self.analyze_and_review_chat: ChatWithCallback = self._create_analyze_and_review_chat()
 
     def _create_analyze_and_review_chat(self):
+        examples = [(example.requirement, example.module) for example in self.examples] or [
+            (EXAMPLE_REQUIREMENT, EXAMPLE_MODULE)]
         prompt = f'''
         Your are a very experienced python software developer. 
         Write the api for a module based on its description.
 
         The API should contain the module's name and public functions signatures and doc strings.
 
-        For example, given the following text:
-        Given a markdown file containing code blocks, I want to extract the code blocks.
-
-        The answer may be:
-        ```yaml
-        name: markdown_utils
-        description: A module for markdown-related utility functions
-        api: |
-          def extract_code_blocks(text: str) -> list[str]:
-              """
-              Extracts code blocks from a markdown text.
-
-              Args:
-              text: A string that may or may not contain markdown code blocks.
-
-              Returns:
-              All the code blocks identified in the given text. If no code blocks were found, return an empty list.
-              """
-        ```
+        {format_examples(examples)}
 
         Reply only with a valid yaml, formatted as in the example.
 
@@ -56,21 +96,94 @@ class Analyzer:
         <formatted yaml>
         '''
 
+        # The yaml is parsed within the callback, so that an invalid one can be sent back to the model
         return ChatWithCallback(callback=parse_and_print, messages=[
             ChatMessage.of_system('You are an experienced python software engineer.'),
             ChatMessage.of_user(prompt)
-        ])
+        ], stream=True, language='yaml', approval=self.approval, stage='analyze')
 
-    @staticmethod
-    def _parse_response(response: str) -> ModuleDetails:
-        yaml_data = yaml.safe_load(response)
+    def analyze(self) -> ModuleDetails:
+        return self.analyze_and_review_chat.run()
+
+
+def parse_package(content: str) -> list[ModuleDetails]:
+    """
+    Parses a yaml block per module, and raises a ReplyError unless the modules only require other modules of the
+    package, without a cycle between them.
+    """
+    blocks = markdown_parser.parse_code_blocks(content, 'yaml')
+    if not blocks:
+        raise ReplyError('The reply must have a ```yaml block for every module')
+    modules = []
+    for block in blocks:
+        values = parse_reply(block.code, PACKAGE_MODULE_SCHEMA)
+        modules.append(ModuleDetails(name=module_name(values['name']), description=values['description'],
+                                     api=values['api'], requires=[module_name(name) for name in values['requires']]))
+
+    names = [module.name for module in modules]
+    if len(set(names)) != len(names):
+        raise ReplyError('Every module must have its own name')
+    for module in modules:
+        unknown = [name for name in module.requires if name not in names or name == module.name]
+        if unknown:
+            raise ReplyError(f'The module {module.name} requires {", ".join(unknown)}, which are not other modules of '
+                             f'the package')
+    try:
+        StageGraph([Stage(module.name, run=None, inputs=module.requires) for module in modules])
+    except ValueError:
+        raise ReplyError('The modules must not require each other in a cycle') from None
+    return modules
+
+
+def print_package(content: str) -> list[ModuleDetails]:
+    modules = parse_package(content)
+    rich.print(f'{BOT_PREFIX} Here is an overview of the modules of the package you required.')
+    for module in modules:
+        print_code(analysis_yaml(module), 'yaml')
+    return modules
+
+
+class PackageAnalyzer:
+    """
+    Decomposes a requirement into a package of modules, each with its api and the other modules it requires, which
+    are implemented before it.
+    """
+
+    def __init__(self, requirements: str, approval: Optional[ApprovalPolicy] = None):
+        self.requirements = requirements
+        self.approval = approval or HumanApproval()
+        self.decompose_and_review_chat: ChatWithCallback = self._create_decompose_and_review_chat()
 
-        return ModuleDetails(
-            name=yaml_data['name'],
-            description=yaml_data['description'],
-            api=yaml_data['api']
-        )
+    def _create_decompose_and_review_chat(self):
+        example = '\n\n'.join(f'```yaml\n{analysis_yaml(module)}\n```' for module in EXAMPLE_PACKAGE)
+        # The prompt is indented, and so must the example be, beyond its first line
+        example = textwrap.indent(example, ' ' * 8)[8:]
+        prompt = f'''
+        Your are a very experienced python software developer. 
+        Split the requirement below into a package of small modules, and write the api of every module.
 
-    def analyze(self) -> ModuleDetails:
-        reviewed_analysis = self.analyze_and_review_chat.run()
-        return self._parse_response(reviewed_analysis)
+        The API should contain the module's name and public functions signatures and doc strings.
+        A module lists the other modules of the package that it imports in `requires`. Modules must not require each
+        other in a cycle. Prefer modules that do not require each other, as they are implemented in parallel.
+
+        For example, given the following text:
+        {EXAMPLE_PACKAGE_REQUIREMENT}
+
+        The answer may be:
+        {example}
+
+        Reply only with a valid ```yaml block per module, formatted as in the example.
+
+        Package description: {self.requirements}
+        Response:
+        <formatted yaml blocks>
+        '''
+
+        # Not streamed, as a streamed reply would stop at the end of the first module
+        return ChatWithCallback(callback=print_package, messages=[
+            ChatMessage.of_system('You are an experienced python software engineer.'),
+            ChatMessage.of_user(prompt)
+        ], approval=self.approval, stage='analyze')
+
+    def decompose(self) -> list[ModuleDetails]:
+        return self.decompose_and_review_chat.run()
@@ -0,0 +1,154 @@
+import select
+import sys
+from typing import Optional
+
+import rich
+from rich.prompt import Confirm, Prompt
+
+from common import BOT_PREFIX
+from instrumentation import tracer
+
+
+def repair_feedback(error: Exception) -> str:
+    rich.print(f'{BOT_PREFIX} The reply could not be used ({type(error).__name__}), asking for another one')
+    return f'I could not use your reply: {type(error).__name__}: {error}\nReply again, in the requested format.'
+
+
+class ApprovalPolicy:
+    """
+    Resolves the checkpoints where a pipeline would wait for a human:
+    - review: a reply of the model was handled by its stage. Returns feedback to send back to the model, or None to
+      accept the reply. error is the exception raised while handling the reply, if any.
+    - confirm: a yes or no question, e.g. whether to install the dependencies of the module.
+    - proceed: a pause before continuing, e.g. before the tests run again.
+
+    This base policy accepts everything without waiting, and fails the stage if a reply could not be handled.
+    Policies are shared by concurrent pipelines, so they must not keep state between calls.
+    """
+    name = 'auto'
+    interactive = False
+    # Whether stages should run their own checks on a reply, and report failures to review as errors
+    checks_replies = False
+
+    def review(self, stage: str, attempt: int, error: Optional[Exception] = None) -> Optional[str]:
+        if error is not None:
+            raise error
+        return None
+
+    def confirm(self, stage: str, question: str, default: bool = False) -> bool:
+        return default
+
+    def proceed(self, stage: str, message: str) -> None:
+        pass
+
+
+class AutoApproval(ApprovalPolicy):
+    pass
+
+
+class ValidReplyApproval(ApprovalPolicy):
+    """
+    Accepts replies that their stage could parse. A reply that could not be parsed is sent back to the model with the
+    error, up to max_repairs times per stage.
+    """
+    name = 'valid'
+
+    def __init__(self, max_repairs: int = 2):
+        self.max_repairs = max_repairs
+
+    def review(self, stage: str, attempt: int, error: Optional[Exception] = None) -> Optional[str]:
+        if error is None:
+            return None
+        if attempt > self.max_repairs:
+            raise error
+        return repair_feedback(error)
+
+
+class RunnableTestsApproval(ValidReplyApproval):
+    """
+    Like ValidReplyApproval, and the generated unit tests must also load and run against the implementation. Failing
+    assertions are left to the Fixer, whose fixes are only accepted when the tests pass.
+    """
+    name = 'tests'
+    checks_replies = True
+
+
+class HumanApproval(ApprovalPolicy):
+    """
+    Asks a human. A reply that does not have the requested structure is sent back to the model with the problem, up to
+    max_repairs times per stage, without asking.
+    """
+    name = 'human'
+    interactive = True
+    max_repairs = 2
+
+    def _ask(self, stage: str, prompt: str) -> str:
+        with tracer.human_wait(stage):
+            return Prompt.ask(prompt)
+
+    def _confirm(self, stage: str, question: str, default: bool) -> bool:
+        with tracer.human_wait(stage):
+            return Confirm.ask(question)
+
+    def review(self, stage: str, attempt: int, error: Optional[Exception] = None) -> Optional[str]:
+        if error is not None:
+            # Imported here, as replies imports yaml, which the runner does not need to start
+            from replies import ReplyError
+            if isinstance(error, ReplyError) and attempt <= self.max_repairs:
+                return repair_feedback(error)
+            raise error
+
+        feedback = self._ask(stage, f'{BOT_PREFIX} Do you have any comments? If not just press Enter')
+        if not feedback:
+            rich.print(f'{BOT_PREFIX} OK, I will continue')
+            return None
+
+        rich.print(f'{BOT_PREFIX} OK, I will try again')
+        return feedback
+
+    def confirm(self, stage: str, question: str, default: bool = False) -> bool:
+        return self._confirm(stage, question, default)
+
+    def proceed(self, stage: str, message: str) -> None:
+        self._ask(stage, message)
+
+
+class TimeoutApproval(HumanApproval):
+    """
+    Asks like HumanApproval, but continues with the default answer if nobody answers within timeout seconds.
+    """
+    name = 'timeout'
+
+    def __init__(self, timeout: float = 60):
+        self.timeout = timeout
+
+    def _read_line(self, prompt: str) -> Optional[str]:
+        rich.print(f'{prompt} [grey50](continuing in {self.timeout:g}s)[/grey50] ', end='')
+        ready, _, _ = select.select([sys.stdin], [], [], self.timeout)
+        if not ready:
+            rich.print(f'\n{BOT_PREFIX} No answer, continuing')
+            return None
+        return sys.stdin.readline().strip()
+
+    def _ask(self, stage: str, prompt: str) -> str:
+        with tracer.human_wait(stage):
+            return self._read_line(prompt) or ''
+
+    def _confirm(self, stage: str, question: str, default: bool) -> bool:
+        with tracer.human_wait(stage):
+            answer = self._read_line(f'{question} [y/n]')
+        if not answer:
+            return default
+        return answer.lower() in ('y', 'yes')
+
+
+POLICIES = {policy.name: policy for policy in [AutoApproval, ValidReplyApproval, RunnableTestsApproval, HumanApproval,
+                                               TimeoutApproval]}
+
+
+def approval_policy(name: str, timeout: float = 60) -> ApprovalPolicy:
+    if name not in POLICIES:
+        raise ValueError(f'Unknown approval policy {name}, expected one of {", ".join(POLICIES)}')
+    if name == TimeoutApproval.name:
+        return TimeoutApproval(timeout)
+    return POLICIES[name]()
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional, Union
+
+from cache import completion_key
+from tokens import count_message_tokens, count_tokens
+
+
+class MissingAPIKeyError(RuntimeError):
+    pass
+
+
+class Backend:
+    """
+    Produces chat completions for the LLMClient, in the format of the openai API.
+
+    acreate returns a response dict, or with stream=True, an async iterator of chunk dicts. Errors are raised as
+    openai.error exceptions, so the client can retry them.
+    """
+
+    async def start(self) -> None:
+        pass
+
+    async def acreate(self, model: str, messages: list[dict[str, str]], **params) -> Union[dict, AsyncIterator[dict]]:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class OpenAIBackend(Backend):
+    """
+    The openai API, over a single keep-alive connection pool. The API key is read, and openai and aiohttp are
+    imported, when the first request is made.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, connection_limit: int = 32):
+        self.api_key = api_key
+        self.connection_limit = connection_limit
+        self._session: Optional['aiohttp.ClientSession'] = None
+
+    async def start(self) -> None:
+        if self._session is not None:
+            return
+        import aiohttp
+        import openai
+
+        api_key = self.api_key or os.environ.get('OPENAI_API_KEY')
+        if not api_key:
+            raise MissingAPIKeyError('OPENAI_API_KEY is not set!')
+        openai.api_key = api_key
+
+        connector = aiohttp.TCPConnector(limit=self.connection_limit, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(connector=connector)
+
+    async def acreate(self, model: str, messages: list[dict[str, str]], **params) -> Union[dict, AsyncIterator[dict]]:
+        import openai
+        openai.aiosession.set(self._session)
+        return await openai.ChatCompletion.acreate(model=model, messages=messages, **params)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+@dataclass
+class ScriptedReply:
+    """
+    Replies to requests whose last user message matches pattern.
+
+    The n-th reply of a conversation (counted by the assistant messages already in it) is replies[n], or the last reply
+    once they run out. Named groups of the pattern can be used in the replies as {name}.
+    """
+    pattern: str
+    replies: list[str]
+
+    def reply(self, messages: list[dict[str, str]]) -> Optional[str]:
+        user_messages = [message['content'] for message in messages if message['role'] == 'user']
+        match = re.search(self.pattern, user_messages[-1] if user_messages else '', flags=re.DOTALL)
+        if match is None:
+            return None
+
+        assistant_messages = sum(1 for message in messages if message['role'] == 'assistant')
+        reply = self.replies[min(assistant_messages, len(self.replies) - 1)]
+        for name, value in match.groupdict().items():
+            reply = reply.replace('{' + name + '}', value or '')
+        return reply
+
+
+class ReplayBackend(Backend):
+    """
+    A deterministic, offline stand-in for the openai API.
+
+    Requests are answered from recorded fixtures (keyed like the completion cache) first, and then by the first
+    matching scripted reply. Every request takes latency seconds plus latency_per_token for every token of the reply,
+    and fails with a retryable error with probability error_rate, drawn from a seeded generator.
+    """
+
+    def __init__(self, fixtures: Optional[dict[str, list[str]]] = None, script: Optional[list[ScriptedReply]] = None,
+                 latency: float = 0.0, latency_per_token: float = 0.0, error_rate: float = 0.0, seed: int = 0,
+                 chunk_size: int = 16):
+        self.fixtures = fixtures or {}
+        self.script = script or []
+        self.latency = latency
+        self.latency_per_token = latency_per_token
+        self.error_rate = error_rate
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, file_name: str, **kwargs) -> 'ReplayBackend':
+        fixtures = {}
+        with open(file_name, 'r') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    fixtures[record['key']] = record['choices']
+        return cls(fixtures=fixtures, **kwargs)
+
+    def _choices(self, model: str, messages: list[dict[str, str]], params: dict) -> list[str]:
+        n = params.get('n', 1)
+        key_params = {name: value for name, value in params.items() if name != 'stream'}
+        recorded = self.fixtures.get(completion_key(model, messages, key_params))
+        if recorded is not None:
+            return recorded
+
+        for scripted in self.script:
+            reply = scripted.reply(messages)
+            if reply is not None:
+                return [reply] * n
+
+        import openai.error
+        last_message = messages[-1]['content'].strip().splitlines()[0] if messages else ''
+        raise openai.error.InvalidRequestError(f'No recorded or scripted reply for: {last_message}', param=None)
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            self.calls += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            return failed
+
+    async def acreate(self, model: str, messages: list[dict[str, str]], **params) -> Union[dict, AsyncIterator[dict]]:
+        await asyncio.sleep(self.latency)
+        if self._should_fail():
+            import openai.error
+            raise openai.error.ServiceUnavailableError('Injected error')
+
+        choices = self._choices(model, messages, params)
+        if params.get('stream'):
+            return self._stream(choices[0], model)
+
+        completion_tokens = sum(count_tokens(choice, model) for choice in choices)
+        await asyncio.sleep(self.latency_per_token * completion_tokens)
+        return {
+            'choices': [{'index': i, 'message': {'role': 'assistant', 'content': choice}}
+                        for i, choice in enumerate(choices)],
+            'usage': {'prompt_tokens': count_message_tokens(messages, model), 'completion_tokens': completion_tokens},
+        }
+
+    async def _stream(self, content: str, model: str) -> AsyncIterator[dict]:
+        for i in range(0, len(content), self.chunk_size):
+            chunk = content[i:i + self.chunk_size]
+            await asyncio.sleep(self.latency_per_token * count_tokens(chunk, model))
+            yield {'choices': [{'index': 0, 'delta': {'content': chunk}}]}
+
+
+class RecordingBackend(Backend):
+    """
+    Passes requests to another backend, and appends every reply to a fixtures file that ReplayBackend.from_file reads.
+    A streamed reply that its consumer stopped reading early is recorded as far as it was read.
+    """
+
+    def __init__(self, backend: Backend, file_name: str):
+        self.backend = backend
+        self.file_name = file_name
+        self._lock = threading.Lock()
+
+    def _record(self, model: str, messages: list[dict[str, str]], params: dict, choices: list[str]) -> None:
+        key_params = {name: value for name, value in params.items() if name != 'stream'}
+        record = {'key': completion_key(model, messages, key_params), 'choices': choices}
+        with self._lock, open(self.file_name, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    async def start(self) -> None:
+        await self.backend.start()
+
+    async def acreate(self, model: str, messages: list[dict[str, str]], **params) -> Union[dict, AsyncIterator[dict]]:
+        response = await self.backend.acreate(model, messages, **params)
+        if params.get('stream'):
+            return self._record_stream(response, model, messages, params)
+
+        self._record(model, messages, params, [choice['message']['content'] for choice in response['choices']])
+        return response
+
+    async def _record_stream(self, chunks: AsyncIterator[dict], model: str, messages: list[dict[str, str]],
+                             params: dict) -> AsyncIterator[dict]:
+        parts = []
+        try:
+            async for chunk in chunks:
+                parts.append(chunk['choices'][0]['delta'].get('content') or '')
+                yield chunk
+        except (GeneratorExit, asyncio.CancelledError):
+            # The consumer stopped reading because it got what it needed, e.g. the first code block, so what it read
+            # is the reply to replay
+            self._record(model, messages, params, [''.join(parts)])
+            raise
+        self._record(model, messages, params, [''.join(parts)])
+
+    async def close(self) -> None:
+        await self.backend.close()
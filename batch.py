@@ -0,0 +1,102 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+
+import yaml
+from rich import print
+
+from approvals import AutoApproval
+from common import BOT_PREFIX
+from pipeline import Pipeline, PipelineResult
+from tokens import token_usage
+
+
+@dataclass
+class BatchItem:
+    id: str
+    requirement: str
+
+
+def _to_item(index: int, record) -> BatchItem:
+    if isinstance(record, str):
+        return BatchItem(id=f'{index:04d}', requirement=record)
+    if not isinstance(record, dict) or not isinstance(record.get('requirement'), str):
+        raise ValueError(f'Requirement {index + 1} must be a string, or an object with a requirement: {record!r}')
+    return BatchItem(id=str(record.get('id', f'{index:04d}')), requirement=record['requirement'])
+
+
+def _load_jsonl(f, file_name: str) -> list:
+    records = []
+    for number, line in enumerate(f, 1):
+        if line.strip():
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                raise ValueError(f'Line {number} of {file_name} is not valid json: {e}') from e
+    return records
+
+
+def load_requirements(file_name: str) -> list[BatchItem]:
+    """
+    Loads the requirements of a batch.
+
+    A .jsonl file holds one requirement per line, and a .yaml/.yml file holds a list of requirements. Each requirement
+    is either a string, or an object with a `requirement` and an optional `id`. Raises a ValueError if the file holds
+    anything else.
+    """
+    with open(file_name, 'r') as f:
+        if file_name.endswith('.jsonl'):
+            records = _load_jsonl(f, file_name)
+        else:
+            records = yaml.safe_load(f) or []
+    if not isinstance(records, list):
+        raise ValueError(f'{file_name} must hold a list of requirements')
+
+    items = [_to_item(i, record) for i, record in enumerate(records)]
+    ids = [item.id for item in items]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f'Requirement ids in {file_name} must be unique')
+    return items
+
+
+def _run_item(item: BatchItem, output_dir: str, pipeline_options: dict) -> PipelineResult:
+    print(f'{BOT_PREFIX} Starting {item.id}: {item.requirement}')
+    result = Pipeline(item.requirement, work_dir=os.path.join(output_dir, item.id), **pipeline_options).run()
+    print(f'{BOT_PREFIX} Finished {item.id} with status {result.status}')
+    return result
+
+
+def run_batch(file_name: str, output_dir: str, workers: int = 4, **pipeline_options) -> list[PipelineResult]:
+    """
+    Runs a pipeline for every requirement in file_name, each in its own directory under output_dir, with at most
+    `workers` pipelines running at the same time. A manifest.json describing the results is written to output_dir.
+
+    Any pipeline_options are passed to every Pipeline. The approval policy must not be interactive, and defaults to
+    accepting everything.
+    """
+    pipeline_options.setdefault('approval', AutoApproval())
+    if pipeline_options['approval'].interactive:
+        raise ValueError('Batch pipelines run concurrently, so their approval policy cannot be interactive')
+    items = load_requirements(file_name)
+    os.makedirs(output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda item: _run_item(item, output_dir, pipeline_options), items))
+    duration = time.perf_counter() - start
+
+    manifest = {
+        'requirements_file': file_name,
+        'approval': pipeline_options['approval'].name,
+        'duration': duration,
+        'tokens': {stage: asdict(usage) for stage, usage in token_usage.stages.items()},
+        'results': [{'id': item.id, **asdict(result)} for item, result in zip(items, results)],
+    }
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    passed = sum(1 for result in results if result.status == 'passed')
+    print(f'{BOT_PREFIX} {passed}/{len(results)} modules are passing their tests. Took {duration:.1f} seconds.')
+    return results
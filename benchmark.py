@@ -0,0 +1,370 @@
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from typing import Iterator
+
+from rich import print
+from rich.table import Table
+
+import chat
+import markdown_parser
+from approvals import approval_policy
+from backends import ReplayBackend, ScriptedReply
+from batch import run_batch
+from client import LLMClient
+from common import BOT_PREFIX
+from instrumentation import LLM, TESTS, tracer
+from profiler import PerformanceBudget
+
+ANALYSIS = '''```yaml
+name: {name}
+description: Adds numbers
+api: |
+  def add(a: int, b: int) -> int:
+      """
+      Adds two numbers.
+      """
+```'''
+
+IMPLEMENTATION = '''```yaml
+dependencies: []
+code: |
+  def add(a: int, b: int) -> int:
+      """
+      Adds two numbers.
+      """
+      return a {operator} b
+```'''
+
+TESTS_REPLY = '''```python
+import unittest
+from {name} import add
+
+
+class TestAdd(unittest.TestCase):
+    def test_positive(self):
+        # Given two positive numbers
+        a, b = 1, 2
+
+        # When
+        result = add(a, b)
+
+        # Then the sum is returned
+        self.assertEqual(result, 3)
+
+    def test_negative(self):
+        # Given two negative numbers
+        a, b = -1, -2
+
+        # When
+        result = add(a, b)
+
+        # Then the sum is returned
+        self.assertEqual(result, -3)
+```'''
+
+FIX = '''```python
+def add(a: int, b: int) -> int:
+    """
+    Adds two numbers.
+    """
+    return a + b
+```'''
+
+BENCHMARKS = '''```python
+from {name} import add
+
+
+def setup_numbers(size):
+    return list(range(size))
+
+
+def bench_numbers(data):
+    for number in data:
+        add(number, number)
+```'''
+
+
+MALFORMED_ANALYSIS = '''```yaml
+name: {name}
+api: [def add(a, b)
+```'''
+
+# Not indented under its key and with a colon in the description, which is repaired without asking again
+REPAIRABLE_ANALYSIS = '''Here is the api:
+```yaml
+name: {name}
+description: Adds numbers: a and b
+api: |
+def add(a: int, b: int) -> int:
+    """
+    Adds two numbers.
+    """
+'''
+
+
+def script(buggy: bool, malformed: bool = False, repairable: bool = False) -> list[ScriptedReply]:
+    """
+    Scripted answers for requirements of the form `<module name>: <description>`. A buggy implementation subtracts
+    instead of adding, so its tests fail until the fixer's reply is applied. A malformed analysis is missing a key,
+    so it is replaced by a valid one once the model is told it could not be used. A repairable analysis is invalid
+    yaml that is repaired locally.
+    """
+    analysis = MALFORMED_ANALYSIS if malformed else REPAIRABLE_ANALYSIS if repairable else ANALYSIS
+    return [
+        ScriptedReply(r'Description: (?P<name>\w+):', [analysis]),
+        ScriptedReply(r'could not use your reply', [ANALYSIS.replace('{name}', 'repaired')]),
+        ScriptedReply(r'Module name: (?P<name>\w+)', [IMPLEMENTATION.replace('{operator}', '-' if buggy else '+')]),
+        ScriptedReply(r'unit tests file for the module (?P<name>\w+)\.py', [TESTS_REPLY]),
+        ScriptedReply(r'Fix the module', [FIX]),
+        ScriptedReply(r'Explain and summarize the errors', ['1. add subtracts instead of adding']),
+        ScriptedReply(r'Suggest a list of unit tests', ['1. Adding positive numbers\n2. Adding negative numbers']),
+        ScriptedReply(r'benchmarks file for the module (?P<name>\w+)\.py', [BENCHMARKS]),
+    ]
+
+
+@dataclass
+class Scenario:
+    name: str
+    requirements: int
+    workers: int = 1
+    buggy: bool = False
+    fix_candidates: int = 1
+    patch_fixes: bool = False
+    llm_summary: bool = False
+    latency: float = 0.0
+    latency_per_token: float = 0.0
+    error_rate: float = 0.0
+    malformed: bool = False
+    repairable: bool = False
+    approval: str = 'auto'
+    suggest_tests: bool = False
+    optimize: bool = False
+
+
+SCENARIOS = [
+    Scenario('serial', requirements=4),
+    Scenario('batch', requirements=8, workers=4),
+    Scenario('latency', requirements=8, workers=4, latency=0.2, latency_per_token=0.001),
+    Scenario('fix_loop', requirements=4, workers=4, buggy=True),
+    Scenario('fix_candidates', requirements=4, workers=4, buggy=True, fix_candidates=3),
+    Scenario('patch_fixes', requirements=4, workers=4, buggy=True, patch_fixes=True),
+    Scenario('llm_summary', requirements=4, workers=4, buggy=True, llm_summary=True),
+    Scenario('errors', requirements=8, workers=4, latency=0.05, error_rate=0.3),
+    Scenario('repairs', requirements=4, workers=4, malformed=True, approval='tests'),
+    Scenario('local_repairs', requirements=4, workers=4, repairable=True, approval='tests'),
+    Scenario('suggest_tests', requirements=8, workers=4, latency=0.2, latency_per_token=0.001, suggest_tests=True),
+    Scenario('optimize', requirements=4, workers=4, optimize=True),
+]
+
+
+@dataclass
+class ScenarioResult:
+    scenario: str
+    pipelines: int
+    passed: int
+    wall: float
+    calls: int
+    escalated: int
+    retries: int
+    test_runs: int
+    llm_latency: float
+    tests_duration: float
+
+    @property
+    def throughput(self) -> float:
+        return self.pipelines / self.wall if self.wall else 0.0
+
+
+@contextlib.contextmanager
+def silenced() -> Iterator[None]:
+    # The spinners hold on to the original stdout, so it is redirected at the file descriptor level
+    sys.stdout.flush()
+    saved = os.dup(1)
+    with open(os.devnull, 'w') as devnull:
+        os.dup2(devnull.fileno(), 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+def run_scenario(scenario: Scenario, output_dir: str, verbose: bool = False) -> ScenarioResult:
+    backend = ReplayBackend(script=script(scenario.buggy, scenario.malformed, scenario.repairable), latency=scenario.latency,
+                            latency_per_token=scenario.latency_per_token, error_rate=scenario.error_rate)
+    chat.llm_client = LLMClient(backend=backend, base_delay=0.01, max_delay=0.1)
+    chat.completion_cache = None
+
+    requirements_file = os.path.join(output_dir, f'{scenario.name}.jsonl')
+    with open(requirements_file, 'w') as f:
+        for i in range(scenario.requirements):
+            f.write(json.dumps({'id': f'{i:04d}', 'requirement': f'{scenario.name}_{i}: add two numbers'}) + '\n')
+
+    first_span = len(tracer.spans)
+    output = contextlib.nullcontext() if verbose else silenced()
+    start = time.perf_counter()
+    try:
+        with output:
+            results = run_batch(requirements_file, os.path.join(output_dir, scenario.name), workers=scenario.workers,
+                                approval=approval_policy(scenario.approval), fix_candidates=scenario.fix_candidates,
+                                llm_summary=scenario.llm_summary, suggest_tests=scenario.suggest_tests,
+                                patch_fixes=scenario.patch_fixes,
+                                performance=PerformanceBudget() if scenario.optimize else None)
+    finally:
+        chat.llm_client.close()
+    wall = time.perf_counter() - start
+
+    spans = tracer.spans[first_span:]
+    llm_spans = [span for span in spans if span.category == LLM]
+    test_spans = [span for span in spans if span.category == TESTS]
+    return ScenarioResult(
+        scenario=scenario.name,
+        pipelines=len(results),
+        passed=sum(1 for result in results if result.status == 'passed'),
+        wall=wall,
+        calls=len(llm_spans),
+        # Calls that a stage escalated to a stronger model than the one it starts with
+        escalated=sum(1 for span in llm_spans if span.attributes.get('model') != chat.model_router.cascade[0]),
+        retries=sum(span.attributes.get('retries', 0) for span in llm_spans),
+        test_runs=len(test_spans),
+        llm_latency=sum(span.duration for span in llm_spans),
+        tests_duration=sum(span.duration for span in test_spans),
+    )
+
+
+def print_results(results: list[ScenarioResult]) -> None:
+    table = Table(title='Benchmark')
+    for i, column in enumerate(['Scenario', 'Passed', 'Wall (s)', 'Pipelines/s', 'Calls', 'Escalated', 'Retries',
+                                'Test runs', 'LLM latency (s)', 'Tests (s)']):
+        table.add_column(column, justify='left' if i == 0 else 'right')
+    for result in results:
+        table.add_row(result.scenario, f'{result.passed}/{result.pipelines}', f'{result.wall:.2f}',
+                      f'{result.throughput:.2f}', str(result.calls), str(result.escalated), str(result.retries),
+                      str(result.test_runs), f'{result.llm_latency:.2f}', f'{result.tests_duration:.2f}')
+    print(table)
+
+
+def regressions(results: list[ScenarioResult], baseline: dict, tolerance: float) -> list[str]:
+    """
+    Compares the results to a baseline written with --json, and describes every scenario that got slower by more than
+    the tolerance, made more calls or test runs, or passed fewer pipelines.
+    """
+    found = []
+    for result in results:
+        previous = baseline.get(result.scenario)
+        if previous is None:
+            continue
+        if result.wall > previous['wall'] * (1 + tolerance):
+            found.append(f"{result.scenario}: wall time {result.wall:.2f}s, was {previous['wall']:.2f}s")
+        for key in ['calls', 'test_runs']:
+            if getattr(result, key) > previous[key]:
+                found.append(f'{result.scenario}: {key} {getattr(result, key)}, was {previous[key]}')
+        if result.passed < previous['passed']:
+            found.append(f"{result.scenario}: {result.passed} passed, was {previous['passed']}")
+    return found
+
+
+TRANSCRIPT_EXCHANGE = '''Here is the implementation, with a nested example:
+````markdown
+```python
+print(add(1, 2))
+```
+````
+~~~python3 title="adder.py"\r
+def add(a: int, b: int) -> int:\r
+    return a + b\r
+~~~\r
+And a fence that is never closed: ```python
+'''
+
+
+def markdown_scaling(sizes_mb: list[int]) -> list[tuple[int, int, float]]:
+    """
+    Times parse_code_blocks on transcripts of the sizes given, made of exchanges with nested, tilde and unclosed fences.
+    The time per megabyte stays the same as the transcripts grow if parsing takes linear time.
+    """
+    results = []
+    for size_mb in sizes_mb:
+        transcript = TRANSCRIPT_EXCHANGE * (size_mb * 1024 * 1024 // len(TRANSCRIPT_EXCHANGE))
+        start = time.perf_counter()
+        blocks = markdown_parser.parse_code_blocks(transcript)
+        results.append((size_mb, len(blocks), time.perf_counter() - start))
+    return results
+
+
+def print_markdown_scaling(results: list[tuple[int, int, float]]) -> None:
+    table = Table(title='Markdown parsing')
+    for column in ['Transcript (MB)', 'Blocks', 'Time (s)', 'Time per MB (s)']:
+        table.add_column(column, justify='right')
+    for size_mb, blocks, duration in results:
+        table.add_row(str(size_mb), str(blocks), f'{duration:.2f}', f'{duration / size_mb:.3f}')
+    print(table)
+
+
+def startup_time(runs: int) -> float:
+    """
+    The median time in seconds that a new python process takes to import the runner, which every batch worker pays.
+    """
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import runner'], check=True)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline against a scripted, offline backend.')
+    parser.add_argument('--scenario', action='append', choices=[scenario.name for scenario in SCENARIOS],
+                        help='Run only this scenario (can be repeated)')
+    parser.add_argument('--json', metavar='FILE', help='Write the results to FILE')
+    parser.add_argument('--baseline', metavar='FILE', help='Fail if the results regressed from a previous --json FILE')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='The wall time increase from the baseline that is tolerated (default: 0.25)')
+    parser.add_argument('--verbose', action='store_true', help='Show the output of the pipelines')
+    parser.add_argument('--startup', type=int, metavar='RUNS',
+                        help='Time importing the runner in RUNS new processes instead, and fail if the median is '
+                             'slower than --max-startup')
+    parser.add_argument('--max-startup', type=float, default=0.5,
+                        help='The slowest median startup in seconds that --startup accepts (default: 0.5)')
+    parser.add_argument('--markdown', type=int, nargs='*', metavar='MB',
+                        help='Time the markdown parser on transcripts of these sizes instead (default: 1 2 4 8)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.startup:
+        median = startup_time(args.startup)
+        print(f'{BOT_PREFIX} Importing the runner takes {median:.3f}s (median of {args.startup} runs)')
+        sys.exit(1 if median > args.max_startup else 0)
+    if args.markdown is not None:
+        print_markdown_scaling(markdown_scaling(args.markdown or [1, 2, 4, 8]))
+        sys.exit(0)
+
+    scenarios = [scenario for scenario in SCENARIOS if not args.scenario or scenario.name in args.scenario]
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        results = [run_scenario(scenario, output_dir, args.verbose) for scenario in scenarios]
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({result.scenario: asdict(result) for result in results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for regression in found:
+            print(f'{BOT_PREFIX} Regression in {regression}')
+        if found:
+            sys.exit(1)
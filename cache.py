@@ -0,0 +1,181 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+def _normalize_content(content: str) -> str:
+    return '\n'.join(line.rstrip() for line in content.strip().splitlines())
+
+
+def completion_key(model: str, messages: list[dict[str, str]], params: dict) -> str:
+    """
+    Computes a content-addressed key for a completion request.
+
+    Trailing whitespace and surrounding blank lines are ignored in message contents, so prompts that differ only in
+    formatting map to the same key.
+    """
+    payload = {
+        'model': model,
+        'messages': [
+            {'role': message['role'], 'content': _normalize_content(message['content'])} for message in messages
+        ],
+        'params': params,
+    }
+    serialized = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+class CompletionCache:
+    """
+    Base class for completion caches. A cached value is the list of choice contents returned for a request.
+    """
+
+    def __init__(self):
+        self.stats = CacheStats()
+
+    def get(self, key: str) -> Optional[list[str]]:
+        raise NotImplementedError
+
+    def put(self, key: str, choices: list[str]) -> None:
+        raise NotImplementedError
+
+
+class MemoryCompletionCache(CompletionCache):
+    def __init__(self, max_entries: int = 256):
+        super().__init__()
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, list[str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[list[str]]:
+        with self._lock:
+            if key not in self._entries:
+                self.stats.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return list(self._entries[key])
+
+    def put(self, key: str, choices: list[str]) -> None:
+        with self._lock:
+            self._entries[key] = list(choices)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+
+class SqliteCompletionCache(CompletionCache):
+    """
+    An on-disk completion cache backed by SQLite.
+
+    Args:
+        path: The database file. It is created if it does not exist.
+        max_entries: The maximal number of cached completions. Least recently used entries are evicted first.
+        max_bytes: An optional cap on the total size of the cached completions.
+        ttl: An optional time to live in seconds. Expired entries are treated as misses and evicted.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10_000, max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None):
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        ''')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed)')
+        self._connection.commit()
+
+    def _is_expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, key: str) -> Optional[list[str]]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute('SELECT value, created FROM completions WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.stats.misses += 1
+                return None
+
+            value, created = row
+            if self._is_expired(created, now):
+                self._connection.execute('DELETE FROM completions WHERE key = ?', (key,))
+                self._connection.commit()
+                self.stats.misses += 1
+                self.stats.evictions += 1
+                return None
+
+            self._connection.execute('UPDATE completions SET accessed = ? WHERE key = ?', (now, key))
+            self._connection.commit()
+            self.stats.hits += 1
+            return json.loads(value)
+
+    def put(self, key: str, choices: list[str]) -> None:
+        value = json.dumps(choices, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO completions (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, value, len(value.encode('utf-8')), now, now)
+            )
+            self._evict(now)
+            self._connection.commit()
+
+    def _evict(self, now: float) -> None:
+        if self.ttl is not None:
+            deleted = self._connection.execute('DELETE FROM completions WHERE created < ?', (now - self.ttl,))
+            self.stats.evictions += deleted.rowcount
+
+        count, total_size = self._connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions').fetchone()
+        if count <= self.max_entries and (self.max_bytes is None or total_size <= self.max_bytes):
+            return
+
+        rows = self._connection.execute('SELECT key, size FROM completions ORDER BY accessed ASC, rowid ASC').fetchall()
+        to_delete = []
+        for key, size in rows:
+            over_size = self.max_bytes is not None and total_size > self.max_bytes
+            if count <= self.max_entries and not over_size:
+                break
+            to_delete.append((key,))
+            count -= 1
+            total_size -= size
+
+        self._connection.executemany('DELETE FROM completions WHERE key = ?', to_delete)
+        self.stats.evictions += len(to_delete)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM completions').fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -1,19 +1,99 @@
 import os
+import time
 from dataclasses import dataclass
-
-import openai as openai
-import rich
-from halo import Halo
-from rich.prompt import Prompt
-
-from common import BOT_PREFIX
-
-api_key = os.environ.get('OPENAI_API_KEY')
-if not api_key:
-    print('OPENAI_API_KEY is not set!')
-    exit(1)
-
-openai.api_key = api_key
+from typing import Callable, Iterator, Optional
+
+import markdown_parser
+import terminal
+from approvals import ApprovalPolicy, HumanApproval
+from cache import CompletionCache, SqliteCompletionCache, completion_key
+from client import CallStats, LLMClient
+from instrumentation import LLM, tracer
+from routing import ModelRouter
+from tokens import count_message_tokens, count_tokens, prompt_budget, token_usage, truncate_lines
+
+llm_client = LLMClient()
+model_router = ModelRouter()
+
+completion_cache: Optional[CompletionCache] = None
+cache_path = os.environ.get('IMPLLMENTORS_CACHE')
+if cache_path:
+    completion_cache = SqliteCompletionCache(cache_path)
+
+
+def _record_usage(span: dict, stage: str, prompt_tokens: int, completion_tokens: int) -> None:
+    token_usage.record(stage, prompt_tokens, completion_tokens)
+    span.update(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+
+def create_completions(model: str, messages: list[dict[str, str]], stage: str = 'chat', **params) -> list[str]:
+    with tracer.span(stage, LLM, model=model, cache_hit=False) as span:
+        key = completion_key(model, messages, params)
+        if completion_cache is not None:
+            cached = completion_cache.get(key)
+            if cached is not None:
+                span['cache_hit'] = True
+                return cached
+
+        stats = CallStats()
+        with terminal.spinner():
+            response = llm_client.complete(model, messages, stats, **params)
+        span['retries'] = stats.retries
+
+        choices = [choice['message']['content'] for choice in response['choices']]
+        usage = response.get('usage')
+        if usage:
+            _record_usage(span, stage, usage['prompt_tokens'], usage['completion_tokens'])
+        else:
+            _record_usage(span, stage, count_message_tokens(messages, model),
+                          sum(count_tokens(choice, model) for choice in choices))
+
+        if completion_cache is not None:
+            completion_cache.put(key, choices)
+        return choices
+
+
+def create_completion(model: str, messages: list[dict[str, str]], stage: str = 'chat', **params) -> str:
+    return create_completions(model, messages, stage, **params)[0]
+
+
+def _record_streamed_reply(span: dict, key: str, model: str, messages: list[dict[str, str]], stage: str,
+                           parts: list[str]) -> None:
+    reply = ''.join(parts)
+    _record_usage(span, stage, count_message_tokens(messages, model), count_tokens(reply, model))
+    if completion_cache is not None and reply:
+        completion_cache.put(key, [reply])
+
+
+def stream_completion(model: str, messages: list[dict[str, str]], stage: str = 'chat', **params) -> Iterator[str]:
+    with tracer.span(stage, LLM, model=model, cache_hit=False, stream=True) as span:
+        # A streamed reply may be cut short by its consumer, so streams are cached apart from the full completions
+        key = completion_key(model, messages, {**params, 'stream': True})
+        if completion_cache is not None:
+            cached = completion_cache.get(key)
+            if cached is not None:
+                span['cache_hit'] = True
+                yield cached[0]
+                return
+
+        parts = []
+        stats = CallStats()
+        start = time.perf_counter()
+        try:
+            for delta in llm_client.stream(model, messages, stats, **params):
+                if not parts:
+                    span['time_to_first_token'] = time.perf_counter() - start
+                parts.append(delta)
+                yield delta
+        except GeneratorExit:
+            # The consumer stopped reading because it got what it needed, so the partial reply is the reply
+            span['stopped_early'] = True
+            _record_streamed_reply(span, key, model, messages, stage, parts)
+            raise
+        finally:
+            span['retries'] = stats.retries
+
+        _record_streamed_reply(span, key, model, messages, stage, parts)
 
 
 @dataclass
@@ -40,6 +120,10 @@ class ChatMessage:
         }
 
 
+SUPERSEDED_CODE = '# Omitted, superseded by a later version'
+FOLLOW_UP_MAX_LINES = 12
+
+
 class ChatHistory:
     def __init__(self, messages: list[ChatMessage]):
         self.messages = messages
@@ -58,36 +142,101 @@ class ChatHistory:
         else:
             return None
 
-
-class Chat:
-    def __init__(self, messages: list[ChatMessage], model='gpt-3.5-turbo'):
-        self.model = model
+    def token_count(self, model: str = 'gpt-3.5-turbo') -> int:
+        return count_message_tokens(self.to_array_of_dicts(), model)
+
+    def compact(self, budget: int, model: str = 'gpt-3.5-turbo', patches: bool = False) -> None:
+        """
+        Shrinks the history until it fits in budget tokens. Each step is applied only if the previous ones were not
+        enough:
+        1. Code blocks in assistant replies that were followed by a later reply are replaced by a placeholder, unless
+           the replies are patches, which hold only the code they changed, so a later patch does not supersede them.
+        2. Follow-up user messages, except for the last one, are truncated.
+        3. The oldest exchanges after the opening system and user messages are dropped.
+        """
+        if self.token_count(model) <= budget:
+            return
+
+        if not patches:
+            assistant_indices = [i for i, message in enumerate(self.messages) if message.role == 'assistant']
+            for i in assistant_indices[:-1]:
+                self.messages[i] = ChatMessage.of_assistant(markdown_parser.replace_code_blocks(
+                    self.messages[i].content, lambda block: SUPERSEDED_CODE))
+            if self.token_count(model) <= budget:
+                return
+
+        opening = next((i for i, message in enumerate(self.messages) if message.role == 'user'), 0) + 1
+        for i in range(opening, len(self.messages) - 1):
+            if self.messages[i].role == 'user':
+                self.messages[i] = ChatMessage.of_user(truncate_lines(self.messages[i].content, FOLLOW_UP_MAX_LINES))
+
+        while self.token_count(model) > budget and len(self.messages) - opening > 2:
+            del self.messages[opening:opening + 2]
+
+
+class RoutedChat:
+    """
+    A chat whose completions go to model if one is given, and otherwise to the model that model_router picks for its
+    stage, which is a stronger one after every failed reply the chat was told about with escalate.
+    """
+
+    def __init__(self, model: Optional[str], stage: str):
+        self.fixed_model = model
+        self.stage = stage
+        self.failures = 0
+
+    @property
+    def model(self) -> str:
+        return self.fixed_model or model_router.model(self.stage, self.failures)
+
+    def escalate(self) -> None:
+        self.failures += 1
+
+
+class Chat(RoutedChat):
+    """
+    A chat whose history is compacted to token_budget tokens before every completion, or with fit_context, to what the
+    context window of the model of the completion leaves for the prompt. patches tells that the replies are patches,
+    which the compaction keeps (see ChatHistory.compact).
+    """
+
+    def __init__(self, messages: list[ChatMessage], model: Optional[str] = None, stage='chat',
+                 token_budget: Optional[int] = None, fit_context: bool = False, patches: bool = False):
+        super().__init__(model, stage)
         self.chat_history = ChatHistory(messages)
+        self.token_budget = token_budget
+        self.fit_context = fit_context
+        self.patches = patches
 
-    def run(self) -> ChatHistory:
-        with Halo(text='Thinking...', spinner='dots'):
-            result = openai.ChatCompletion.create(model=self.model, messages=self.chat_history.to_array_of_dicts())
+    def _messages(self) -> list[dict[str, str]]:
+        budget = prompt_budget(self.model) if self.fit_context else self.token_budget
+        if budget is not None:
+            self.chat_history.compact(budget, self.model, self.patches)
+        return self.chat_history.to_array_of_dicts()
 
-        content = result['choices'][0]['message']['content']
+    def run(self) -> ChatHistory:
+        content = create_completion(self.model, self._messages(), self.stage)
         self.chat_history.append_message(ChatMessage.of_assistant(content))
         return self.chat_history
 
+    def run_candidates(self, n: int) -> list[str]:
+        # The candidates are not added to the chat history, the caller should add the one it picked
+        return create_completions(self.model, self._messages(), self.stage, n=n)
+
 
-class ChatWithHumanFeedback:
-    def __init__(self, messages: list[ChatMessage], model='gpt-3.5-turbo'):
-        self.model = model
+class ChatWithHumanFeedback(RoutedChat):
+    def __init__(self, messages: list[ChatMessage], model: Optional[str] = None, stage='chat'):
+        super().__init__(model, stage)
         self.chat_history = ChatHistory(messages)
 
     def run(self) -> ChatHistory:
         while True:
-            with Halo(text='Thinking...', spinner='dots'):
-                result = openai.ChatCompletion.create(model=self.model, messages=self.chat_history.to_array_of_dicts())
-
-            content = result['choices'][0]['message']['content']
+            content = create_completion(self.model, self.chat_history.to_array_of_dicts(), self.stage)
             self.chat_history.append_message(ChatMessage.of_assistant(content))
             print(content)
 
-            user_input = input("Do you have any comments? If not just press Enter.")
+            with tracer.human_wait(self.stage):
+                user_input = input("Do you have any comments? If not just press Enter.")
 
             if not user_input:
                 return self.chat_history
@@ -96,28 +245,63 @@ class ChatWithHumanFeedback:
             self.chat_history.append_message(ChatMessage.of_user(user_input))
 
 
-class ChatWithCallback:
-    def __init__(self, callback, messages: list[ChatMessage], model='gpt-3.5-turbo'):
-        self.model = model
+class ChatWithCallback(RoutedChat):
+    """
+    A chat whose replies are handed to callback, and then reviewed according to the approval policy. A reply that is
+    not approved is followed by the feedback of the policy, until one is. check is called with the result of the
+    callback, when the policy asks for replies to be checked, and should raise if the result is not acceptable.
+    A reply that the callback or check raised for escalates the chat to a stronger model.
+    With stream, a reply is only received up to its first code block in language (of any language if it is None), for
+    callbacks that only use that block.
+    """
+
+    def __init__(self, callback, messages: list[ChatMessage], model: Optional[str] = None, stream=False,
+                 approval: Optional[ApprovalPolicy] = None, stage='chat', check: Optional[Callable] = None,
+                 language: Optional[str] = None):
+        super().__init__(model, stage)
         self.chat_history = ChatHistory(messages)
         self.callback = callback
+        self.stream = stream
+        self.language = language
+        self.approval = approval or HumanApproval()
+        self.check = check
+
+    def _stream_until_first_code_block(self) -> str:
+        # The callbacks only consume the first code block of a reply, so there is no need to wait for the rest of it
+        parser = markdown_parser.IncrementalCodeBlockParser(self.language)
+        deltas = stream_completion(self.model, self.chat_history.to_array_of_dicts(), self.stage)
+        with terminal.spinner():
+            for delta in deltas:
+                if parser.feed(delta):
+                    deltas.close()
+                    break
+
+        return parser.text
+
+    def _handle(self, content: str):
+        result = self.callback(content)
+        if self.check is not None and self.approval.checks_replies:
+            self.check(result)
+        return result
 
     def run(self):
+        attempt = 0
         while True:
-            with Halo(text='Thinking...', spinner='dots'):
-                response = openai.ChatCompletion.create(model=self.model,
-                                                        messages=self.chat_history.to_array_of_dicts())
-
-            content = response['choices'][0]['message']['content']
+            attempt += 1
+            if self.stream:
+                content = self._stream_until_first_code_block()
+            else:
+                content = create_completion(self.model, self.chat_history.to_array_of_dicts(), self.stage)
             self.chat_history.append_message(ChatMessage.of_assistant(content))
-            result = self.callback(content)
 
-            user_input = Prompt.ask(f"{BOT_PREFIX} Do you have any comments? If not just press Enter")
+            result, error = None, None
+            try:
+                result = self._handle(content)
+            except Exception as e:
+                error = e
+                self.escalate()
 
-            if not user_input:
-                rich.print(f'{BOT_PREFIX} OK, I will continue')
+            feedback = self.approval.review(self.stage, attempt, error)
+            if feedback is None:
                 return result
-
-            rich.print(f'{BOT_PREFIX} OK, I will try again')
-            self.chat_history.append_message(ChatMessage.of_assistant(content))
-            self.chat_history.append_message(ChatMessage.of_user(user_input))
+            self.chat_history.append_message(ChatMessage.of_user(feedback))
@@ -0,0 +1,99 @@
+import json
+import os
+import threading
+from typing import Any, Optional
+
+from chat import ChatHistory, ChatMessage
+
+CHECKPOINT_FILE_NAME = '.impllmentors-checkpoint.json'
+CHECKPOINT_VERSION = 1
+
+
+class Checkpoint:
+    """
+    The progress of a pipeline run, persisted in its work directory so that a run that died can be resumed.
+
+    For every stage it holds whether the stage completed, its output (what the next stages need from it, with the
+    generated files referred to by name, as they are written to the work directory) and the chat history of the stage.
+    An incomplete stage may hold the chat history and progress it made so far.
+    Every change is written to disk immediately, replacing the previous checkpoint atomically. Stages running
+    concurrently can update the same checkpoint. Pipelines sharing a work directory, e.g. those of the modules of a
+    package, each use their own file_name.
+    """
+
+    def __init__(self, work_dir: str, requirement: str, stages: Optional[dict[str, dict]] = None,
+                 file_name: str = CHECKPOINT_FILE_NAME):
+        self.work_dir = work_dir
+        self.requirement = requirement
+        self.stages: dict[str, dict] = stages or {}
+        self.file_name = file_name
+        self._lock = threading.RLock()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.work_dir, self.file_name)
+
+    @classmethod
+    def load(cls, work_dir: str, file_name: str = CHECKPOINT_FILE_NAME) -> Optional['Checkpoint']:
+        try:
+            with open(os.path.join(work_dir, file_name), 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if data.get('version') != CHECKPOINT_VERSION:
+            return None
+        return cls(work_dir, data['requirement'], data['stages'], file_name)
+
+    def save(self) -> None:
+        temporary_path = f'{self.path}.tmp'
+        with self._lock:
+            data = {'version': CHECKPOINT_VERSION, 'requirement': self.requirement, 'stages': self.stages}
+            with open(temporary_path, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(temporary_path, self.path)
+
+    def completed(self, stage: str) -> bool:
+        """
+        Whether the stage completed, and the files it generated are still in the work directory.
+        """
+        checkpoint = self.stages.get(stage, {})
+        if not checkpoint.get('completed'):
+            return False
+        output = checkpoint.get('output')
+        file_name = output.get('file') if isinstance(output, dict) else None
+        return file_name is None or os.path.exists(os.path.join(self.work_dir, file_name))
+
+    def output(self, stage: str) -> Any:
+        return self.stages[stage]['output']
+
+    def chat_history(self, stage: str) -> Optional[ChatHistory]:
+        messages = self.stages.get(stage, {}).get('chat')
+        if messages is None:
+            return None
+        return ChatHistory([ChatMessage(role, content) for role, content in messages])
+
+    def progress(self, stage: str) -> dict:
+        return self.stages.get(stage, {}).get('progress', {})
+
+    @staticmethod
+    def _messages(chat_history: Optional[ChatHistory]) -> Optional[list[list[str]]]:
+        if chat_history is None:
+            return None
+        return [[message.role, message.content] for message in chat_history.messages]
+
+    def complete(self, stage: str, output: Any, chat_history: Optional[ChatHistory] = None) -> None:
+        with self._lock:
+            self.stages[stage] = {'completed': True, 'output': output, 'chat': self._messages(chat_history)}
+            self.save()
+
+    def discard(self, stages: list[str]) -> None:
+        with self._lock:
+            if any(stage in self.stages for stage in stages):
+                for stage in stages:
+                    self.stages.pop(stage, None)
+                self.save()
+
+    def record_progress(self, stage: str, chat_history: ChatHistory, **progress) -> None:
+        with self._lock:
+            self.stages[stage] = {'completed': False, 'chat': self._messages(chat_history), 'progress': progress}
+            self.save()
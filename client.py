@@ -0,0 +1,219 @@
+import asyncio
+import atexit
+import queue
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterator, Optional
+
+from backends import Backend, OpenAIBackend
+from tokens import count_message_tokens, count_tokens
+
+# The names of the openai.error exceptions to retry, as openai is slow to import and only needed once a request fails
+RETRYABLE_ERRORS = ('RateLimitError', 'ServiceUnavailableError', 'APIConnectionError', 'Timeout', 'TryAgain')
+
+
+def _is_retryable(error: Exception) -> bool:
+    import openai.error
+    if isinstance(error, tuple(getattr(openai.error, name) for name in RETRYABLE_ERRORS)):
+        return True
+    if isinstance(error, openai.error.APIError):
+        return error.http_status is not None and error.http_status >= 500
+    return False
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class CallStats:
+    retries: int = 0
+
+
+class TokenBucket:
+    """
+    A token bucket refilled continuously at a fixed rate per minute.
+
+    Consuming more than is available puts the bucket in debt, which later acquisitions wait out. This lets the
+    client charge the actual usage of a completion after it is known.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate_per_second = rate_per_minute / 60
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.available = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.available -= amount
+
+    async def acquire(self, amount: float) -> None:
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.available < amount:
+                await asyncio.sleep((amount - self.available) / self.rate_per_second)
+                self._refill()
+            self.available -= amount
+
+
+class LLMClient:
+    """
+    An asyncio based client for chat completions, shared by all the chats of the process.
+
+    All requests go to a single backend (by default the openai API over a keep-alive connection pool), are limited to
+    max_concurrency in flight, are rate limited by requests and tokens per minute, and are retried with jittered
+    exponential backoff on rate limit and server errors. The synchronous complete and stream methods run the requests
+    on a background event loop, so chats running in many threads share the same limits and connections.
+    """
+
+    def __init__(self, backend: Optional[Backend] = None, max_concurrency: int = 8,
+                 requests_per_minute: float = 3500, tokens_per_minute: float = 90_000, max_retries: int = 5,
+                 base_delay: float = 1.0, max_delay: float = 30.0):
+        self.backend = backend or OpenAIBackend()
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._request_bucket: Optional[TokenBucket] = None
+        self._token_bucket: Optional[TokenBucket] = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=loop.run_forever, name='llm-client', daemon=True)
+                self._thread.start()
+                self._loop = loop
+                atexit.register(self.close)
+            return self._loop
+
+    async def _ensure_backend(self) -> None:
+        # Called from within the event loop, so the asyncio primitives bind to it
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._request_bucket = TokenBucket(self.requests_per_minute)
+            self._token_bucket = TokenBucket(self.tokens_per_minute)
+        await self.backend.start()
+
+    async def _wait_for_capacity(self, model: str, messages: list[dict[str, str]], params: dict) -> None:
+        await self._request_bucket.acquire(1)
+        await self._token_bucket.acquire(count_message_tokens(messages, model) + params.get('max_tokens', 0))
+
+    async def _backoff(self, attempt: int, error: Exception, stats: Optional[CallStats]) -> None:
+        self.retries += 1
+        if stats is not None:
+            stats.retries += 1
+        delay = _retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        await asyncio.sleep(delay)
+
+    async def acomplete(self, model: str, messages: list[dict[str, str]], stats: Optional[CallStats] = None,
+                        **params) -> dict:
+        await self._ensure_backend()
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_capacity(model, messages, params)
+            try:
+                async with self._semaphore:
+                    response = await self.backend.acreate(model, messages, **params)
+            except Exception as e:
+                if attempt == self.max_retries or not _is_retryable(e):
+                    raise
+                await self._backoff(attempt, e, stats)
+                continue
+
+            usage = response.get('usage')
+            if usage:
+                self._token_bucket.consume(usage.get('completion_tokens', 0))
+            return response
+
+    async def astream(self, model: str, messages: list[dict[str, str]], stats: Optional[CallStats] = None,
+                      **params) -> AsyncIterator[str]:
+        await self._ensure_backend()
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_capacity(model, messages, params)
+            received = []
+            try:
+                async with self._semaphore:
+                    chunks = await self.backend.acreate(model, messages, stream=True, **params)
+                    async for chunk in chunks:
+                        delta = chunk['choices'][0]['delta'].get('content')
+                        if delta:
+                            received.append(delta)
+                            yield delta
+            except Exception as e:
+                # Once deltas were handed out, retrying would duplicate them
+                if received or attempt == self.max_retries or not _is_retryable(e):
+                    raise
+                await self._backoff(attempt, e, stats)
+                continue
+
+            self._token_bucket.consume(count_tokens(''.join(received), model))
+            return
+
+    def complete(self, model: str, messages: list[dict[str, str]], stats: Optional[CallStats] = None,
+                 **params) -> dict:
+        loop = self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(self.acomplete(model, messages, stats, **params), loop).result()
+
+    def stream(self, model: str, messages: list[dict[str, str]], stats: Optional[CallStats] = None,
+               **params) -> Iterator[str]:
+        loop = self._ensure_started()
+        deltas: queue.Queue = queue.Queue()
+        done = object()
+
+        async def produce():
+            try:
+                async for delta in self.astream(model, messages, stats, **params):
+                    deltas.put(delta)
+            except Exception as e:
+                deltas.put(e)
+            finally:
+                deltas.put(done)
+
+        producer = asyncio.run_coroutine_threadsafe(produce(), loop)
+        try:
+            while True:
+                item = deltas.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            producer.cancel()
+
+    def close(self) -> None:
+        if self._loop is None:
+            return
+
+        if self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(self.backend.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            # Closed once stopped, rather than whenever it is garbage collected, which may be after its sockets are
+            self._thread.join()
+        self._loop.close()
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
 @dataclass
@@ -6,6 +6,12 @@ class ModuleDetails:
     name: str
     description: str
     api: str
+    # The other modules of the package that the module imports, by name
+    requires: list[str] = field(default_factory=list)
+
+
+def format_apis(modules: list[ModuleDetails]) -> str:
+    return '\n\n'.join(f'{module.name}.py:\n```python\n{module.api.strip()}\n```' for module in modules)
 
 
 BOT_PREFIX = '[light_goldenrod3]BOT:[/light_goldenrod3]'
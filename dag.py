@@ -0,0 +1,86 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from instrumentation import propagate
+
+
+@dataclass
+class Stage:
+    """
+    A node of a StageGraph.
+
+    Attributes:
+        name: The name of the stage, which is also the name of its output.
+        run: Called with the outputs of the input stages as keyword arguments, and returns the output of the stage.
+        inputs: The names of the stages whose outputs this stage needs.
+    """
+    name: str
+    run: Callable[..., Any]
+    inputs: list[str] = field(default_factory=list)
+
+
+class StageGraph:
+    """
+    Runs stages as soon as their inputs are ready, with independent stages running concurrently.
+
+    Stages that are ready at the same time start in the order they were given, so with max_workers=1 the stages run
+    one after the other in that order.
+    """
+
+    def __init__(self, stages: list[Stage]):
+        self.stages = stages
+        self._by_name = {stage.name: stage for stage in stages}
+        if len(self._by_name) != len(stages):
+            raise ValueError('Stage names must be unique')
+        for stage in stages:
+            missing = [name for name in stage.inputs if name not in self._by_name]
+            if missing:
+                raise ValueError(f'Stage {stage.name} depends on unknown stages: {", ".join(missing)}')
+        self._check_acyclic()
+
+    def _check_acyclic(self) -> None:
+        resolved: set[str] = set()
+        remaining = list(self.stages)
+        while remaining:
+            ready = [stage for stage in remaining if all(name in resolved for name in stage.inputs)]
+            if not ready:
+                raise ValueError(f'Stages {", ".join(stage.name for stage in remaining)} depend on each other')
+            resolved.update(stage.name for stage in ready)
+            remaining = [stage for stage in remaining if stage.name not in resolved]
+
+    def dependents(self, name: str) -> list[str]:
+        """
+        The stages that use the output of the named stage, directly or through other stages.
+        """
+        found: set[str] = set()
+        changed = True
+        while changed:
+            changed = False
+            for stage in self.stages:
+                if stage.name not in found and any(i == name or i in found for i in stage.inputs):
+                    found.add(stage.name)
+                    changed = True
+        return [stage.name for stage in self.stages if stage.name in found]
+
+    def run(self, max_workers: int = 4) -> dict[str, Any]:
+        """
+        Runs all the stages and returns their outputs by name. If a stage raises, no more stages are started, and the
+        error is raised once the running stages finish.
+        """
+        outputs: dict[str, Any] = {}
+        pending = list(self.stages)
+        running: dict[Future, Stage] = {}
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='stage') as executor:
+            while pending or running:
+                for stage in [stage for stage in pending if all(name in outputs for name in stage.inputs)]:
+                    if len(running) >= max_workers:
+                        break
+                    pending.remove(stage)
+                    running[executor.submit(propagate(stage.run), **{name: outputs[name] for name in stage.inputs})] = stage
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    outputs[stage.name] = future.result()
+        return outputs
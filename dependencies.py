@@ -0,0 +1,155 @@
+import fcntl
+import hashlib
+import importlib.util
+import json
+import os
+import site
+import subprocess
+import sys
+import sysconfig
+import venv
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from rich import print
+
+from common import BOT_PREFIX
+
+DEFAULT_ENVIRONMENTS_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'impllmentors', 'envs')
+INSTALLED_FILE_NAME = 'impllmentors-requirements.json'
+
+# Run by the python of an environment, prints the requirements that are not satisfied in it
+UNSATISFIED_SCRIPT = '''
+import json, re, sys
+from importlib import metadata
+unsatisfied = []
+for requirement in json.loads(sys.argv[1]):
+    name = re.match(r'\\s*([A-Za-z0-9][A-Za-z0-9._-]*)', requirement).group(1)
+    try:
+        version = metadata.version(name)
+    except metadata.PackageNotFoundError:
+        unsatisfied.append(requirement)
+        continue
+    if requirement.strip() == name:
+        continue
+    try:
+        from packaging.requirements import Requirement
+        if not Requirement(requirement).specifier.contains(version, prereleases=True):
+            unsatisfied.append(requirement)
+    except Exception:
+        unsatisfied.append(requirement)
+print(json.dumps(unsatisfied))
+'''
+
+
+def normalize_requirements(requirements: list[str]) -> list[str]:
+    """
+    Removes duplicates and blank requirements, and sorts the rest, so that equivalent lists get the same environment.
+    """
+    normalized = {' '.join(requirement.split()) for requirement in requirements if requirement and requirement.strip()}
+    return sorted(normalized, key=str.lower)
+
+
+def requirements_key(requirements: list[str]) -> str:
+    return hashlib.sha256('\n'.join(normalize_requirements(requirements)).lower().encode()).hexdigest()[:16]
+
+
+@dataclass
+class Environment:
+    path: str
+    python: str
+    requirements: list[str]
+
+
+class DependencyManager:
+    """
+    Installs the dependencies of generated modules into virtualenvs, instead of into the running environment.
+
+    An environment is created per set of requirements, keyed by their hash, under root, and reused by every later run
+    that needs the same set. The environments see the packages of the running environment, including those of the
+    virtualenv it may run in, so requirements it already satisfies are not installed again. The rest are installed
+    with a single pip call, with the pip of the running environment if it has one, using a wheel cache shared by all
+    the environments. An environment is locked while it is being created, so concurrent pipelines wait for each other
+    rather than installing the same packages twice.
+    """
+
+    def __init__(self, root: str = DEFAULT_ENVIRONMENTS_DIR, system_site_packages: bool = True):
+        self.root = root
+        self.system_site_packages = system_site_packages
+
+    @property
+    def wheel_cache(self) -> str:
+        return os.path.join(self.root, 'pip-cache')
+
+    @staticmethod
+    def _python(path: str) -> str:
+        return os.path.join(path, 'Scripts' if sys.platform == 'win32' else 'bin', 'python')
+
+    @contextmanager
+    def _locked(self, key: str) -> Iterator[None]:
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, f'{key}.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _installed(path: str) -> Optional[list[str]]:
+        try:
+            with open(os.path.join(path, INSTALLED_FILE_NAME), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def unsatisfied(self, python: str, requirements: list[str]) -> list[str]:
+        output = subprocess.run([python, '-c', UNSATISFIED_SCRIPT, json.dumps(requirements)], capture_output=True,
+                                text=True, check=True)
+        return json.loads(output.stdout)
+
+    def _create(self, path: str) -> None:
+        # With the system site packages, the pip of the running environment is used, which saves installing it
+        has_pip = importlib.util.find_spec('pip') is not None
+        venv.create(path, system_site_packages=self.system_site_packages,
+                    with_pip=not (self.system_site_packages and has_pip))
+        if self.system_site_packages and sys.prefix != sys.base_prefix:
+            # The system site packages of an environment are those of the base interpreter, so when running in a
+            # virtualenv, its packages are added to the new environment with a .pth file
+            site_packages = sysconfig.get_path('purelib', vars={'base': path, 'platbase': path})
+            with open(os.path.join(site_packages, 'impllmentors-running-env.pth'), 'w') as f:
+                f.write('\n'.join(site.getsitepackages()) + '\n')
+
+    def install(self, requirements: list[str]) -> Environment:
+        """
+        Returns an environment in which the requirements are installed, creating it if needed.
+        Raises a subprocess.CalledProcessError if they could not be installed.
+        """
+        requirements = normalize_requirements(requirements)
+        key = requirements_key(requirements)
+        path = os.path.join(self.root, key)
+        environment = Environment(path=path, python=self._python(path), requirements=requirements)
+        if self._installed(path) == requirements:
+            return environment
+
+        with self._locked(key):
+            # Another pipeline may have installed it while this one waited for the lock
+            if self._installed(path) == requirements:
+                return environment
+
+            if not os.path.exists(environment.python):
+                self._create(path)
+
+            unsatisfied = self.unsatisfied(environment.python, requirements)
+            if unsatisfied:
+                print(f'{BOT_PREFIX} Installing {", ".join(unsatisfied)} into {path}')
+                subprocess.run([environment.python, '-m', 'pip', 'install', '--disable-pip-version-check', '--quiet',
+                                '--cache-dir', self.wheel_cache, *unsatisfied], check=True)
+
+            with open(os.path.join(path, INSTALLED_FILE_NAME), 'w') as f:
+                json.dump(requirements, f)
+        return environment
+
+
+dependency_manager = DependencyManager(os.environ.get('IMPLLMENTORS_ENVS', DEFAULT_ENVIRONMENTS_DIR))
@@ -0,0 +1,138 @@
+import fcntl
+import json
+import math
+import os
+import re
+import textwrap
+import threading
+from collections import Counter
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from common import ModuleDetails
+
+DEFAULT_EXAMPLES_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'impllmentors', 'examples.jsonl')
+WORD = re.compile(r'[a-z0-9]+')
+
+
+@dataclass
+class Example:
+    """
+    A requirement that a pipeline implemented, with what each stage produced for it.
+    """
+    requirement: str
+    module: ModuleDetails
+    code: str
+    dependencies: list[str]
+    tests: str
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Example':
+        return cls(**{**data, 'module': ModuleDetails(**data['module'])})
+
+
+def _block(text: str) -> str:
+    return textwrap.indent(text.strip('\n'), '  ')
+
+
+def _scalar(text: str) -> str:
+    # json strings are valid yaml, and keep the values that contain e.g. colons or quotes valid
+    import yaml
+    try:
+        if yaml.safe_load(f'value: {text}') == {'value': text}:
+            return text
+    except yaml.YAMLError:
+        pass
+    return json.dumps(text, ensure_ascii=False)
+
+
+def analysis_yaml(module: ModuleDetails) -> str:
+    requires = f'requires: {json.dumps(module.requires)}\n' if module.requires else ''
+    return f'name: {module.name}\ndescription: {_scalar(module.description)}\n{requires}api: |\n{_block(module.api)}'
+
+
+def implementation_yaml(code: str, dependencies: list[str]) -> str:
+    return f'dependencies: {json.dumps(dependencies)}\ncode: |\n{_block(code)}'
+
+
+def _terms(text: str) -> Counter:
+    # Words and word pairs, so that e.g. "sort a list" and "a sorted list" are close, but not as close as the same words
+    words = WORD.findall(text.lower())
+    return Counter(words + [f'{first} {second}' for first, second in zip(words, words[1:])])
+
+
+class ExampleIndex:
+    """
+    The examples of previous runs, stored in a JSON lines file, with a TF-IDF similarity search over their
+    requirements, which picks the examples that the prompts of the next runs show the model.
+
+    The index is small (one example per implemented module), so it is kept in memory and searched exhaustively.
+    Examples are appended to the file, which concurrent pipelines and processes can do safely.
+    """
+
+    def __init__(self, file_name: str = DEFAULT_EXAMPLES_FILE):
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        self._examples: Optional[list[Example]] = None
+        self._terms: list[Counter] = []
+        self._document_frequency: Counter = Counter()
+
+    def _load(self) -> list[Example]:
+        if self._examples is None:
+            self._examples = []
+            try:
+                with open(self.file_name, 'r') as f:
+                    for line in f:
+                        if line.strip():
+                            self._index(Example.from_dict(json.loads(line)))
+            except FileNotFoundError:
+                pass
+        return self._examples
+
+    def _index(self, example: Example) -> None:
+        terms = _terms(example.requirement)
+        self._examples.append(example)
+        self._terms.append(terms)
+        self._document_frequency.update(terms.keys())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._load())
+
+    def add(self, example: Example) -> None:
+        with self._lock:
+            self._load()
+            self._index(example)
+            os.makedirs(os.path.dirname(os.path.abspath(self.file_name)), exist_ok=True)
+            with open(self.file_name, 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.write(json.dumps(asdict(example)) + '\n')
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _vector(self, terms: Counter) -> dict[str, float]:
+        documents = len(self._examples)
+        vector = {term: (1 + math.log(count)) * (math.log((1 + documents) / (1 + self._document_frequency[term])) + 1)
+                  for term, count in terms.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else vector
+
+    def nearest(self, requirement: str, count: int = 2, min_similarity: float = 0.2) -> list[Example]:
+        """
+        The examples whose requirements are the most similar to requirement, most similar first.
+        """
+        with self._lock:
+            examples = self._load()
+            if not examples:
+                return []
+
+            query = self._vector(_terms(requirement))
+            scored = []
+            for i, terms in enumerate(self._terms):
+                vector = self._vector(terms)
+                similarity = sum(weight * vector.get(term, 0.0) for term, weight in query.items())
+                if similarity >= min_similarity:
+                    scored.append((similarity, i))
+            scored.sort(key=lambda item: (-item[0], item[1]))
+            return [examples[i] for _, i in scored[:count]]
@@ -0,0 +1,167 @@
+import os
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+from suite_runner import SuiteRun
+
+UNITTEST_HEADER = re.compile(r'^(FAIL|ERROR): (\S+)(?: \((.+)\))?$')
+PYTEST_HEADER = re.compile(r'^_{3,} (?:ERROR (?:at \w+ of|collecting) )?(.+?) _{3,}$')
+PYTEST_LOCATION = re.compile(r'^(\S+\.py):(\d+): (\w+)$')
+FRAME = re.compile(r'^\s*File "(.+)", line (\d+), in (\S+)$')
+COMPARISON = re.compile(r'^(?:\w+ differ: )?(.+?) != (.+)$')
+PYTEST_COMPARISON = re.compile(r'^assert (.+?) == (.+)$')
+LIBRARY_PATH_PARTS = (f'{os.sep}unittest{os.sep}', 'site-packages', f'{os.sep}lib{os.sep}python')
+
+
+@dataclass
+class Failure:
+    """
+    A compact description of a failing test.
+
+    Attributes:
+        test_id: The id of the failing test.
+        kind: 'failure' for a failed assertion, or 'error' for an unexpected exception.
+        message: The last line of the traceback, e.g. `AssertionError: 3 != 4`.
+        expected: The expected value of a failed equality assertion, if one was identified.
+        actual: The actual value of a failed equality assertion, if one was identified.
+        frame: The most relevant line of the traceback, which is the deepest frame outside of the standard library.
+    """
+    test_id: str
+    kind: str
+    message: str
+    expected: Optional[str] = None
+    actual: Optional[str] = None
+    frame: Optional[str] = None
+
+
+def _is_library_frame(file_name: str) -> bool:
+    return any(part in file_name for part in LIBRARY_PATH_PARTS)
+
+
+def _relevant_frame(lines: list[str]) -> Optional[str]:
+    frame = None
+    for i, line in enumerate(lines):
+        match = FRAME.match(line)
+        if not match or _is_library_frame(match.group(1)):
+            continue
+
+        file_name, line_number, function = match.groups()
+        frame = f'{os.path.basename(file_name)}:{line_number} in {function}'
+        if i + 1 < len(lines) and not FRAME.match(lines[i + 1]) and lines[i + 1].startswith('    '):
+            frame += f': {lines[i + 1].strip()}'
+    return frame
+
+
+def _exception_message(lines: list[str]) -> str:
+    # With chained exceptions, the one that failed the test follows the last traceback header
+    start = max((i for i, line in enumerate(lines) if line.startswith('Traceback (most recent call last)')), default=-1)
+    for i in range(start + 1, len(lines)):
+        if lines[i] and not lines[i].startswith(' '):
+            return '\n'.join(lines[i:]).strip()
+    return '\n'.join(lines).strip()
+
+
+def _with_comparison(failure: Failure, assertion: str, pattern: re.Pattern) -> Failure:
+    match = pattern.match(assertion.splitlines()[0] if assertion else '')
+    if match:
+        # Generated tests follow the assertEqual(actual, expected) convention
+        failure.actual, failure.expected = match.group(1).strip(), match.group(2).strip()
+    return failure
+
+
+def failure_from_traceback(test_id: str, kind: str, traceback_text: str) -> Failure:
+    lines = traceback_text.rstrip().splitlines()
+    message = _exception_message(lines)
+    failure = Failure(test_id=test_id, kind=kind, message=message.splitlines()[0] if message else '',
+                      frame=_relevant_frame(lines))
+    if message.startswith('AssertionError: '):
+        return _with_comparison(failure, message[len('AssertionError: '):], COMPARISON)
+    return failure
+
+
+def failures_from_suite_run(suite_run: SuiteRun) -> list[Failure]:
+    return [
+        failure_from_traceback(case.name, 'failure' if case.status == 'failed' else 'error', case.traceback or '')
+        for case in suite_run.failed_cases
+    ]
+
+
+def parse_unittest_output(output: str) -> list[Failure]:
+    failures = []
+    sections = re.split(r'^={70}$', output, flags=re.MULTILINE)[1:]
+    for section in sections:
+        lines = section.strip('\n').splitlines()
+        header = UNITTEST_HEADER.match(lines[0]) if lines else None
+        if not header:
+            continue
+
+        kind, name, location = header.groups()
+        if location is None:
+            test_id = name
+        elif location.endswith(f'.{name}'):
+            test_id = location
+        else:
+            test_id = f'{location}.{name}'
+
+        body = '\n'.join(lines[2:])
+        body = re.split(r'^-{70}$', body, flags=re.MULTILINE)[0]
+        failures.append(failure_from_traceback(test_id, 'failure' if kind == 'FAIL' else 'error', body))
+    return failures
+
+
+def parse_pytest_output(output: str) -> list[Failure]:
+    failures = []
+    test_id = None
+    section: list[str] = []
+    for line in output.splitlines() + ['_____ end _____']:
+        header = PYTEST_HEADER.match(line)
+        if not header and not line.startswith('=' * 10):
+            section.append(line)
+            continue
+
+        if test_id is not None:
+            failures.append(_pytest_failure(test_id, section))
+        test_id = header.group(1) if header else None
+        section = []
+    return failures
+
+
+def _pytest_failure(test_id: str, lines: list[str]) -> Failure:
+    error_lines = [line[1:].strip() for line in lines if line.startswith('E ')]
+    locations = [PYTEST_LOCATION.match(line) for line in lines]
+    locations = [location for location in locations if location]
+
+    frame = None
+    kind = 'error'
+    if locations:
+        file_name, line_number, exception_type = locations[-1].groups()
+        frame = f'{os.path.basename(file_name)}:{line_number}'
+        kind = 'failure' if exception_type == 'AssertionError' else 'error'
+
+    message = error_lines[0] if error_lines else ''
+    failure = Failure(test_id=test_id, kind=kind, message=message, frame=frame)
+    if message.startswith('AssertionError: '):
+        return _with_comparison(failure, message[len('AssertionError: '):], COMPARISON)
+    return _with_comparison(failure, message, PYTEST_COMPARISON)
+
+
+def parse_test_output(output: str) -> list[Failure]:
+    """
+    Parses the output of a unittest or pytest run, and extracts a Failure for every failing test.
+    """
+    if re.search(r'^={70}\n(FAIL|ERROR): ', output, flags=re.MULTILINE):
+        return parse_unittest_output(output)
+    return parse_pytest_output(output)
+
+
+def format_report(failures: list[Failure]) -> str:
+    lines = []
+    for i, failure in enumerate(failures, start=1):
+        verb = 'failed' if failure.kind == 'failure' else 'raised an error'
+        lines.append(f'{i}. {failure.test_id} {verb}: {failure.message}')
+        if failure.expected is not None:
+            lines.append(f'   expected: {failure.expected}, actual: {failure.actual}')
+        if failure.frame:
+            lines.append(f'   at {failure.frame}')
+    return '\n'.join(lines)
@@ -1,30 +1,88 @@
-import subprocess
+import difflib
+import glob
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Union
 
 import rich
-from pygments import highlight
-from pygments.formatters.terminal import TerminalFormatter
-from pygments.lexers.python import PythonLexer
-from rich.prompt import Prompt
+from rich.markup import escape
 
 import markdown_parser
-from chat import ChatMessage, Chat
+from approvals import ApprovalPolicy, HumanApproval
+from chat import ChatHistory, ChatMessage, Chat
+from checkpoint import Checkpoint
 from common import BOT_PREFIX
+from failure_report import failures_from_suite_run, format_report
+from instrumentation import propagate
+from patcher import PatchError, apply_reply, validate
+from preflight import check_module
+from suite_runner import SuiteRun, SuiteWorker, run_unit_tests
+from terminal import print_code
+
+
+@dataclass
+class FixResult:
+    passed: bool
+    attempts: int
+
+
+def evaluate_candidate(work_dir: str, module_file_name: str, test_module_file_name: str, code: str,
+                       python: str = sys.executable) -> SuiteRun:
+    with tempfile.TemporaryDirectory() as candidate_dir:
+        for file_name in glob.glob(os.path.join(work_dir, '*.py')):
+            shutil.copy(file_name, candidate_dir)
+
+        with open(os.path.join(candidate_dir, module_file_name), 'w') as f:
+            f.write(code)
+
+        return run_unit_tests(test_module_file_name, cwd=candidate_dir, python=python)
 
 
 class Fixer:
-    def __init__(self, module_name: str, max_tries: int = 3):
+    """
+    Runs the unit tests of a module, and asks the model to fix the module until they pass, or max_tries is reached.
+
+    By default the model replies with the whole fixed module. With patches, it replies with only the functions and
+    classes it changed (or a unified diff), which are applied to the module as it is on disk, so the completions are
+    shorter and edits made to other parts of the module are kept. A fix that is not valid python, or could not be
+    applied, is sent back to the model without running the tests.
+    The module is checked before every test run, and a module that can not be imported, e.g. because of an import
+    that does not resolve, fails without running the tests.
+    """
+
+    def __init__(self, module_name: str, max_tries: int = 3, work_dir: str = '.',
+                 approval: Optional[ApprovalPolicy] = None, candidates: int = 1, llm_summary: bool = False,
+                 checkpoint: Optional[Checkpoint] = None, python: str = sys.executable, test_shards: int = 1,
+                 patches: bool = False):
         self.module_name = module_name
+        self.work_dir = work_dir
+        self.approval = approval or HumanApproval()
+        self.candidates = candidates
+        self.llm_summary = llm_summary
+        self.checkpoint = checkpoint
+        self.chat_history: Optional[ChatHistory] = None
+        self.python = python
+        self.patches = patches
+        self.suite_worker = SuiteWorker(work_dir, python, shards=test_shards)
+        self.failing_tests: list[str] = []
+        self.human_edits: Optional[str] = None
         self.module_content: str = self._load_content(f'{module_name}.py')
         self.test_module_file_name = f'test_{module_name}.py'
         self.module_tests_content: str = self._load_content(self.test_module_file_name)
         self.max_tries = max_tries
 
-    @staticmethod
-    def _load_content(file_name: str) -> str:
-        with open(file_name, 'r') as f:
+    def _load_content(self, file_name: str) -> str:
+        with open(os.path.join(self.work_dir, file_name), 'r') as f:
             return f.read()
 
-    def _create_chat(self, stderr: str):
+    def _wait_for_user(self, message: str) -> None:
+        self.approval.proceed('fix', message)
+
+    def _create_chat(self, failure_report: str):
         prompt = f'''
         Below, you are given the contents of a python module and the contents of the unit tests for that module.
 
@@ -38,72 +96,210 @@ class Fixer:
         {self.module_tests_content}
         ```
 
-        The unit tests are failing with the following message: {stderr}
+        The unit tests are failing:
+        {failure_report}
 
         Fix the module so that the unit tests will pass. 
         The unit tests are the ultimate source of truth, do not try to change them!
 
-        Provide code only without explanations:
-        ```python
-        <fixed code>
-        ```
+        {self._reply_format()}
         '''
 
         return Chat(messages=[
             ChatMessage.of_system('You are an experienced python software engineer.'),
             ChatMessage.of_user(prompt)
-        ])
+        ], stage='fix', fit_context=True, patches=self.patches)
+
+    def _reply_format(self) -> str:
+        if self.patches:
+            return '''Provide only the functions and classes you change, complete and without explanations:
+        ```python
+        <changed functions and classes>
+        ```'''
+        return '''Provide code only without explanations:
+        ```python
+        <fixed code>
+        ```'''
 
-    def run_tests_and_fix_if_needed(self):
+    def _fixed_module(self, reply: str) -> str:
+        """
+        The module with the fix of the reply applied. Raises a PatchError if the fix could not be applied, or is not
+        valid python.
+        """
+        file_name = f'{self.module_name}.py'
+        if self.patches:
+            return apply_reply(self._load_content(file_name), reply, file_name)
+
+        block = markdown_parser.first_code_block(reply, 'python')
+        fixed_module = block.code if block else reply
+        validate(fixed_module, file_name)
+        return fixed_module
+
+    def _invalid_fix(self, error: PatchError) -> SuiteRun:
+        # Reported like a test run, so the fix loop sends the error back to the model
+        rich.print(f'{BOT_PREFIX} The fix could not be used, the tests were not run: {escape(str(error))}')
+        return SuiteRun.of_crash(f'{self.module_name}.py', f'{type(error).__name__}: {error}')
+
+    def run_tests_and_fix_if_needed(self) -> FixResult:
+        try:
+            return self._run_tests_and_fix_if_needed()
+        finally:
+            self.suite_worker.close()
+
+    def _run_tests_and_fix_if_needed(self) -> FixResult:
         output = self.run_unit_tests()
-        if output.returncode == 0:
+        if output.passed:
             rich.print(f'{BOT_PREFIX} All unit tests are passing.')
-            return
+            return FixResult(passed=True, attempts=0)
 
-        stderr_summary = self.summarize_stderr(output.stderr)
         rich.print(f'{BOT_PREFIX} There are failing unit tests.')
         rich.print(f'{BOT_PREFIX} Here is a summary of the failures:')
-        rich.print(f'{stderr_summary}')
-        Prompt.ask(
+        rich.print(escape(self.describe_failures(output)))
+        self._wait_for_user(
             f'{BOT_PREFIX} I will try to fix the module. Please review the unit tests and press Enter when I can start')
 
-        self.try_to_fix(output.stderr)
+        restored = self._restore_chat()
+        if restored is not None:
+            chat, attempt = restored
+            rich.print(f'{BOT_PREFIX} Continuing the fix from attempt {attempt + 1}/{self.max_tries}.')
+            return self._fix(chat, first_attempt=attempt + 1)
+        return self.try_to_fix(format_report(failures_from_suite_run(output)))
+
+    def _restore_chat(self) -> Optional[tuple[Chat, int]]:
+        if self.checkpoint is None:
+            return None
+        chat_history = self.checkpoint.chat_history('fix')
+        attempt = self.checkpoint.progress('fix').get('attempt')
+        if chat_history is None or attempt is None:
+            return None
+
+        chat = self._create_chat(failure_report='')
+        chat.chat_history = chat_history
+        # Every attempt so far failed, so the resumed chat escalates as far as the interrupted one did
+        chat.failures = attempt
+        return chat, attempt
+
+    def _preflight(self, code: str) -> Optional[SuiteRun]:
+        """
+        A failed run reporting the problems that keep the module from being imported, which are found without running
+        the tests, or None if there are none.
+        """
+        problems = [problem for problem in check_module(code, work_dir=self.work_dir, python=self.python)
+                    if problem.fatal]
+        if not problems:
+            return None
+        return SuiteRun.of_crash(f'{self.module_name}.py', f'PreflightError: {"; ".join(map(str, problems))}')
+
+    def run_unit_tests(self) -> SuiteRun:
+        output = self._preflight(self._load_content(f'{self.module_name}.py'))
+        if output is None:
+            # Tests that failed before run first, so a fix that does not help is detected quickly
+            output = self.suite_worker.run(self.test_module_file_name, priority=self.failing_tests)
+        self._remember_failing_tests(output)
+        return output
+
+    def _remember_failing_tests(self, output: SuiteRun) -> None:
+        ran = {case.name for case in output.cases}
+        self.failing_tests = [case.name for case in output.failed_cases] + [
+            name for name in self.failing_tests if name not in ran
+        ]
 
-    def run_unit_tests(self):
-        return subprocess.run(
-            ['python', '-m', 'unittest', self.test_module_file_name],
-            capture_output=True,
-            text=True
-        )
+    def _write_module(self, code: str) -> None:
+        with open(os.path.join(self.work_dir, f'{self.module_name}.py'), 'w') as f:
+            f.write(code)
 
-    def try_to_fix(self, stderr: str):
-        chat = self._create_chat(stderr)
-        for i in range(1, self.max_tries):
-            chat_history = chat.run()
-            response = chat_history.last_assistant_reply()
-            fixed_module = markdown_parser.parse_code_blocks(response)[0].code
+    def _fix_once(self, chat: Chat) -> SuiteRun:
+        chat_history = chat.run()
+        try:
+            fixed_module = self._fixed_module(chat_history.last_assistant_reply())
+        except PatchError as e:
+            return self._invalid_fix(e)
 
-            rich.print(f'{BOT_PREFIX} I changed the code to this:')
-            print(highlight(fixed_module, PythonLexer(), TerminalFormatter()))
+        rich.print(f'{BOT_PREFIX} I changed the code to this:')
+        print_code(fixed_module)
+        self._write_module(fixed_module)
 
-            with open(f'{self.module_name}.py', 'w') as f:
-                f.write(fixed_module)
+        self._wait_for_user(f'{BOT_PREFIX} Press Enter when you are ready from me to run the tests again')
+        self.human_edits = self._diff_from_written(fixed_module)
+        return self.run_unit_tests()
 
-            Prompt.ask(f'{BOT_PREFIX} Press Enter when you are ready from me to run the tests again')
-            output = self.run_unit_tests()
-            if output.returncode == 0:
+    def _diff_from_written(self, written: str) -> Optional[str]:
+        # The user may edit the module before the tests run, and the model should know about it
+        current = self._load_content(f'{self.module_name}.py')
+        if current == written:
+            return None
+        return ''.join(difflib.unified_diff(written.splitlines(keepends=True), current.splitlines(keepends=True),
+                                            f'{self.module_name}.py (yours)', f'{self.module_name}.py (edited)'))
+
+    def _fix_with_candidates(self, chat: Chat) -> SuiteRun:
+        replies = chat.run_candidates(self.candidates)
+        fixed_modules: list[Union[str, PatchError]] = []
+        for reply in replies:
+            try:
+                fixed_modules.append(self._fixed_module(reply))
+            except PatchError as e:
+                fixed_modules.append(e)
+
+        def evaluate(fixed_module: Union[str, PatchError]) -> SuiteRun:
+            if isinstance(fixed_module, PatchError):
+                return SuiteRun.of_crash(f'{self.module_name}.py', f'{type(fixed_module).__name__}: {fixed_module}')
+            preflight = self._preflight(fixed_module)
+            if preflight is not None:
+                return preflight
+            return evaluate_candidate(self.work_dir, f'{self.module_name}.py', self.test_module_file_name,
+                                      fixed_module, self.python)
+
+        rich.print(f'{BOT_PREFIX} I wrote {len(fixed_modules)} candidate fixes, running the tests on each of them.')
+        # The tests run in subprocesses, so threads are enough to evaluate the candidates in parallel
+        with ThreadPoolExecutor(max_workers=len(fixed_modules)) as executor:
+            outputs = list(executor.map(propagate(evaluate), fixed_modules))
+
+        best = max(range(len(outputs)), key=lambda i: (outputs[i].passed, outputs[i].passing))
+        chat.chat_history.append_message(ChatMessage.of_assistant(replies[best]))
+        if isinstance(fixed_modules[best], PatchError):
+            return self._invalid_fix(fixed_modules[best])
+
+        rich.print(f'{BOT_PREFIX} Candidate {best + 1} passes {outputs[best].passing}/{outputs[best].tests_run} '
+                   f'tests. I changed the code to this:')
+        print_code(fixed_modules[best])
+        self._write_module(fixed_modules[best])
+        self._remember_failing_tests(outputs[best])
+        return outputs[best]
+
+    def try_to_fix(self, failure_report: str) -> FixResult:
+        return self._fix(self._create_chat(failure_report), first_attempt=1)
+
+    def _fix(self, chat: Chat, first_attempt: int) -> FixResult:
+        self.chat_history = chat.chat_history
+        for i in range(first_attempt, self.max_tries):
+            output = self._fix_with_candidates(chat) if self.candidates > 1 else self._fix_once(chat)
+            if output.passed:
                 rich.print(f'{BOT_PREFIX} I fixed the module. All unit tests are now passing.')
-                return
+                return FixResult(passed=True, attempts=i)
 
-            chat_history.append_message(ChatMessage.of_user(
-                f'The tests still fail after the changes you made. This is the stderr:\n {output.stderr}'))
+            report = format_report(failures_from_suite_run(output))
+            follow_up = f'The tests still fail after the changes you made:\n{report}'
+            if self.human_edits:
+                follow_up = f'I edited your code before running the tests:\n```diff\n{self.human_edits}```\n{follow_up}'
+                self.human_edits = None
+            chat.chat_history.append_message(ChatMessage.of_user(follow_up))
+            # The next attempt goes to a stronger model, if the fix stage has one
+            chat.escalate()
+            if self.checkpoint is not None:
+                self.checkpoint.record_progress('fix', chat.chat_history, attempt=i)
 
             rich.print(f'''{BOT_PREFIX} Fix attempt {i}/{self.max_tries} has failed.
 Here is a summary of the reasons: 
-{self.summarize_stderr(output.stderr)}''')
+{escape(self.describe_failures(output))}''')
         rich.print(
             f"{BOT_PREFIX} Fix attempt {self.max_tries}/{self.max_tries} has failed.")
         rich.print(f"{BOT_PREFIX} Sorry, I can't fix the module. Make sure the tests are correct.")
+        return FixResult(passed=False, attempts=self.max_tries)
+
+    def describe_failures(self, output: SuiteRun) -> str:
+        if self.llm_summary:
+            return self.summarize_stderr(output.stderr)
+        return format_report(failures_from_suite_run(output))
 
     def summarize_stderr(self, stderr: str) -> str:
         prompt = f'''
@@ -133,4 +329,4 @@ Here is a summary of the reasons:
         return Chat(messages=[
             ChatMessage.of_system('You are an experienced python software engineer.'),
             ChatMessage.of_user(prompt)
-        ]).run().last_assistant_reply()
+        ], stage='summarize').run().last_assistant_reply()
@@ -1,45 +1,78 @@
-import subprocess
+import sys
+import textwrap
+from dataclasses import dataclass
+from typing import Optional
 
 import rich
-import rich.prompt
-import yaml
-from pygments import highlight
-from pygments.formatters.terminal import TerminalFormatter
-from pygments.lexers.python import PythonLexer
+from rich.markup import escape
 
-import markdown_parser
+from approvals import ApprovalPolicy, HumanApproval
 from chat import ChatMessage, ChatWithCallback
-from common import ModuleDetails, BOT_PREFIX
+from common import ModuleDetails, BOT_PREFIX, format_apis
+from examples import Example, implementation_yaml
+from preflight import PreflightError, Problem, check_module, format_problems
+from replies import IMPLEMENTATION_SCHEMA, parse_reply
+from terminal import print_code
 
 
-def parse_and_print(content: str) -> str:
-    blocks = markdown_parser.parse_code_blocks(content)
-    block = blocks[0].code if len(blocks) > 0 else content
-    yaml_data = yaml.safe_load(block)
-    code = yaml_data['code']
+@dataclass
+class Implementation:
+    code: str
+    dependencies: list[str]
+
+
+def parse_and_print(content: str) -> Implementation:
+    values = parse_reply(content, IMPLEMENTATION_SCHEMA)
+    code = values['code']
 
     rich.print(f'{BOT_PREFIX} Here is the implementation for the api we defined.')
-    print(highlight(code, PythonLexer(), TerminalFormatter()))
+    print_code(code)
 
-    dependencies = yaml_data['dependencies']
-    if dependencies and len(dependencies) > 0:
+    dependencies = values['dependencies']
+    if len(dependencies) > 0:
         rich.print(f'\n{BOT_PREFIX} You will need to install the following packages:')
         for dep in dependencies:
             rich.print(f'- {dep}')
 
-        confirm = rich.prompt.Confirm.ask(f'{BOT_PREFIX} Do you want me to install them for you?')
+    return Implementation(code, dependencies)
+
 
-        if confirm:
-            for dep in dependencies:
-                rich.print(f'{BOT_PREFIX} Installing {dep}')
-                subprocess.run(['pip', 'install', dep])
+def format_examples(examples: list[Example]) -> str:
+    if not examples:
+        return ''
+    sections = [f'Example api:\n{example.module.api.strip()}\n\nExample response:\n```yaml\n'
+                f'{implementation_yaml(example.code, example.dependencies)}\n```' for example in examples]
+    text = 'Here is how similar modules were implemented before.\n\n' + '\n\n'.join(sections)
+    # The prompt is indented, and so must the examples be, beyond their first line
+    return textwrap.indent(text, ' ' * 8)[8:] + '\n\n' + ' ' * 8
 
-    return code
+
+def format_requires(modules: list[ModuleDetails]) -> str:
+    if not modules:
+        return ''
+    text = 'The module can import these modules of its package, which are already implemented:\n\n'
+    text += format_apis(modules)
+    return textwrap.indent(text, ' ' * 8)[8:] + '\n\n' + ' ' * 8
 
 
 class Implementor:
-    def __init__(self, module: ModuleDetails):
+    """
+    Implements a module from its api. The prompt shows the model the examples given, e.g. the modules implemented for
+    the most similar requirements in previous runs, and the apis of the modules of its package that it requires.
+
+    Every implementation is checked without running it (see preflight.check_module), against the api. With an
+    approval policy that checks replies, the problems found are sent back to the model, otherwise they are only shown.
+    """
+
+    def __init__(self, module: ModuleDetails, approval: Optional[ApprovalPolicy] = None,
+                 examples: Optional[list[Example]] = None, work_dir: str = '.',
+                 requires: Optional[list[ModuleDetails]] = None):
         self.module: ModuleDetails = module
+        self.approval = approval or HumanApproval()
+        self.examples = examples or []
+        self.requires = requires or []
+        self.work_dir = work_dir
+        self.dependencies: list[str] = []
         self.implement_and_review_chat: ChatWithCallback = self._create_implement_and_review_chat()
 
     def _create_implement_and_review_chat(self):
@@ -51,7 +84,7 @@ class Implementor:
         - If only standard library packages are needed, no need to specify anything in the `dependencies`.
         - Reply only with a valid yaml.
 
-        Module name: {self.module.name}
+        {format_examples(self.examples)}{format_requires(self.requires)}Module name: {self.module.name}
         Module description: {self.module.description}
         Module api: {self.module.api}
         
@@ -66,10 +99,31 @@ class Implementor:
         ```
         '''
 
-        return ChatWithCallback(callback=parse_and_print, messages=[
+        return ChatWithCallback(callback=self._parse, messages=[
             ChatMessage.of_system('You are an experienced python software engineer.'),
             ChatMessage.of_user(prompt)
-        ])
+        ], stream=True, language='yaml', approval=self.approval, stage='implement', check=self._check)
+
+    def _problems(self, implementation: Implementation) -> list[Problem]:
+        # The dependencies are installed after the implementation, so the imports are checked against them
+        return check_module(implementation.code, api=self.module.api, work_dir=self.work_dir, python=sys.executable,
+                            dependencies=implementation.dependencies)
+
+    def _parse(self, content: str) -> Implementation:
+        implementation = parse_and_print(content)
+        if not self.approval.checks_replies:
+            problems = self._problems(implementation)
+            if problems:
+                rich.print(f'{BOT_PREFIX} I found these problems in the implementation:')
+                rich.print(escape(format_problems(problems)))
+        return implementation
+
+    def _check(self, implementation: Implementation) -> None:
+        problems = self._problems(implementation)
+        if problems:
+            raise PreflightError(problems)
 
     def implement(self) -> str:
-        return self.implement_and_review_chat.run()
+        implementation = self.implement_and_review_chat.run()
+        self.dependencies = implementation.dependencies
+        return implementation.code
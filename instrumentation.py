@@ -0,0 +1,198 @@
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Iterator
+
+from tokens import cost
+
+STAGE = 'stage'
+LLM = 'llm'
+TESTS = 'tests'
+HUMAN = 'human'
+
+# Attributes of every span started within Tracer.labeled, e.g. the job a service runs the span for
+_labels: contextvars.ContextVar[dict] = contextvars.ContextVar('labels', default={})
+
+
+def propagate(function: Callable) -> Callable:
+    """
+    Wraps function to run with the labels of the calling thread, when it is called in another thread, e.g. by an
+    executor.
+    """
+    context = contextvars.copy_context()
+    # Every call gets its own copy, as a context can not be entered by two threads at once
+    return lambda *args, **kwargs: context.copy().run(function, *args, **kwargs)
+
+
+@dataclass
+class Span:
+    """
+    A timed section of a run.
+
+    Attributes:
+        name: What was timed, e.g. a pipeline stage or a chat stage.
+        category: One of 'stage', 'llm', 'tests' or 'human'. Human spans are time spent waiting for the user.
+        start: Seconds since the tracer was created.
+        duration: Seconds.
+        thread: The name of the thread the span ran in.
+        attributes: Details such as tokens, retries and cache hits of a completion.
+    """
+    name: str
+    category: str
+    start: float
+    duration: float
+    thread: str
+    attributes: dict = field(default_factory=dict)
+
+    @property
+    def end(self) -> float:
+        return self.start + self.duration
+
+
+class Tracer:
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, category: str, **attributes) -> Iterator[dict]:
+        """
+        Times the body of the with statement. The yielded attributes can be updated within the body.
+        """
+        attributes = {**_labels.get(), **attributes}
+        start = time.perf_counter()
+        try:
+            yield attributes
+        finally:
+            end = time.perf_counter()
+            span = Span(name, category, start - self.origin, end - start, threading.current_thread().name, attributes)
+            with self._lock:
+                self.spans.append(span)
+
+    @contextmanager
+    def labeled(self, **labels) -> Iterator[None]:
+        """
+        Adds labels to the attributes of the spans started within the with statement, including the ones started by
+        functions wrapped with propagate.
+        """
+        token = _labels.set({**_labels.get(), **labels})
+        try:
+            yield
+        finally:
+            _labels.reset(token)
+
+    def take(self, **labels) -> list[Span]:
+        """
+        Removes the spans with all the labels given, and returns them, so a long running process keeps only the spans
+        it still needs.
+        """
+        taken, kept = [], []
+        with self._lock:
+            for span in self.spans:
+                labeled = all(span.attributes.get(name) == value for name, value in labels.items())
+                (taken if labeled else kept).append(span)
+            self.spans = kept
+        return taken
+
+    def human_wait(self, name: str):
+        return self.span(name, HUMAN)
+
+    def _spans(self, category: str) -> list[Span]:
+        with self._lock:
+            return [span for span in self.spans if span.category == category]
+
+    def human_time_within(self, outer: Span) -> float:
+        return sum(
+            span.duration for span in self._spans(HUMAN)
+            if span.thread == outer.thread and outer.start <= span.start and span.end <= outer.end
+        )
+
+    def export_chrome_trace(self, file_name: str) -> None:
+        """
+        Writes the spans in the Chrome trace event format, which chrome://tracing and Perfetto can open.
+        """
+        with self._lock:
+            spans = list(self.spans)
+
+        thread_ids = {}
+        events = []
+        for span in spans:
+            thread_id = thread_ids.setdefault(span.thread, len(thread_ids) + 1)
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': span.start * 1_000_000,
+                'dur': span.duration * 1_000_000,
+                'pid': 1,
+                'tid': thread_id,
+                'args': span.attributes,
+            })
+        for thread, thread_id in thread_ids.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': thread_id, 'args': {'name': thread}})
+
+        with open(file_name, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def export_json(self, file_name: str) -> None:
+        with self._lock:
+            spans = [asdict(span) for span in self.spans]
+        with open(file_name, 'w') as f:
+            json.dump({'spans': spans}, f, indent=2)
+
+    def stage_summary(self) -> list[dict]:
+        rows = {}
+        for span in self._spans(STAGE):
+            row = rows.setdefault(span.name, {'stage': span.name, 'runs': 0, 'wall': 0.0, 'human': 0.0})
+            row['runs'] += 1
+            row['wall'] += span.duration
+            row['human'] += self.human_time_within(span)
+        for row in rows.values():
+            row['machine'] = row['wall'] - row['human']
+        return list(rows.values())
+
+    def llm_summary(self) -> list[dict]:
+        rows = {}
+        for span in self._spans(LLM):
+            row = rows.setdefault(span.name, {'stage': span.name, 'calls': 0, 'cache_hits': 0, 'retries': 0,
+                                              'latency': 0.0, 'prompt_tokens': 0, 'completion_tokens': 0})
+            row['calls'] += 1
+            row['latency'] += span.duration
+            row['cache_hits'] += 1 if span.attributes.get('cache_hit') else 0
+            for key in ['retries', 'prompt_tokens', 'completion_tokens']:
+                row[key] += span.attributes.get(key, 0)
+        return list(rows.values())
+
+    def model_summary(self) -> list[dict]:
+        """
+        The completions per model, with their latency, tokens and cost (None if the prices of the model are unknown),
+        to compare the models that the stages are routed to.
+        """
+        rows = {}
+        for span in self._spans(LLM):
+            model = span.attributes.get('model', 'unknown')
+            row = rows.setdefault(model, {'model': model, 'calls': 0, 'cache_hits': 0, 'latency': 0.0,
+                                          'prompt_tokens': 0, 'completion_tokens': 0, 'cost': 0.0})
+            row['calls'] += 1
+            row['latency'] += span.duration
+            row['cache_hits'] += 1 if span.attributes.get('cache_hit') else 0
+            for key in ['prompt_tokens', 'completion_tokens']:
+                row[key] += span.attributes.get(key, 0)
+        for row in rows.values():
+            row['cost'] = cost(row['model'], row['prompt_tokens'], row['completion_tokens'])
+        return list(rows.values())
+
+    def tests_summary(self) -> dict:
+        spans = self._spans(TESTS)
+        return {
+            'runs': len(spans),
+            'duration': sum(span.duration for span in spans),
+            'tests': sum(span.attributes.get('tests_run', 0) for span in spans),
+        }
+
+
+tracer = Tracer()
@@ -1,6 +1,14 @@
+import io
 import re
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Callable, Iterator, List, Optional
+
+# A fence that starts a line, with any info string after it, e.g. ```python or ~~~~ {.python title="x"}
+OPENING_FENCE = re.compile(r'^(\s*)(`{3,}|~{3,})(.*)$')
+# A fence at the end of a line of text, e.g. "Here it is: ```python", which only takes a language
+TRAILING_FENCE = re.compile(r'(?<![`~])(`{3,}|~{3,})([\w+#.-]*)[ \t]*$')
+LANGUAGE_ALIASES = {'py': 'python', 'py3': 'python', 'python3': 'python', 'yml': 'yaml', 'sh': 'bash',
+                    'shell': 'bash', 'js': 'javascript', 'patch': 'diff'}
 
 
 @dataclass
@@ -15,21 +23,205 @@ class CodeBlock:
     language: Optional[str]
     code: str
 
+    def has_language(self, language: str) -> bool:
+        """
+        Whether the block is in language, or in one of its aliases, e.g. py or python3 for python.
+        """
+        return self.language is not None and _normalized(self.language) == _normalized(language)
+
+
+def _normalized(language: str) -> str:
+    language = language.lower()
+    return LANGUAGE_ALIASES.get(language, language)
+
+
+def _language(info: str) -> Optional[str]:
+    # The first word of the info string, e.g. python for `python3 title="x"` or `{.python}`
+    words = info.split()
+    language = words[0].strip('{}.') if words else ''
+    return language or None
+
+
+class _FenceScanner:
+    """
+    A state machine over the lines of a markdown text, which finds its code blocks in a single pass.
+
+    A block is opened by a fence of three or more backticks or tildes and closed by a line that starts with at least as
+    many of the same character, so that blocks fenced with e.g. ```` or ~~~ can contain ``` blocks. The lines of a
+    block are kept as is, except for the indentation of its opening fence.
+    """
+
+    def __init__(self):
+        self.fence: Optional[str] = None
+        self.indent = 0
+        self.language: Optional[str] = None
+        self.lines: List[str] = []
+
+    @property
+    def in_block(self) -> bool:
+        return self.fence is not None
+
+    def closes(self, line: str) -> bool:
+        return self.fence is not None and line.lstrip().startswith(self.fence)
+
+    def line(self, line: str) -> Optional[CodeBlock]:
+        """
+        Scans the next line, without its line break, and returns the code block it closes, if it closes one.
+        """
+        if self.fence is None:
+            self._open(line)
+            return None
+        if not self.closes(line):
+            self.lines.append(self._dedented(line))
+            return None
+
+        code = '\n'.join(self.lines)
+        block = CodeBlock(self.language, code)
+        self.fence, self.language, self.lines = None, None, []
+        # Empty blocks carry nothing for the callers, which take the first block of a reply
+        return block if code else None
+
+    def _open(self, line: str) -> None:
+        opening = OPENING_FENCE.match(line)
+        if opening and not (opening.group(2)[0] == '`' and '`' in opening.group(3)):
+            indent, self.fence, info = opening.groups()
+            self.indent = len(indent)
+            self.language = _language(info)
+            return
+        trailing = TRAILING_FENCE.search(line)
+        if trailing:
+            self.fence, language = trailing.groups()
+            self.indent = 0
+            self.language = language or None
+
+    def _dedented(self, line: str) -> str:
+        stripped = line.lstrip(' ')
+        return line[min(self.indent, len(line) - len(stripped)):]
+
+
+def _lines(markdown_text: str) -> Iterator[str]:
+    # Reading the lines of a stream, rather than splitting the text, keeps one line in memory at a time
+    for line in io.StringIO(markdown_text, newline='\n'):
+        yield line.rstrip('\r\n')
+
+
+def _matches(block: CodeBlock, language: Optional[str]) -> bool:
+    return language is None or block.has_language(language)
+
+
+def iter_code_blocks(markdown_text: str, language: Optional[str] = None) -> Iterator[CodeBlock]:
+    """
+    Yields the code blocks of a markdown text as they are found, in a single pass over its lines.
+
+    Args:
+        markdown_text: a string containing markdown that may or may not contain code blocks.
+        language: Only yield the blocks in this language (see CodeBlock.has_language).
+    """
+    scanner = _FenceScanner()
+    for line in _lines(markdown_text):
+        block = scanner.line(line)
+        if block is not None and _matches(block, language):
+            yield block
+
 
-def parse_code_blocks(markdown_text: str) -> List[CodeBlock]:
+def parse_code_blocks(markdown_text: str, language: Optional[str] = None) -> List[CodeBlock]:
     """
     Parses a markdown text and extracts all the code blocks found in it.
 
     Args:
         markdown_text: a string containing markdown that may or may not contain code blocks.
+        language: Only return the blocks in this language (see CodeBlock.has_language).
 
     Returns:
         A list of CodeBlock objects representing all the identified code blocks in the markdown text. If no code blocks
-        were found, return an empty list.
-    """
-    code_blocks = []
-    pattern = re.compile(r"```(\w+)?\n(.+?)\n```", flags=re.DOTALL | re.MULTILINE)
-    for match in pattern.finditer(markdown_text):
-        language, code = match.groups()
-        code_blocks.append(CodeBlock(language, code))
-    return code_blocks
+        were found, return an empty list. A block that is not closed is not returned.
+    """
+    return list(iter_code_blocks(markdown_text, language))
+
+
+def first_code_block(markdown_text: str, language: Optional[str] = None) -> Optional[CodeBlock]:
+    """
+    The first code block in language, or the first code block of the text if none is, or None if there are none.
+    """
+    first = None
+    for block in iter_code_blocks(markdown_text):
+        if _matches(block, language):
+            return block
+        first = first or block
+    return first
+
+
+def replace_code_blocks(markdown_text: str, replace: Callable[[CodeBlock], str]) -> str:
+    """
+    Replaces the code of every code block in a markdown text with what replace returns for it, keeping the fences and
+    the rest of the text as is.
+    """
+    scanner = _FenceScanner()
+    output: List[str] = []
+    inside: List[str] = []
+    for line in io.StringIO(markdown_text, newline='\n'):
+        was_in_block = scanner.in_block
+        block = scanner.line(line.rstrip('\r\n'))
+        if was_in_block and not scanner.in_block:
+            if block is not None:
+                output.append(replace(block) + '\n')
+            else:
+                output += inside
+            output.append(line)
+            inside = []
+        elif was_in_block:
+            inside.append(line)
+        else:
+            output.append(line)
+    # A block that is not closed is kept as is
+    return ''.join(output + inside)
+
+
+class IncrementalCodeBlockParser:
+    """
+    Parses code blocks out of a markdown text that arrives in chunks, e.g. a streamed completion.
+
+    Code blocks are emitted as soon as their closing fence is seen. Feeding all the chunks yields the same blocks as
+    calling parse_code_blocks on the concatenated text, with the same language. Only the line being received is
+    scanned again when a chunk arrives, so parsing a whole completion takes linear time.
+    """
+
+    def __init__(self, language: Optional[str] = None):
+        self.language = language
+        self.code_blocks: List[CodeBlock] = []
+        self._chunks: List[str] = []
+        self._scanner = _FenceScanner()
+        self._line = ''
+        # Whether the line being received was already scanned, as the closing fence of a block
+        self._scanned = False
+
+    @property
+    def text(self) -> str:
+        return ''.join(self._chunks)
+
+    def feed(self, chunk: str) -> List[CodeBlock]:
+        """
+        Adds a chunk of text to the parser.
+
+        Args:
+            chunk: The next piece of the markdown text.
+
+        Returns:
+            The code blocks in the language of the parser that were completed by this chunk, possibly an empty list.
+        """
+        self._chunks.append(chunk)
+        completed = []
+        *lines, self._line = (self._line + chunk).split('\n')
+        for line in lines:
+            if not self._scanned:
+                completed.append(self._scanner.line(line.rstrip('\r')))
+            self._scanned = False
+
+        # A closing fence is known before its line ends, which is when the callers waiting for a block can stop
+        if not self._scanned and self._scanner.closes(self._line):
+            completed.append(self._scanner.line(self._line))
+            self._scanned = True
+
+        completed = [block for block in completed if block is not None and _matches(block, self.language)]
+        self.code_blocks.extend(completed)
+        return completed
@@ -0,0 +1,294 @@
+import glob
+import os
+import shutil
+import sys
+import tempfile
+from dataclasses import dataclass, field
+from typing import Optional
+
+import rich
+from rich.markup import escape
+
+import markdown_parser
+from approvals import ApprovalPolicy, HumanApproval
+from chat import Chat, ChatMessage, ChatWithCallback
+from common import BOT_PREFIX
+from failure_report import failures_from_suite_run, format_report
+from patcher import PatchError, apply_reply, validate
+from preflight import check_module
+from profiler import PerformanceBudget, Profile, format_profile, measure
+from suite_runner import run_unit_tests
+from terminal import print_code
+
+
+@dataclass
+class OptimizeResult:
+    """
+    status is within_budget if the module was within the budget as it was, optimized if a faster implementation
+    brought it within the budget, over_budget if none did, or not_measured if the benchmarks could not run.
+    """
+    status: str
+    attempts: int = 0
+    violations: list[str] = field(default_factory=list)
+
+
+def parse_and_print(content: str) -> str:
+    block = markdown_parser.first_code_block(content, 'python')
+    if block is None:
+        raise ValueError('The reply has no code block with the benchmarks')
+    code = block.code
+    rich.print(f'{BOT_PREFIX} I wrote some benchmarks to measure the performance of the module.')
+    print_code(code)
+    return code
+
+
+def check_benchmarks_run(work_dir: str, file_name: str, benchmarks: str, python: str = sys.executable,
+                         size: int = 10) -> None:
+    """
+    Runs the benchmarks against the module with small inputs, in a temporary copy of work_dir, and raises a ValueError
+    if any of them failed.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        for source in glob.glob(os.path.join(work_dir, '*.py')):
+            shutil.copy(source, directory)
+        with open(os.path.join(directory, f'bench_{file_name}'), 'w') as f:
+            f.write(benchmarks)
+        profile = measure(f'bench_{file_name}', cwd=directory, python=python, sizes=[size])
+    if profile.errors:
+        raise ValueError('The benchmarks failed:\n' + '\n'.join(profile.errors))
+
+
+class BenchmarkWriter:
+    """
+    Writes the benchmarks of a module, which measure how the time and memory of its functions grow with the size of
+    their inputs (see profiler.measure). Like the unit tests, they are written from the content of the module, or when
+    api is given, from its api.
+    """
+
+    def __init__(self, file_name: str, work_dir: str = '.', approval: Optional[ApprovalPolicy] = None,
+                 api: Optional[str] = None, python: str = sys.executable):
+        self.file_name = file_name
+        self.work_dir = work_dir
+        self.approval = approval or HumanApproval()
+        self.api = api
+        self.python = python
+        self.file_content: str = api if api is not None else self._load_content()
+        self.write_benchmarks_and_review_chat: ChatWithCallback = self._create_write_benchmarks_and_review_chat()
+
+    def _load_content(self) -> str:
+        with open(os.path.join(self.work_dir, self.file_name), 'r') as f:
+            return f.read()
+
+    def _describe_module(self) -> str:
+        if self.api is not None:
+            return 'This is the api of the module, whose implementation is not written yet:'
+        return 'This is the content of the module:'
+
+    def _create_write_benchmarks_and_review_chat(self):
+        prompt = f'''
+        Write a benchmarks file for the module {self.file_name}, which measures how the time its public functions
+        take grows with the size of their inputs.
+        Write a case for every function whose running time depends on the size of its input, and at most 3 cases.
+        Each case must be a pair of functions, with the following structure:
+        ```python
+        def setup_<case_description>(size: int):
+            <Build and return an input of the given size for the function under test, the kind of input it is likely
+            to get, deterministically, e.g. with random.Random(0)>
+
+        def bench_<case_description>(data):
+            <call the function under test with the input>
+        ```
+
+        {self._describe_module()}
+        ```python
+        {self.file_content}
+        ```
+
+        Provide code only without explanations:
+        ```python
+        <benchmarks>
+        ```
+        '''
+
+        return ChatWithCallback(callback=parse_and_print, messages=[
+            ChatMessage.of_system('You are an experienced python software engineer.'),
+            ChatMessage.of_user(prompt)
+        ], stream=True, language='python', approval=self.approval, stage='write_benchmarks',
+            check=lambda benchmarks: check_benchmarks_run(self.work_dir, self.file_name, benchmarks, self.python))
+
+    def write_benchmarks(self) -> str:
+        return self.write_benchmarks_and_review_chat.run()
+
+
+class Optimizer:
+    """
+    Measures the benchmarks of a module, and asks the model for a faster implementation until the module is within
+    the budget, or max_tries is reached.
+
+    A faster implementation only replaces the module if the unit tests of the module still pass with it, and it is
+    faster than the module (see profiler.Profile.faster_than); both are checked in a temporary copy of work_dir. With
+    patches, the model replies with only the functions and classes it changed, like with the Fixer.
+    """
+
+    def __init__(self, module_name: str, budget: Optional[PerformanceBudget] = None, max_tries: int = 3,
+                 work_dir: str = '.', approval: Optional[ApprovalPolicy] = None, python: str = sys.executable,
+                 patches: bool = False):
+        self.module_name = module_name
+        self.budget = budget or PerformanceBudget()
+        self.max_tries = max_tries
+        self.work_dir = work_dir
+        self.approval = approval or HumanApproval()
+        self.python = python
+        self.patches = patches
+        self.module_file_name = f'{module_name}.py'
+        self.test_module_file_name = f'test_{module_name}.py'
+        self.benchmarks_file_name = f'bench_{module_name}.py'
+        self.chat: Optional[Chat] = None
+
+    def _load_content(self, file_name: str) -> str:
+        with open(os.path.join(self.work_dir, file_name), 'r') as f:
+            return f.read()
+
+    def _measure(self, cwd: str) -> Profile:
+        return measure(self.benchmarks_file_name, cwd=cwd, python=self.python, sizes=self.budget.sizes,
+                       max_seconds=self.budget.max_seconds)
+
+    def _create_chat(self, profile: Profile, violations: list[str]) -> Chat:
+        prompt = f'''
+        Below, you are given the contents of a python module, the contents of its unit tests and of its benchmarks.
+
+        The contents of module {self.module_file_name}:
+        ```python
+        {self._load_content(self.module_file_name)}
+        ```
+
+        The contents of the unit tests file {self.test_module_file_name}:
+        ```python
+        {self._load_content(self.test_module_file_name)}
+        ```
+
+        The contents of the benchmarks file {self.benchmarks_file_name}:
+        ```python
+        {self._load_content(self.benchmarks_file_name)}
+        ```
+
+        The module is too slow. These are its measurements:
+        {format_profile(profile)}
+
+        {self._describe_violations(violations)}
+
+        Make the module faster, e.g. with an algorithm or a data structure of a lower complexity, without changing
+        its api. The unit tests must keep passing, do not change them, nor the benchmarks!
+
+        {self._reply_format()}
+        '''
+
+        return Chat(messages=[
+            ChatMessage.of_system('You are an experienced python software engineer.'),
+            ChatMessage.of_user(prompt)
+        ], stage='optimize', fit_context=True, patches=self.patches)
+
+    @staticmethod
+    def _describe_violations(violations: list[str]) -> str:
+        return 'These are over the budget:\n' + '\n'.join(f'- {violation}' for violation in violations)
+
+    def _reply_format(self) -> str:
+        if self.patches:
+            return '''Provide only the functions and classes you change, complete and without explanations:
+        ```python
+        <changed functions and classes>
+        ```'''
+        return '''Provide code only without explanations:
+        ```python
+        <faster code>
+        ```'''
+
+    def _optimized_module(self, reply: str) -> str:
+        """
+        The module with the changes of the reply applied. Raises a PatchError if they could not be applied, or the
+        module is not valid python.
+        """
+        if self.patches:
+            return apply_reply(self._load_content(self.module_file_name), reply, self.module_file_name)
+
+        block = markdown_parser.first_code_block(reply, 'python')
+        optimized_module = block.code if block else reply
+        validate(optimized_module, self.module_file_name)
+        return optimized_module
+
+    def _evaluate(self, code: str) -> tuple[Optional[str], Optional[Profile]]:
+        """
+        Why the unit tests do not pass with code, or the profile of code when they do.
+        """
+        problems = [problem for problem in check_module(code, work_dir=self.work_dir, python=self.python)
+                    if problem.fatal]
+        if problems:
+            return '\n'.join(map(str, problems)), None
+
+        with tempfile.TemporaryDirectory() as candidate_dir:
+            for file_name in glob.glob(os.path.join(self.work_dir, '*.py')):
+                shutil.copy(file_name, candidate_dir)
+            with open(os.path.join(candidate_dir, self.module_file_name), 'w') as f:
+                f.write(code)
+
+            suite_run = run_unit_tests(self.test_module_file_name, cwd=candidate_dir, python=self.python)
+            if not suite_run.passed:
+                return format_report(failures_from_suite_run(suite_run)), None
+            return None, self._measure(candidate_dir)
+
+    def _write_module(self, code: str) -> None:
+        with open(os.path.join(self.work_dir, self.module_file_name), 'w') as f:
+            f.write(code)
+
+    def run(self) -> OptimizeResult:
+        profile = self._measure(self.work_dir)
+        rich.print(f'{BOT_PREFIX} Here are the measurements of the benchmarks:')
+        rich.print(escape(format_profile(profile)))
+        if profile.errors:
+            rich.print(f'{BOT_PREFIX} The benchmarks failed, so I can not tell whether the module is fast enough.')
+            return OptimizeResult(status='not_measured', violations=profile.errors)
+
+        violations = profile.violations(self.budget)
+        if not violations:
+            rich.print(f'{BOT_PREFIX} The module is within the performance budget.')
+            return OptimizeResult(status='within_budget')
+
+        rich.print(f'{BOT_PREFIX} The module is over the performance budget:')
+        rich.print(escape(self._describe_violations(violations)))
+        self.approval.proceed(
+            'optimize', f'{BOT_PREFIX} I will try to make the module faster. Press Enter when I can start')
+
+        self.chat = self._create_chat(profile, violations)
+        for attempt in range(1, self.max_tries + 1):
+            reply = self.chat.run().last_assistant_reply()
+            try:
+                optimized_module = self._optimized_module(reply)
+                failures, candidate = self._evaluate(optimized_module)
+            except PatchError as e:
+                optimized_module, failures, candidate = None, f'{type(e).__name__}: {e}', None
+
+            if candidate is None:
+                follow_up = f'I did not keep your changes, as the unit tests fail with them:\n{failures}'
+                rich.print(f'{BOT_PREFIX} The unit tests fail with the faster module, so I did not keep it.')
+            elif candidate.errors or not candidate.faster_than(profile):
+                follow_up = (f'I did not keep your changes, as the module is not faster with them:\n'
+                             f'{format_profile(candidate)}')
+                rich.print(f'{BOT_PREFIX} The module is not faster with the changes, so I did not keep them.')
+            else:
+                profile, violations = candidate, candidate.violations(self.budget)
+                self._write_module(optimized_module)
+                rich.print(f'{BOT_PREFIX} I made the module faster, the unit tests are still passing:')
+                rich.print(escape(format_profile(profile)))
+                if not violations:
+                    rich.print(f'{BOT_PREFIX} The module is now within the performance budget.')
+                    return OptimizeResult(status='optimized', attempts=attempt)
+                follow_up = (f'I kept your changes, but the module is still too slow:\n{format_profile(profile)}\n\n'
+                             f'{self._describe_violations(violations)}')
+
+            self.chat.chat_history.append_message(ChatMessage.of_user(follow_up))
+            # The next attempt goes to a stronger model, if the optimize stage has one
+            self.chat.escalate()
+            rich.print(f'{BOT_PREFIX} Optimization attempt {attempt}/{self.max_tries} has failed.')
+
+        rich.print(f"{BOT_PREFIX} Sorry, I can't make the module fast enough.")
+        return OptimizeResult(status='over_budget', attempts=self.max_tries, violations=violations)
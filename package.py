@@ -0,0 +1,126 @@
+import os
+import time
+import traceback
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Optional
+
+from rich import print
+
+from analyzer import PackageAnalyzer
+from approvals import ApprovalPolicy, HumanApproval
+from checkpoint import CHECKPOINT_FILE_NAME, Checkpoint
+from common import BOT_PREFIX, ModuleDetails
+from dag import Stage, StageGraph
+from instrumentation import STAGE, tracer
+from pipeline import Pipeline, PipelineResult
+
+
+@dataclass
+class PackageResult:
+    requirement: str
+    work_dir: str
+    status: str = 'pending'
+    modules: list[PipelineResult] = field(default_factory=list)
+    duration: float = 0
+    error: Optional[str] = None
+
+
+def module_checkpoint_name(module: str) -> str:
+    return CHECKPOINT_FILE_NAME.replace('.json', f'.{module}.json')
+
+
+class PackagePipeline:
+    """
+    Runs a requirement that is too large for a single module: the PackageAnalyzer decomposes it into modules that
+    require each other, and every module then runs through its own Pipeline, without the analysis, as a stage of a
+    graph whose edges are the requirements between the modules. So the modules that do not require each other are
+    implemented and tested in parallel, up to max_parallel at a time, and a module starts once the modules it requires
+    passed their tests. The fixes of a module only change that module.
+
+    The modules are written side by side to work_dir, so they import each other as they would in a package. A module
+    that requires one that did not pass is skipped.
+    The decomposition is checkpointed to work_dir, and every module checkpoints its own pipeline, so with resume, the
+    modules that passed are not run again. Any pipeline_options are passed to the pipeline of every module.
+    """
+
+    def __init__(self, requirement: str, work_dir: str = '.', approval: Optional[ApprovalPolicy] = None,
+                 max_parallel: int = 4, resume: bool = False, **pipeline_options):
+        self.requirement = requirement
+        self.work_dir = work_dir
+        self.approval = approval or HumanApproval()
+        self.max_parallel = max_parallel
+        self.resume = resume
+        self.pipeline_options = pipeline_options
+        self.result = PackageResult(requirement=requirement, work_dir=work_dir)
+        self.checkpoint: Optional[Checkpoint] = None
+        self.modules: list[ModuleDetails] = []
+
+    def _load_checkpoint(self) -> Checkpoint:
+        if self.resume:
+            checkpoint = Checkpoint.load(self.work_dir)
+            if checkpoint is not None and checkpoint.requirement == self.requirement:
+                return checkpoint
+        return Checkpoint(self.work_dir, self.requirement)
+
+    def _decompose(self) -> list[ModuleDetails]:
+        if self.checkpoint.completed('decompose'):
+            print(f'{BOT_PREFIX} Restored the modules of the package from the checkpoint')
+            return [ModuleDetails(**module) for module in self.checkpoint.output('decompose')]
+
+        with tracer.span('Decomposing Requirement', STAGE, work_dir=self.work_dir):
+            analyzer = PackageAnalyzer(self.requirement, approval=self.approval)
+            modules = analyzer.decompose()
+        self.checkpoint.complete('decompose', [asdict(module) for module in modules],
+                                 analyzer.decompose_and_review_chat.chat_history)
+        return modules
+
+    def _required(self, module: ModuleDetails) -> list[ModuleDetails]:
+        """
+        The modules that module requires, directly or through other modules, in the order of the package.
+        """
+        by_name = {other.name: other for other in self.modules}
+        names: set[str] = set()
+        pending = list(module.requires)
+        while pending:
+            name = pending.pop()
+            if name not in names:
+                names.add(name)
+                pending.extend(by_name[name].requires)
+        return [other for other in self.modules if other.name in names]
+
+    def _module_stage(self, module: ModuleDetails) -> Callable[..., PipelineResult]:
+        def run_module(**requires: PipelineResult) -> PipelineResult:
+            failed = [name for name, result in requires.items() if result.status != 'passed']
+            if failed:
+                print(f'{BOT_PREFIX} Skipping {module.name}, as {", ".join(failed)} did not pass')
+                return PipelineResult(requirement=module.description, work_dir=self.work_dir, status='skipped',
+                                      module=module.name, error=f'Requires {", ".join(failed)}, which did not pass')
+
+            print(f'{BOT_PREFIX} Starting the module {module.name}')
+            with tracer.labeled(module=module.name):
+                result = Pipeline(module.description, work_dir=self.work_dir, approval=self.approval,
+                                  resume=self.resume, module=module, requires=self._required(module),
+                                  checkpoint_name=module_checkpoint_name(module.name), **self.pipeline_options).run()
+            print(f'{BOT_PREFIX} Finished the module {module.name} with status {result.status}')
+            return result
+        return run_module
+
+    def run(self) -> PackageResult:
+        os.makedirs(self.work_dir, exist_ok=True)
+        start = time.perf_counter()
+        try:
+            self.checkpoint = self._load_checkpoint()
+            self.modules = self._decompose()
+            graph = StageGraph([Stage(module.name, self._module_stage(module), module.requires)
+                                for module in self.modules])
+            outputs = graph.run(max_workers=self.max_parallel if not self.approval.interactive else 1)
+            self.result.modules = [outputs[module.name] for module in self.modules]
+            passed = all(result.status == 'passed' for result in self.result.modules)
+            self.result.status = 'passed' if passed else 'failed'
+        except Exception as e:
+            self.result.status = 'error'
+            self.result.error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+            if self.approval.interactive:
+                raise
+        self.result.duration = time.perf_counter() - start
+        return self.result
@@ -0,0 +1,219 @@
+import ast
+import re
+import textwrap
+from dataclasses import dataclass
+from typing import Optional, Union
+
+import markdown_parser
+
+HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,\d+)? \+\d+(?:,\d+)? @@')
+DEFINITIONS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+Definition = Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef]
+
+
+class PatchError(ValueError):
+    """
+    A change that could not be applied to a module, or that leaves it invalid.
+    """
+
+
+@dataclass
+class _Hunk:
+    line: int
+    old: list[str]
+    new: list[str]
+
+
+def _hunks(diff: str) -> list[_Hunk]:
+    hunks: list[_Hunk] = []
+    for line in diff.splitlines():
+        header = HUNK_HEADER.match(line)
+        if header:
+            hunks.append(_Hunk(int(header.group(1)) - 1, [], []))
+        elif not hunks or line.startswith(('---', '+++', '\\')):
+            continue
+        elif line.startswith('-'):
+            hunks[-1].old.append(line[1:])
+        elif line.startswith('+'):
+            hunks[-1].new.append(line[1:])
+        else:
+            # A context line, whose leading space some models drop when the line is empty
+            hunks[-1].old.append(line[1:] if line.startswith(' ') else line)
+            hunks[-1].new.append(line[1:] if line.startswith(' ') else line)
+    if not hunks:
+        raise PatchError('The diff has no hunks')
+    return hunks
+
+
+def _find(lines: list[str], block: list[str], near: int) -> Optional[int]:
+    # The line numbers of a generated diff are often off, so the block is searched for, closest to where it should be
+    candidates = [i for i in range(len(lines) - len(block) + 1)
+                  if [line.rstrip() for line in lines[i:i + len(block)]] == [line.rstrip() for line in block]]
+    return min(candidates, key=lambda i: abs(i - near)) if candidates else None
+
+
+def apply_diff(source: str, diff: str) -> str:
+    """
+    Applies a unified diff to source. Every hunk is searched for by its content, so the line numbers in the hunk
+    headers only break ties. Raises a PatchError if the lines a hunk changes are not in source.
+    """
+    lines = source.splitlines()
+    offset = 0
+    for hunk in _hunks(diff):
+        start = _find(lines, hunk.old, hunk.line + offset) if hunk.old else min(hunk.line + offset, len(lines))
+        if start is None:
+            raise PatchError('These lines of the diff are not in the module:\n' + '\n'.join(hunk.old))
+        lines[start:start + len(hunk.old)] = hunk.new
+        offset += len(hunk.new) - len(hunk.old)
+    return '\n'.join(lines) + '\n'
+
+
+def _start(node: ast.stmt) -> int:
+    # Decorators belong to their definition
+    decorators = getattr(node, 'decorator_list', [])
+    return min([node.lineno] + [decorator.lineno for decorator in decorators]) - 1
+
+
+def _segment(lines: list[str], node: ast.stmt, indent: str) -> list[str]:
+    text = textwrap.dedent('\n'.join(lines[_start(node):node.end_lineno]))
+    return textwrap.indent(text, indent).splitlines()
+
+
+def _names(body: list[ast.stmt]) -> dict[str, Definition]:
+    return {node.name: node for node in body if isinstance(node, DEFINITIONS)}
+
+
+def _assigned_names(node: ast.stmt) -> list[str]:
+    targets = node.targets if isinstance(node, ast.Assign) else [getattr(node, 'target', None)]
+    return [target.id for target in targets if isinstance(target, ast.Name)]
+
+
+class _Replacer:
+    """
+    Collects the line ranges of source to replace, and applies them bottom up so that the ranges stay valid.
+    """
+
+    def __init__(self, source: str, code: str):
+        self.lines = source.splitlines()
+        self.code_lines = code.splitlines()
+        self.edits: list[tuple[int, int, list[str]]] = []
+
+    def replace(self, old: ast.stmt, new: ast.stmt, indent: str) -> None:
+        self.edits.append((_start(old), old.end_lineno, _segment(self.code_lines, new, indent)))
+
+    def insert(self, line: int, new: ast.stmt, indent: str, blank_lines: int) -> None:
+        self.edits.append((line, line, [''] * blank_lines + _segment(self.code_lines, new, indent)))
+
+    def merge_class(self, old: ast.ClassDef, new: ast.ClassDef) -> None:
+        old_methods, new_methods = _names(old.body), _names(new.body)
+        if set(old_methods) <= set(new_methods):
+            # The whole class was given
+            self.replace(old, new, ' ' * old.col_offset)
+            return
+
+        indent = ' ' * old.body[0].col_offset
+        for name, node in new_methods.items():
+            if name in old_methods:
+                self.replace(old_methods[name], node, indent)
+            else:
+                self.insert(old.end_lineno, node, indent, blank_lines=1)
+
+    def result(self) -> str:
+        lines = list(self.lines)
+        # Bottom up, and the later of two insertions at the same line first, so that they end up in order
+        for _, (start, end, replacement) in sorted(enumerate(self.edits), key=lambda edit: (edit[1][0], edit[0]),
+                                                   reverse=True):
+            lines[start:end] = replacement
+        return '\n'.join(lines) + '\n'
+
+
+def _method_owner(tree: ast.Module, node: ast.stmt) -> Optional[ast.ClassDef]:
+    # A method given without its class, which the owning class is found for by name
+    if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return None
+    arguments = node.args.posonlyargs + node.args.args
+    if not arguments or arguments[0].arg not in ('self', 'cls'):
+        return None
+    owners = [cls for cls in tree.body if isinstance(cls, ast.ClassDef) and node.name in _names(cls.body)]
+    return owners[0] if len(owners) == 1 else None
+
+
+def replace_definitions(source: str, code: str) -> str:
+    """
+    Replaces the functions, classes, methods and top level assignments of source that code defines, keeping the rest
+    of source as is. Definitions and imports that source does not have are added. A class whose methods are not all
+    given is changed method by method.
+    """
+    tree, new_tree = ast.parse(source), ast.parse(code)
+    replacer = _Replacer(source, code)
+    definitions = _names(tree.body)
+    assignments = {name: node for node in tree.body if isinstance(node, (ast.Assign, ast.AnnAssign))
+                   for name in _assigned_names(node)}
+    source_imports = {ast.dump(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))}
+    imports_end = max((node.end_lineno for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))),
+                      default=0)
+
+    for node in new_tree.body:
+        if isinstance(node, ast.ClassDef) and isinstance(definitions.get(node.name), ast.ClassDef):
+            replacer.merge_class(definitions[node.name], node)
+        elif isinstance(node, DEFINITIONS) and node.name in definitions:
+            replacer.replace(definitions[node.name], node, '')
+        elif isinstance(node, DEFINITIONS):
+            owner = _method_owner(tree, node)
+            if owner is not None:
+                replacer.replace(_names(owner.body)[node.name], node, ' ' * owner.body[0].col_offset)
+            else:
+                replacer.insert(len(replacer.lines), node, '', blank_lines=2)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            if ast.dump(node) not in source_imports:
+                replacer.insert(imports_end, node, '', blank_lines=0)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            names = [name for name in _assigned_names(node) if name in assignments]
+            if names:
+                replacer.replace(assignments[names[0]], node, '')
+            else:
+                replacer.insert(imports_end, node, '', blank_lines=0)
+        # Other statements, e.g. a module docstring or an example call, are not part of the change
+    return replacer.result()
+
+
+def _covers(source: str, code: str) -> bool:
+    # A reply that defines every definition of the module is a rewrite of the whole module
+    return set(_names(ast.parse(source).body)) <= set(_names(ast.parse(code).body))
+
+
+def validate(code: str, file_name: str = '<module>') -> None:
+    """
+    Raises a PatchError if code is not valid python.
+    """
+    try:
+        ast.parse(code, file_name)
+    except SyntaxError as e:
+        raise PatchError(f'SyntaxError: {e.msg} ({file_name}, line {e.lineno}): {(e.text or "").strip()}')
+
+
+def apply_reply(source: str, reply: str, file_name: str = '<module>') -> str:
+    """
+    Applies a reply of the model to the module source, and returns the changed module. The reply is a ```diff block
+    with a unified diff, or a ```python block with the definitions to replace, or with the whole module. Raises a
+    PatchError if the reply could not be applied, or if the result is not valid python.
+    """
+    blocks = markdown_parser.parse_code_blocks(reply)
+    diffs = [block.code for block in blocks if block.has_language('diff')]
+    code = next((block.code for block in blocks if not block.has_language('diff')), None)
+    if diffs:
+        patched = source
+        for diff in diffs:
+            patched = apply_diff(patched, diff)
+    else:
+        # A method copied from within its class keeps the indentation of the class
+        code = textwrap.dedent(code if code is not None else reply)
+        validate(code, 'your reply')
+        try:
+            rewrite = _covers(source, code)
+        except SyntaxError:
+            # The definitions of a module that does not parse can not be replaced
+            rewrite = True
+        patched = code if rewrite else replace_definitions(source, code)
+    validate(patched, file_name)
+    return patched
@@ -0,0 +1,336 @@
+import os
+import sys
+import time
+import traceback
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Optional
+
+from rich import print
+
+from analyzer import Analyzer
+from approvals import ApprovalPolicy, HumanApproval
+from checkpoint import CHECKPOINT_FILE_NAME, Checkpoint
+from common import BOT_PREFIX, ModuleDetails
+from dag import Stage, StageGraph
+from dependencies import DependencyManager, dependency_manager
+from examples import Example, ExampleIndex
+from fixer import FixResult, Fixer
+from implementor import Implementor
+from instrumentation import STAGE, tracer
+from optimizer import BenchmarkWriter, OptimizeResult, Optimizer
+from profiler import PerformanceBudget
+from tester import Tester
+
+STAGE_TITLES = {
+    'analyze': 'Analyzing Requirement',
+    'implement': 'Implementing',
+    'suggest_tests': 'Suggesting Test Cases',
+    'write_tests': 'Writing Unit Tests',
+    'fix': 'Verifying Tests Are Passing',
+    'write_benchmarks': 'Writing Benchmarks',
+    'optimize': 'Checking Performance',
+}
+
+
+@dataclass
+class PipelineResult:
+    requirement: str
+    work_dir: str
+    status: str = 'pending'
+    module: Optional[str] = None
+    files: list[str] = field(default_factory=list)
+    dependencies: list[str] = field(default_factory=list)
+    fix_attempts: int = 0
+    performance: Optional[str] = None
+    optimize_attempts: int = 0
+    durations: dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+def write_file(file_name: str, content: str) -> None:
+    with open(file_name, 'w') as f:
+        f.write(content)
+
+
+def print_progress(titles: list[str], current_stage: int) -> None:
+    stages = []
+    for i, stage in enumerate(titles):
+        if i < current_stage:
+            stages.append(f'[green3]{stage}[/green3]')
+        elif i == current_stage:
+            stages.append(f'[bold deep_sky_blue1]{stage}[/bold deep_sky_blue1]')
+        else:
+            stages.append(f'[grey30]{stage}[/grey30]')
+    print('\n' + ' -> '.join(stages) + '\n')
+
+
+class Pipeline:
+    """
+    Runs a requirement through the Analyzer -> Implementor -> Tester -> Fixer stages, writing the generated files to
+    work_dir.
+
+    The stages form a graph, and a stage runs as soon as the stages it needs are done. With a non interactive approval
+    policy, the unit tests are written from the api produced by the Analyzer while the Implementor writes the module,
+    and with suggest_tests, the test cases are suggested alongside as well. Interactive runs go through the stages one
+    at a time, and write the tests from the implementation.
+
+    The approval policy resolves the points where a stage would wait for a human. With a non interactive policy, no
+    stage waits, which allows running many pipelines concurrently.
+    With fix_candidates > 1, each fix attempt asks for several candidate fixes and keeps the best one. With
+    patch_fixes, the fixes only replace the definitions they change. Test failures are summarized locally, unless
+    llm_summary is set.
+    The dependencies of the module are installed into a virtualenv shared by the modules with the same dependencies,
+    if the approval policy confirms it (which non interactive policies do when install_dependencies is set), and the
+    tests run in it.
+    The tests run in a sandbox with resource limits, split between test_shards worker processes.
+    With an examples index, the prompts show the modules written for the most similar requirements of previous runs,
+    and the module is added to the index when its tests pass.
+    The progress is checkpointed to work_dir after every stage. With resume, the stages that a previous run of the
+    same requirement completed are skipped, and an interrupted fix continues from its last attempt.
+    With a performance budget, benchmarks are written for the module, alongside the unit tests, and once the tests
+    pass, a module that is over the budget is optimized while its tests keep passing (see optimizer.Optimizer).
+    A module of a package (see package.PackagePipeline) is given with its api, which skips the analysis, and with the
+    modules it requires, which are already in work_dir, and which the prompts show the apis of.
+    """
+
+    def __init__(self, requirement: str, work_dir: str = '.', approval: Optional[ApprovalPolicy] = None,
+                 fix_candidates: int = 1, llm_summary: bool = False, resume: bool = False,
+                 suggest_tests: bool = False, install_dependencies: bool = False,
+                 dependencies: Optional[DependencyManager] = None, test_shards: int = 1,
+                 examples: Optional[ExampleIndex] = None, patch_fixes: bool = False,
+                 module: Optional[ModuleDetails] = None, requires: Optional[list[ModuleDetails]] = None,
+                 checkpoint_name: str = CHECKPOINT_FILE_NAME, performance: Optional[PerformanceBudget] = None):
+        self.requirement = requirement
+        self.work_dir = work_dir
+        self.approval = approval or HumanApproval()
+        self.fix_candidates = fix_candidates
+        self.llm_summary = llm_summary
+        self.resume = resume
+        self.suggest_tests = suggest_tests
+        self.install_dependencies = install_dependencies
+        self.dependency_manager = dependencies or dependency_manager
+        self.test_shards = test_shards
+        self.examples = examples
+        self.patch_fixes = patch_fixes
+        self.module = module
+        self.requires = requires or []
+        self.checkpoint_name = checkpoint_name
+        self.performance = performance
+        self._similar_examples: Optional[list[Example]] = None
+        self.python = sys.executable
+        self.result = PipelineResult(requirement=requirement, work_dir=work_dir)
+        self.checkpoint: Optional[Checkpoint] = None
+        self.graph: StageGraph = self._create_graph()
+        self._resuming = False
+        self._restored_stages: set[str] = set()
+
+    def _create_graph(self) -> StageGraph:
+        # Checking the tests requires the implementation, so the tests policy can not write them alongside it
+        overlap = not self.approval.interactive and not self.approval.checks_replies
+        tests_inputs = ['analyze'] if overlap else ['analyze', 'implement']
+
+        stages = [Stage('analyze', self._analyze), Stage('implement', self._implement, ['analyze'])]
+        if self.suggest_tests:
+            stages.append(Stage('suggest_tests', self._suggest_tests, tests_inputs))
+        stages.append(Stage('write_tests', self._write_tests,
+                            tests_inputs + ['suggest_tests'] if self.suggest_tests else tests_inputs))
+        stages.append(Stage('fix', self._fix, ['analyze', 'implement', 'write_tests']))
+        if self.performance is not None:
+            stages.append(Stage('write_benchmarks', self._write_benchmarks, tests_inputs))
+            stages.append(Stage('optimize', self._optimize, ['analyze', 'write_benchmarks', 'fix']))
+
+        for stage in stages:
+            stage.run = self._staged(stage.name, stage.run)
+        return StageGraph(stages)
+
+    def _write(self, file_name: str, content: str) -> None:
+        write_file(os.path.join(self.work_dir, file_name), content)
+        self.result.files.append(file_name)
+        print(f'{BOT_PREFIX} I have written the file {file_name}')
+
+    def _staged(self, name: str, run: Callable) -> Callable:
+        def run_stage(**inputs):
+            with self._stage(name):
+                return run(**inputs)
+        return run_stage
+
+    @contextmanager
+    def _stage(self, name: str):
+        title = STAGE_TITLES[name]
+        if self.approval.interactive:
+            print_progress([STAGE_TITLES[stage.name] for stage in self.graph.stages],
+                           [stage.name for stage in self.graph.stages].index(name))
+        start = time.perf_counter()
+        with tracer.span(title, STAGE, work_dir=self.work_dir):
+            yield
+        self.result.durations[title] = time.perf_counter() - start
+
+    def _load_checkpoint(self) -> Checkpoint:
+        if self.resume:
+            checkpoint = Checkpoint.load(self.work_dir, self.checkpoint_name)
+            if checkpoint is not None and checkpoint.requirement == self.requirement:
+                self._resuming = True
+                return checkpoint
+        return Checkpoint(self.work_dir, self.requirement, file_name=self.checkpoint_name)
+
+    def _restored(self, name: str) -> bool:
+        """
+        Whether the stage can be restored from the checkpoint, which requires the stages it needs to be restored too.
+        Otherwise, the checkpoints of the stages that need this one are discarded.
+        """
+        inputs = next(stage.inputs for stage in self.graph.stages if stage.name == name)
+        if (self._resuming and all(input_name in self._restored_stages for input_name in inputs)
+                and self.checkpoint.completed(name)):
+            self._restored_stages.add(name)
+            print(f'{BOT_PREFIX} Restored "{STAGE_TITLES[name]}" from the checkpoint')
+            return True
+
+        self.checkpoint.discard(self.graph.dependents(name))
+        return False
+
+    def run(self) -> PipelineResult:
+        os.makedirs(self.work_dir, exist_ok=True)
+        try:
+            self.checkpoint = self._load_checkpoint()
+            outputs = self.graph.run(max_workers=3 if not self.approval.interactive else 1)
+            fix_result = outputs['fix']
+            self.result.fix_attempts = fix_result.attempts
+            self.result.status = 'passed' if fix_result.passed else 'failed'
+            optimize_result = outputs.get('optimize')
+            if optimize_result is not None:
+                self.result.performance = optimize_result.status
+                self.result.optimize_attempts = optimize_result.attempts
+            if fix_result.passed and self.examples is not None:
+                self._add_example(outputs['analyze'])
+        except Exception as e:
+            self.result.status = 'error'
+            self.result.error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+            if self.approval.interactive:
+                raise
+        return self.result
+
+    def _similar(self, count: int) -> list[Example]:
+        if self.examples is None:
+            return []
+        if self._similar_examples is None:
+            self._similar_examples = self.examples.nearest(self.requirement)
+        return self._similar_examples[:count]
+
+    def _add_example(self, module: ModuleDetails) -> None:
+        with open(os.path.join(self.work_dir, f'{module.name}.py'), 'r') as f:
+            code = f.read()
+        with open(os.path.join(self.work_dir, f'test_{module.name}.py'), 'r') as f:
+            tests = f.read()
+        self.examples.add(Example(self.requirement, module, code, self.result.dependencies, tests))
+
+    def _analyze(self) -> ModuleDetails:
+        if self._restored('analyze'):
+            module = ModuleDetails(**self.checkpoint.output('analyze'))
+        elif self.module is not None:
+            module = self.module
+            self.checkpoint.complete('analyze', asdict(module))
+        else:
+            analyzer = Analyzer(self.requirement, approval=self.approval, examples=self._similar(2))
+            module = analyzer.analyze()
+            self.checkpoint.complete('analyze', asdict(module), analyzer.analyze_and_review_chat.chat_history)
+        self.result.module = module.name
+        return module
+
+    def _implement(self, analyze: ModuleDetails) -> str:
+        file_name = f'{analyze.name}.py'
+        if self._restored('implement'):
+            self.result.dependencies = self.checkpoint.output('implement')['dependencies']
+            self.result.files.append(file_name)
+        else:
+            # Implementations are long, so a single example is shown
+            implementor = Implementor(analyze, approval=self.approval, examples=self._similar(1),
+                                      work_dir=self.work_dir, requires=self.requires)
+            implementation = implementor.implement()
+            self.result.dependencies = implementor.dependencies
+            self._write(file_name, implementation)
+            self.checkpoint.complete('implement', {'file': file_name, 'dependencies': implementor.dependencies},
+                                     implementor.implement_and_review_chat.chat_history)
+
+        self._prepare_environment(self.result.dependencies)
+        return file_name
+
+    def _prepare_environment(self, dependencies: list[str]) -> None:
+        if not dependencies or not self.approval.confirm(
+                'install_dependencies', f'{BOT_PREFIX} Do you want me to install them for you?',
+                default=self.install_dependencies):
+            return
+        self.python = self.dependency_manager.install(dependencies).python
+
+    def _tester(self, module: ModuleDetails, implement: Optional[str], suggestions: Optional[str] = None) -> Tester:
+        # Without the implementation, the tests are written from the api
+        api = module.api if implement is None else None
+        return Tester(f'{module.name}.py', work_dir=self.work_dir, approval=self.approval, api=api,
+                      suggestions=suggestions, python=self.python, requires=self.requires)
+
+    def _suggest_tests(self, analyze: ModuleDetails, implement: Optional[str] = None) -> str:
+        if self._restored('suggest_tests'):
+            return self.checkpoint.output('suggest_tests')['suggestions']
+
+        suggestions = self._tester(analyze, implement).suggest_tests()
+        self.checkpoint.complete('suggest_tests', {'suggestions': suggestions})
+        return suggestions
+
+    def _write_tests(self, analyze: ModuleDetails, implement: Optional[str] = None,
+                     suggest_tests: Optional[str] = None) -> str:
+        file_name = f'test_{analyze.name}.py'
+        if self._restored('write_tests'):
+            self.result.files.append(file_name)
+            return file_name
+
+        tester = self._tester(analyze, implement, suggest_tests)
+        tests = tester.write_tests()
+        self._write(file_name, tests)
+        self.checkpoint.complete('write_tests', {'file': file_name}, tester.write_tests_and_review_chat.chat_history)
+        return file_name
+
+    def _fix(self, analyze: ModuleDetails, implement: str, write_tests: str) -> FixResult:
+        if self._restored('fix'):
+            return FixResult(**self.checkpoint.output('fix'))
+
+        self.approval.proceed(
+            'review', f'{BOT_PREFIX} Review the module and tests, then press Enter to run the tests and fix the module if necessary')
+
+        fixer = Fixer(analyze.name, work_dir=self.work_dir, approval=self.approval, candidates=self.fix_candidates,
+                      llm_summary=self.llm_summary, checkpoint=self.checkpoint, python=self.python,
+                      test_shards=self.test_shards, patches=self.patch_fixes)
+        fix_result = fixer.run_tests_and_fix_if_needed()
+        self.checkpoint.complete('fix', asdict(fix_result), fixer.chat_history)
+        return fix_result
+
+    def _write_benchmarks(self, analyze: ModuleDetails, implement: Optional[str] = None) -> str:
+        file_name = f'bench_{analyze.name}.py'
+        if self._restored('write_benchmarks'):
+            self.result.files.append(file_name)
+            return file_name
+
+        # Like the tests, without the implementation, the benchmarks are written from the api
+        writer = BenchmarkWriter(f'{analyze.name}.py', work_dir=self.work_dir, approval=self.approval,
+                                 api=analyze.api if implement is None else None, python=self.python)
+        benchmarks = writer.write_benchmarks()
+        self._write(file_name, benchmarks)
+        self.checkpoint.complete('write_benchmarks', {'file': file_name},
+                                 writer.write_benchmarks_and_review_chat.chat_history)
+        return file_name
+
+    def _optimize(self, analyze: ModuleDetails, write_benchmarks: str, fix: FixResult) -> Optional[OptimizeResult]:
+        if self._restored('optimize'):
+            output = self.checkpoint.output('optimize')
+            return OptimizeResult(**output) if output is not None else None
+
+        # Only a module whose tests pass can be optimized, as the tests check that it still works
+        if not fix.passed:
+            self.checkpoint.complete('optimize', None)
+            return None
+
+        optimizer = Optimizer(analyze.name, budget=self.performance, work_dir=self.work_dir, approval=self.approval,
+                              python=self.python, patches=self.patch_fixes)
+        optimize_result = optimizer.run()
+        self.checkpoint.complete('optimize', asdict(optimize_result),
+                                 optimizer.chat.chat_history if optimizer.chat is not None else None)
+        return optimize_result
@@ -0,0 +1,185 @@
+import ast
+import glob
+import importlib.util
+import json
+import os
+import site
+import subprocess
+import sys
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Union
+
+try:
+    from pyflakes.checker import Checker
+    from pyflakes.messages import UndefinedName
+except ImportError:
+    Checker = None
+
+FunctionNode = Union[ast.FunctionDef, ast.AsyncFunctionDef]
+
+FIND_SPECS_SCRIPT = '''
+import importlib.util, json, sys
+print(json.dumps([name for name in json.loads(sys.argv[1]) if importlib.util.find_spec(name) is None]))
+'''
+
+
+@dataclass
+class Problem:
+    """
+    A problem found in a module without running it.
+
+    Attributes:
+        kind: syntax, import, undefined, missing or signature.
+        message: What is wrong.
+        line: The line of the module it is on, if it is on one.
+    """
+    kind: str
+    message: str
+    line: Optional[int] = None
+
+    @property
+    def fatal(self) -> bool:
+        """
+        Whether the module can not even be imported, so no test can pass. The tests decide about the other problems.
+        """
+        return self.kind in ('syntax', 'import')
+
+    def __str__(self) -> str:
+        return f'line {self.line}: {self.message}' if self.line else self.message
+
+
+def format_problems(problems: list[Problem]) -> str:
+    return '\n'.join(f'- {problem}' for problem in problems)
+
+
+class PreflightError(ValueError):
+    def __init__(self, problems: list[Problem]):
+        super().__init__(f'The module has problems:\n{format_problems(problems)}')
+        self.problems = problems
+
+
+def _import_roots(tree: ast.Module) -> dict[str, int]:
+    # Only the imports of the module level, the others may be optional
+    roots = {}
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                roots.setdefault(alias.name.split('.')[0], node.lineno)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            roots.setdefault(node.module.split('.')[0], node.lineno)
+    return roots
+
+
+def _site_packages_signature(python: str) -> int:
+    """
+    The latest modification of the site-packages directories of python, which installing or removing a package
+    changes.
+    """
+    if python == sys.executable:
+        directories = site.getsitepackages() + [site.getusersitepackages()]
+    else:
+        prefix = os.path.dirname(os.path.dirname(python))
+        directories = glob.glob(os.path.join(prefix, 'lib', 'python*', 'site-packages')) + [
+            os.path.join(prefix, 'Lib', 'site-packages')]
+    return max((os.stat(directory).st_mtime_ns for directory in directories if os.path.isdir(directory)), default=0)
+
+
+def _missing_modules(names: tuple[str, ...], python: str) -> tuple[str, ...]:
+    # Cached until a package is installed in, or removed from, the environment of python, e.g. by the dependencies
+    return _cached_missing_modules(names, python, _site_packages_signature(python))
+
+
+@lru_cache(maxsize=256)
+def _cached_missing_modules(names: tuple[str, ...], python: str, signature: int) -> tuple[str, ...]:
+    if python == sys.executable:
+        return tuple(name for name in names if importlib.util.find_spec(name) is None)
+    output = subprocess.run([python, '-c', FIND_SPECS_SCRIPT, json.dumps(names)], capture_output=True, text=True)
+    return tuple(json.loads(output.stdout)) if output.returncode == 0 else ()
+
+
+def _unresolved_imports(tree: ast.Module, work_dir: str, python: str,
+                        dependencies: Optional[list[str]]) -> list[Problem]:
+    roots = {name: line for name, line in _import_roots(tree).items()
+             if name not in sys.stdlib_module_names and not os.path.exists(os.path.join(work_dir, f'{name}.py'))}
+    missing = set(_missing_modules(tuple(sorted(roots)), python))
+    if dependencies is not None:
+        # The dependencies are not installed yet, and a package may be imported by another name, e.g. bs4
+        if dependencies:
+            return []
+        message = '`{}` is not in the standard library, not installed, and not in the dependencies'
+    else:
+        message = '`{}` can not be imported, it is not in the standard library nor installed'
+    return [Problem('import', message.format(name), line) for name, line in roots.items() if name in missing]
+
+
+def _undefined_names(tree: ast.Module) -> list[Problem]:
+    if Checker is None:
+        return []
+    # The other messages of pyflakes, e.g. unused imports, do not fail the tests
+    return [Problem('undefined', message.message % message.message_args, message.lineno)
+            for message in Checker(tree).messages if isinstance(message, UndefinedName)]
+
+
+def _parameters(function: FunctionNode) -> list[str]:
+    arguments = function.args
+    names = [argument.arg for argument in arguments.posonlyargs + arguments.args]
+    if arguments.vararg:
+        names.append(f'*{arguments.vararg.arg}')
+    names += [argument.arg for argument in arguments.kwonlyargs]
+    if arguments.kwarg:
+        names.append(f'**{arguments.kwarg.arg}')
+    return names
+
+
+def _definitions(body: list[ast.stmt]) -> dict[str, ast.stmt]:
+    return {node.name: node for node in body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))}
+
+
+def _compare(expected: dict[str, ast.stmt], actual: dict[str, ast.stmt], owner: str = '') -> list[Problem]:
+    problems = []
+    for name, node in expected.items():
+        if name.startswith('_') and not (name.startswith('__') and name.endswith('__')):
+            continue
+        qualified = f'{owner}{name}'
+        implemented = actual.get(name)
+        if implemented is None or isinstance(implemented, ast.ClassDef) != isinstance(node, ast.ClassDef):
+            kind = 'class' if isinstance(node, ast.ClassDef) else 'function'
+            problems.append(Problem('missing', f'The {kind} `{qualified}` of the api is not defined'))
+        elif isinstance(node, ast.ClassDef):
+            problems += _compare(_definitions(node.body), _definitions(implemented.body), f'{qualified}.')
+        elif _parameters(node) != _parameters(implemented):
+            problems.append(Problem(
+                'signature', f'`{qualified}` takes ({", ".join(_parameters(implemented))}), but the api defines '
+                             f'({", ".join(_parameters(node))})', implemented.lineno))
+    return problems
+
+
+def _api_drift(tree: ast.Module, api: str) -> list[Problem]:
+    try:
+        api_tree = ast.parse(api)
+    except SyntaxError:
+        # An api that is not valid python can not be compared to
+        return []
+    return _compare(_definitions(api_tree.body), _definitions(tree.body))
+
+
+def check_module(code: str, api: Optional[str] = None, work_dir: str = '.', python: str = sys.executable,
+                 dependencies: Optional[list[str]] = None) -> list[Problem]:
+    """
+    Checks a module without running it: that it parses, that its imports resolve with the python given, that it uses
+    no undefined names (with pyflakes, if it is installed) and, when the api of the module is given, that it defines
+    the functions and classes of the api with the same parameters.
+
+    dependencies are the packages the module declares when they are not installed yet, in which case imports that do
+    not resolve are only reported if it declares none.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        return [Problem('syntax', f'SyntaxError: {e.msg}: {(e.text or "").strip()}', e.lineno)]
+
+    problems = _unresolved_imports(tree, work_dir, python, dependencies) + _undefined_names(tree)
+    if api:
+        problems += _api_drift(tree, api)
+    return problems
@@ -0,0 +1,246 @@
+import importlib
+import inspect
+import json
+import math
+import os
+import signal
+import subprocess
+import sys
+import timeit
+import traceback
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Optional
+
+from sandbox import DEFAULT_LIMITS, Limits, Sandbox, apply_limits
+
+DEFAULT_SIZES = (500, 2000, 8000)
+# Faster calls are timed too imprecisely, and smaller peaks are mostly the overhead of the call, to tell their growth
+MIN_MEASURED_SECONDS = 1e-4
+MIN_MEASURED_BYTES = 64 * 1024
+# A call is repeated, with a new input every time, until the calls took this long, and its fastest run is kept
+MIN_TOTAL_SECONDS = 0.05
+MAX_RUNS = 20
+
+
+@dataclass
+class PerformanceBudget:
+    """
+    How slow the benchmarks of a module may be.
+
+    Attributes:
+        max_seconds: The time a benchmark call may take, with the largest input.
+        max_exponent: How fast the time and memory of a call may grow with the size of its input, e.g. 1.5 allows
+            n log n, but not n^2.
+        sizes: The sizes of the inputs that are measured, smallest first.
+    """
+    max_seconds: float = 1.0
+    max_exponent: float = 1.5
+    sizes: list[int] = field(default_factory=lambda: list(DEFAULT_SIZES))
+
+
+def growth_exponent(sizes: list[int], values: list[float], floor: float) -> Optional[float]:
+    """
+    The exponent k of the n^k that values grow as with sizes, fitted on a log-log scale, or None if fewer than two
+    values are at least floor.
+    """
+    points = [(math.log(size), math.log(value)) for size, value in zip(sizes, values) if value >= floor]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if variance == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+@dataclass
+class CaseProfile:
+    """
+    The measurements of a benchmark case at every input size, up to the first size whose call went over the budget.
+    """
+    name: str
+    sizes: list[int] = field(default_factory=list)
+    seconds: list[float] = field(default_factory=list)
+    peak_bytes: list[int] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def time_exponent(self) -> Optional[float]:
+        return growth_exponent(self.sizes, self.seconds, MIN_MEASURED_SECONDS)
+
+    @property
+    def memory_exponent(self) -> Optional[float]:
+        return growth_exponent(self.sizes, self.peak_bytes, MIN_MEASURED_BYTES)
+
+    def violations(self, budget: PerformanceBudget) -> list[str]:
+        if self.error is not None or not self.sizes:
+            return []
+        problems = []
+        if self.seconds[-1] > budget.max_seconds:
+            problems.append(f'{self.name} takes {self.seconds[-1]:.2f}s with an input of size {self.sizes[-1]}, over '
+                            f'the budget of {budget.max_seconds:g}s')
+        for kind, exponent in (('time', self.time_exponent), ('memory', self.memory_exponent)):
+            if exponent is not None and exponent > budget.max_exponent:
+                problems.append(f'The {kind} of {self.name} grows as n^{exponent:.1f} with the size of its input, '
+                                f'over the budget of n^{budget.max_exponent:g}')
+        return problems
+
+
+@dataclass
+class Profile:
+    """
+    The measurements of all the cases of a benchmarks module. error is why the benchmarks did not run to the end, and
+    timed_out whether it is because they were too slow.
+    """
+    cases: list[CaseProfile]
+    error: Optional[str] = None
+    timed_out: bool = False
+
+    @property
+    def errors(self) -> list[str]:
+        """
+        Why the benchmarks could not measure the module, other than it being too slow, e.g. a case that raised.
+        """
+        errors = [self.error] if self.error is not None and not self.timed_out else []
+        return errors + [f'{case.name}: {case.error}' for case in self.cases if case.error is not None]
+
+    def violations(self, budget: PerformanceBudget) -> list[str]:
+        if self.timed_out:
+            return [self.error]
+        return [problem for case in self.cases for problem in case.violations(budget)]
+
+    def faster_than(self, other: 'Profile') -> bool:
+        """
+        Whether the cases take less time than in the profile of another version of the module. As a case stops growing
+        its input once a call is over the budget, the two profiles of a case are compared at the largest size both
+        measured.
+        """
+        if self.timed_out or other.timed_out:
+            return other.timed_out and not self.timed_out
+        others = {case.name: case for case in other.cases}
+        seconds, other_seconds = 0.0, 0.0
+        for case in self.cases:
+            other_case = others.get(case.name)
+            sizes = set(case.sizes) & set(other_case.sizes) if other_case is not None else set()
+            if sizes:
+                size = max(sizes)
+                seconds += case.seconds[case.sizes.index(size)]
+                other_seconds += other_case.seconds[other_case.sizes.index(size)]
+        return seconds < other_seconds
+
+
+def format_profile(profile: Profile) -> str:
+    lines = []
+    for case in profile.cases:
+        lines.append(f'{case.name}:')
+        if case.error is not None:
+            lines.append(f'  Failed: {case.error}')
+            continue
+        lines.append(f'  {"Size":>8}  {"Time (s)":>10}  {"Peak memory (KB)":>16}')
+        for size, seconds, peak_bytes in zip(case.sizes, case.seconds, case.peak_bytes):
+            lines.append(f'  {size:>8}  {seconds:>10.5f}  {peak_bytes / 1024:>16.1f}')
+    if profile.error is not None:
+        lines.append(profile.error)
+    return '\n'.join(lines)
+
+
+def measure(benchmarks_file_name: str, cwd: str = '.', python: str = sys.executable, sizes: Optional[list[int]] = None,
+            max_seconds: float = math.inf, limits: Limits = DEFAULT_LIMITS) -> Profile:
+    """
+    Runs every case of a benchmarks module with inputs of the given sizes, measuring the time and the peak memory of
+    its calls. The benchmarks are untrusted, so they run in another process, in a sandbox within the limits given.
+
+    A case is a pair of functions, setup_<case>(size) that returns an input of the given size, and bench_<case>(data)
+    that calls the module with it. The larger sizes of a case are skipped once a call takes longer than max_seconds.
+    """
+    request = {'module': os.path.splitext(benchmarks_file_name)[0], 'sizes': sizes or list(DEFAULT_SIZES),
+               'max_seconds': max_seconds if max_seconds != math.inf else None,
+               'cpu_seconds': limits.cpu_seconds, 'memory_bytes': limits.memory_bytes}
+    sandbox = Sandbox(cwd)
+    try:
+        sandbox.sync()
+        completed = subprocess.run([python, os.path.abspath(__file__), json.dumps(request)], cwd=sandbox.path,
+                                   capture_output=True, text=True, timeout=limits.wall_seconds)
+    except subprocess.TimeoutExpired:
+        return Profile([], error=f'The benchmarks did not finish within {limits.wall_seconds:g}s', timed_out=True)
+    finally:
+        sandbox.cleanup()
+
+    if completed.returncode == -signal.SIGXCPU:
+        return Profile([], error=f'The benchmarks used more than {limits.cpu_seconds}s of CPU time', timed_out=True)
+    if completed.returncode != 0 or not completed.stdout.strip():
+        details = completed.stderr.strip().splitlines()
+        return Profile([], error=details[-1] if details else f'The benchmarks exited with {completed.returncode}')
+    data = json.loads(completed.stdout)
+    return Profile([CaseProfile(**case) for case in data['cases']], error=data['error'])
+
+
+def _time_call(setup: Callable, bench: Callable, size: int) -> float:
+    fastest, total, runs = math.inf, 0.0, 0
+    while runs < MAX_RUNS and (runs == 0 or total < MIN_TOTAL_SECONDS):
+        # Every call gets a new input, as a call may change its input, e.g. sort it
+        data = setup(size)
+        start = timeit.default_timer()
+        bench(data)
+        seconds = timeit.default_timer() - start
+        fastest, total, runs = min(fastest, seconds), total + seconds, runs + 1
+    return fastest
+
+
+def _peak_bytes(setup: Callable, bench: Callable, size: int) -> int:
+    data = setup(size)
+    # Traced separately from the timing, which tracing slows down, and only while the input is used
+    tracemalloc.start()
+    try:
+        bench(data)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _profile_case(name: str, setup: Callable, bench: Callable, sizes: list[int],
+                  max_seconds: Optional[float]) -> CaseProfile:
+    case = CaseProfile(name)
+    try:
+        for size in sizes:
+            seconds = _time_call(setup, bench, size)
+            case.sizes.append(size)
+            case.seconds.append(seconds)
+            case.peak_bytes.append(_peak_bytes(setup, bench, size))
+            if max_seconds is not None and seconds > max_seconds:
+                break
+    except Exception as e:
+        case.error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+    return case
+
+
+def _run(request: dict) -> dict:
+    apply_limits(request['cpu_seconds'], request['memory_bytes'])
+    try:
+        module = importlib.import_module(request['module'])
+    except Exception as e:
+        return {'cases': [], 'error': ''.join(traceback.format_exception_only(type(e), e)).strip()}
+
+    cases = []
+    for name, bench in inspect.getmembers(module, inspect.isfunction):
+        if not name.startswith('bench_'):
+            continue
+        setup = getattr(module, f'setup_{name.removeprefix("bench_")}', None)
+        if setup is None:
+            cases.append(CaseProfile(name, error=f'There is no setup_{name.removeprefix("bench_")} function'))
+        else:
+            cases.append(_profile_case(name, setup, bench, request['sizes'], request['max_seconds']))
+    error = None if cases else 'The benchmarks module has no bench_ functions'
+    return {'cases': [asdict(case) for case in cases], 'error': error}
+
+
+if __name__ == '__main__':
+    # The benchmarks may print, so the results are written to a duplicate of stdout, and fd 1 goes to stderr
+    result_stream = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+    sys.dont_write_bytecode = True
+    sys.path.insert(0, os.getcwd())
+    json.dump(_run(json.loads(sys.argv[1])), result_stream)
+    result_stream.flush()
@@ -0,0 +1,40 @@
+import unittest
+from typing import Optional
+
+import chat
+from backends import Backend, ReplayBackend, ScriptedReply
+from client import LLMClient
+
+
+class ReplayTestCase(unittest.TestCase):
+    """
+    A test case whose chats are answered by the backend given to replay instead of the openai API, and by a
+    ReplayBackend of script from the start of every test if the test case has one. The completion cache is off, so
+    every test gets the replies it scripted. The client and the cache of the chat module are restored after every
+    test.
+    """
+    script: Optional[list[ScriptedReply]] = None
+
+    def setUp(self):
+        self.llm_client, self.completion_cache = chat.llm_client, chat.completion_cache
+        chat.completion_cache = None
+        if self.script is not None:
+            self.replay(ReplayBackend(script=self.script))
+
+    def tearDown(self):
+        self.close_replay()
+        chat.llm_client, chat.completion_cache = self.llm_client, self.completion_cache
+
+    def close_replay(self) -> None:
+        """
+        Closes the client of the backend given to replay, once the requests it is still running are stopped, and puts
+        back the client the chat module had before the test.
+        """
+        if chat.llm_client is not self.llm_client:
+            chat.llm_client.close()
+            chat.llm_client = self.llm_client
+
+    def replay(self, backend: Backend) -> Backend:
+        self.close_replay()
+        chat.llm_client = LLMClient(backend=backend)
+        return backend
@@ -0,0 +1,240 @@
+import re
+import textwrap
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import yaml
+
+import markdown_parser
+
+BLOCK_INDICATOR = re.compile(r'^[|>][+-]?\d*$')
+FENCE = re.compile(r'^\s*```')
+IDENTIFIER = re.compile(r'\W+')
+
+
+class ReplyError(ValueError):
+    """
+    A reply that does not have the structure that was asked for, even after repairing it.
+    """
+
+
+@dataclass
+class ReplyField:
+    """
+    A key of a yaml reply.
+
+    Attributes:
+        name: The key.
+        type: str or list, of strings.
+        required: Whether the reply must have the key. A missing optional key gets an empty value.
+        block: Whether the value is multiline text, e.g. code, which the reply should write as a block scalar.
+    """
+    name: str
+    type: type = str
+    required: bool = True
+    block: bool = False
+
+
+@dataclass
+class ReplySchema:
+    name: str
+    fields: list[ReplyField]
+
+    def validate(self, data: Any) -> dict:
+        """
+        Returns the values of the fields in data, with their expected types. Raises a ReplyError describing the first
+        problem found otherwise, which can be sent back to the model as is.
+        """
+        if not isinstance(data, dict):
+            raise ReplyError(f'The reply must be a yaml mapping with the keys {", ".join(self.keys)}')
+
+        values = {}
+        for field in self.fields:
+            value = data.get(field.name)
+            if value is None:
+                if field.required:
+                    raise ReplyError(f'The reply has no `{field.name}` key')
+                value = field.type()
+
+            if field.type is list:
+                if isinstance(value, (str, int, float)):
+                    value = [value]
+                if not isinstance(value, list) or any(isinstance(item, (dict, list)) for item in value):
+                    raise ReplyError(f'`{field.name}` must be a list of strings')
+                value = [str(item) for item in value if item is not None]
+            elif isinstance(value, (int, float)):
+                value = str(value)
+            elif not isinstance(value, str):
+                raise ReplyError(f'`{field.name}` must be a string'
+                                 + (', written as a block scalar (`|`)' if field.block else ''))
+            elif field.required and not value.strip():
+                # e.g. the lines of a block scalar that are not indented under its key
+                raise ReplyError(f'`{field.name}` is empty')
+            values[field.name] = value
+        return values
+
+    @property
+    def keys(self) -> list[str]:
+        return [field.name for field in self.fields]
+
+
+MODULE_SCHEMA = ReplySchema('module', [
+    ReplyField('name'),
+    ReplyField('description'),
+    ReplyField('api', block=True),
+])
+PACKAGE_MODULE_SCHEMA = ReplySchema('package_module', [
+    ReplyField('name'),
+    ReplyField('description'),
+    ReplyField('requires', type=list, required=False),
+    ReplyField('api', block=True),
+])
+IMPLEMENTATION_SCHEMA = ReplySchema('implementation', [
+    ReplyField('dependencies', type=list, required=False),
+    ReplyField('code', block=True),
+])
+
+
+class RepairStats:
+    """
+    Counts how the replies of every schema were parsed: 'valid' for replies that needed no repair, the name of the
+    repair that made a reply valid otherwise, or 'failed' for the replies that could not be repaired.
+    """
+
+    def __init__(self):
+        self.schemas: dict[str, Counter] = {}
+        self._lock = threading.Lock()
+
+    def record(self, schema: str, outcome: str) -> None:
+        with self._lock:
+            self.schemas.setdefault(schema, Counter())[outcome] += 1
+
+    def summary(self) -> dict[str, dict[str, int]]:
+        with self._lock:
+            return {schema: dict(outcomes) for schema, outcomes in self.schemas.items()}
+
+
+repair_stats = RepairStats()
+
+
+def _first_block(content: str) -> str:
+    block = markdown_parser.first_code_block(content, 'yaml')
+    return block.code if block else content
+
+
+def _without_fences(content: str, schema: ReplySchema) -> str:
+    # Drops unbalanced fences, and the text around the yaml, which starts at the first line with a key of the schema
+    lines = [line for line in content.splitlines() if not FENCE.match(line)]
+    keys = re.compile(rf'^\s*({"|".join(map(re.escape, schema.keys))})\s*:')
+    start = next((i for i, line in enumerate(lines) if keys.match(line)), 0)
+    return '\n'.join(lines[start:])
+
+
+def _indentation_fixed(content: str, schema: ReplySchema) -> str:
+    return textwrap.dedent(_without_fences(content, schema).expandtabs(4))
+
+
+def _scalar(text: str) -> Any:
+    try:
+        value = yaml.safe_load(text)
+    except yaml.YAMLError:
+        return text.strip()
+    return value if isinstance(value, (str, int, float)) else text.strip()
+
+
+def _list(lines: list[str]) -> Any:
+    try:
+        return yaml.safe_load('\n'.join(lines))
+    except yaml.YAMLError:
+        return [line.strip()[1:].strip() for line in lines if line.strip().startswith('-')]
+
+
+def _block(first: str, lines: list[str]) -> str:
+    body = textwrap.dedent('\n'.join(lines)).strip('\n')
+    if first and not BLOCK_INDICATOR.match(first):
+        body = f'{first}\n{body}' if body else first
+    return body
+
+
+def _by_keys(content: str, schema: ReplySchema) -> dict:
+    """
+    Reads every key of the schema from the lines up to the next key, without parsing the reply as yaml, which recovers
+    e.g. code that was not indented under its `code: |`, or a description with a colon in it.
+    """
+    keys = re.compile(rf'^({"|".join(map(re.escape, schema.keys))})\s*:[ \t]*(.*)$')
+    sections: dict[str, list[str]] = {}
+    current = None
+    for line in _indentation_fixed(content, schema).splitlines():
+        match = keys.match(line)
+        # A key is read once, so that e.g. a line of code that looks like a key stays in the code
+        if match and match.group(1) not in sections:
+            current = match.group(1)
+            sections[current] = [match.group(2)]
+        elif current is not None:
+            sections[current].append(line)
+
+    data = {}
+    for field in schema.fields:
+        if field.name not in sections:
+            continue
+        first, *lines = sections[field.name]
+        if field.block:
+            data[field.name] = _block(first.strip(), lines)
+        elif field.type is list:
+            data[field.name] = _list([first] + lines)
+        else:
+            data[field.name] = _scalar(' '.join(line.strip() for line in [first] + lines if line.strip()))
+    return data
+
+
+def _loaded(transform: Callable[[str, ReplySchema], str]) -> Callable[[str, ReplySchema], Any]:
+    return lambda content, schema: yaml.safe_load(transform(content, schema))
+
+
+# Tried in order until one gives a valid reply
+REPAIRS: list[tuple[str, Callable[[str, ReplySchema], Any]]] = [
+    ('valid', lambda content, schema: yaml.safe_load(_first_block(content))),
+    ('fences', _loaded(_without_fences)),
+    ('indentation', _loaded(_indentation_fixed)),
+    ('keys', _by_keys),
+]
+
+
+def parse_reply(content: str, schema: ReplySchema) -> dict:
+    """
+    Parses a yaml reply of the model, which is expected in a fenced code block, and validates it against the schema.
+
+    A reply that is not valid is repaired locally if possible: fences that are missing or unbalanced and text around
+    the yaml are dropped, tabs and indentation of the whole reply are fixed, and finally the keys are read line by
+    line, which recovers block scalars that are not indented or do not start with `|`.
+    Raises a ReplyError with the problem of the unrepaired reply otherwise, so that only it is sent back to the model.
+    """
+    errors: list[Exception] = []
+    for repair, parse in REPAIRS:
+        try:
+            values = schema.validate(parse(content, schema))
+        except (yaml.YAMLError, ReplyError) as e:
+            errors.append(e)
+            continue
+        repair_stats.record(schema.name, repair)
+        return values
+
+    repair_stats.record(schema.name, 'failed')
+    # What is missing or wrong is more useful to the model than where the yaml could not be parsed
+    reply_errors = [error for error in errors if isinstance(error, ReplyError)]
+    if reply_errors:
+        raise reply_errors[0]
+    raise ReplyError(f'The reply is not valid yaml: {errors[0]}')
+
+
+def module_name(name: str) -> str:
+    """
+    A valid python module name close to name, e.g. markdown_utils for `Markdown-Utils.py`.
+    """
+    name = name.strip().removesuffix('.py')
+    name = IDENTIFIER.sub('_', name).strip('_').lower()
+    if not name:
+        raise ReplyError('`name` must be a python module name')
+    return f'_{name}' if name[0].isdigit() else name
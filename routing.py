@@ -0,0 +1,58 @@
+from typing import Optional
+
+FAST_MODEL = 'gpt-3.5-turbo'
+STRONG_MODEL = 'gpt-4'
+DEFAULT_CASCADE = [FAST_MODEL, STRONG_MODEL]
+# Stages whose replies are only read by the user, and are not worth a stronger model
+FAST_STAGES = ('summarize',)
+
+
+class ModelRouter:
+    """
+    Picks the model of every completion, by stage. A stage starts with the first, fastest model of its cascade, and
+    escalates to the next one after every failures_per_model failed replies, e.g. a yaml reply that could not be
+    parsed, or a fix after which the tests still fail.
+
+    routes maps stages to their own cascades, e.g. {'fix': ['gpt-4']}. The other stages use cascade, except the ones in
+    FAST_STAGES, which only use its first model.
+    """
+
+    def __init__(self, cascade: Optional[list[str]] = None, routes: Optional[dict[str, list[str]]] = None,
+                 failures_per_model: int = 1):
+        self.cascade = list(cascade or DEFAULT_CASCADE)
+        self.routes = dict(routes or {})
+        self.failures_per_model = max(1, failures_per_model)
+
+    def models(self, stage: str) -> list[str]:
+        if stage in self.routes:
+            return self.routes[stage]
+        if stage in FAST_STAGES:
+            return self.cascade[:1]
+        return self.cascade
+
+    def model(self, stage: str, failures: int = 0) -> str:
+        """
+        The model of the next completion of stage, after failures failed replies.
+        """
+        models = self.models(stage)
+        return models[min(failures // self.failures_per_model, len(models) - 1)]
+
+
+def parse_models(value: str) -> list[str]:
+    models = [model.strip() for model in value.split(',') if model.strip()]
+    if not models:
+        raise ValueError(f'No models in `{value}`')
+    return models
+
+
+def parse_routes(values: list[str]) -> dict[str, list[str]]:
+    """
+    Parses routes given as STAGE=MODEL[,MODEL...], e.g. fix=gpt-3.5-turbo,gpt-4.
+    """
+    routes = {}
+    for value in values:
+        stage, separator, models = value.partition('=')
+        if not separator or not stage.strip():
+            raise ValueError(f'A route must look like STAGE=MODEL[,MODEL...], not `{value}`')
+        routes[stage.strip()] = parse_models(models)
+    return routes
@@ -1,39 +1,204 @@
+import argparse
+import json
+import sys
+
 from rich import print
 from rich.prompt import Prompt
+from rich.table import Table
 
-from analyzer import Analyzer
+import chat
+import terminal
+from approvals import POLICIES, approval_policy
+from backends import MissingAPIKeyError, OpenAIBackend, RecordingBackend, ReplayBackend
+from checkpoint import Checkpoint
+from client import LLMClient
 from common import BOT_PREFIX
-from fixer import Fixer
-from implementor import Implementor
-from tester import Tester
+from examples import DEFAULT_EXAMPLES_FILE, ExampleIndex
+from profiler import PerformanceBudget
+from routing import DEFAULT_CASCADE, ModelRouter, parse_models, parse_routes
+from instrumentation import tracer
+
+
+def _table(title: str, columns: list[str]) -> Table:
+    table = Table(title=title)
+    for i, column in enumerate(columns):
+        table.add_column(column, justify='left' if i == 0 else 'right')
+    return table
+
+
+def summary() -> dict:
+    from replies import repair_stats
+    result = {'stages': tracer.stage_summary(), 'completions': tracer.llm_summary(), 'models': tracer.model_summary(),
+              'tests': tracer.tests_summary(), 'replies': repair_stats.summary()}
+    if chat.completion_cache is not None:
+        result['cache'] = {'hits': chat.completion_cache.stats.hits, 'misses': chat.completion_cache.stats.misses}
+    return result
+
+
+def print_summary() -> None:
+    from replies import repair_stats
+    stages = _table('Pipeline stages', ['Stage', 'Runs', 'Wall (s)', 'Machine (s)', 'Waiting for you (s)'])
+    for row in tracer.stage_summary():
+        stages.add_row(row['stage'], str(row['runs']), f"{row['wall']:.1f}", f"{row['machine']:.1f}",
+                       f"{row['human']:.1f}")
+    print(stages)
+
+    calls = _table('Completions', ['Stage', 'Calls', 'Cache hits', 'Retries', 'Latency (s)', 'Prompt tokens',
+                                   'Completion tokens'])
+    for row in tracer.llm_summary():
+        calls.add_row(row['stage'], str(row['calls']), str(row['cache_hits']), str(row['retries']),
+                      f"{row['latency']:.1f}", str(row['prompt_tokens']), str(row['completion_tokens']))
+    print(calls)
 
+    models = _table('Models', ['Model', 'Calls', 'Cache hits', 'Latency (s)', 'Prompt tokens', 'Completion tokens',
+                               'Cost ($)'])
+    for row in tracer.model_summary():
+        models.add_row(row['model'], str(row['calls']), str(row['cache_hits']), f"{row['latency']:.1f}",
+                       str(row['prompt_tokens']), str(row['completion_tokens']),
+                       '?' if row['cost'] is None else f"{row['cost']:.4f}")
+    print(models)
 
-def write_file(file_name: str, content: str) -> None:
-    with open(file_name, 'w') as f:
-        f.write(content)
+    tests = tracer.tests_summary()
+    print(f"{BOT_PREFIX} Ran the unit tests {tests['runs']} times ({tests['tests']} tests) in {tests['duration']:.1f}s")
+
+    for schema, outcomes in repair_stats.summary().items():
+        repaired = ', '.join(f'{count} by {outcome}' for outcome, count in outcomes.items()
+                             if outcome not in ('valid', 'failed'))
+        print(f"{BOT_PREFIX} {schema.capitalize()} replies: {outcomes.get('valid', 0)} valid, "
+              f"{repaired or '0'} repaired, {outcomes.get('failed', 0)} sent back")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Implement python modules from requirements.')
+    parser.add_argument('--batch', metavar='FILE',
+                        help='A .jsonl or .yaml file of requirements to implement without human feedback')
+    parser.add_argument('--serve', type=int, metavar='PORT',
+                        help='Run as a service that queues requirement jobs submitted over HTTP on PORT of localhost '
+                             '(0 for a free port), see service.py')
+    parser.add_argument('--socket', metavar='PATH', help='Like --serve, over a Unix socket at PATH')
+    parser.add_argument('--package', action='store_true',
+                        help='Split the requirement into a package of modules, which are implemented and tested in '
+                             'parallel when they do not require each other')
+    parser.add_argument('--output-dir', default='runs',
+                        help='Where batch results and service jobs are written (default: runs)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='How many batch or service pipelines, or package modules, run concurrently (default: 4)')
+    parser.add_argument('--fix-candidates', type=int, default=1,
+                        help='How many candidate fixes to request and test in parallel per fix attempt (default: 1)')
+    parser.add_argument('--patch-fixes', action='store_true',
+                        help='Ask for fixes of only the functions and classes that change, instead of the whole module')
+    parser.add_argument('--suggest-tests', action='store_true',
+                        help='Ask for the test cases to cover before writing the unit tests')
+    parser.add_argument('--install-dependencies', action='store_true',
+                        help='Install the dependencies of the modules without asking, when not running interactively')
+    parser.add_argument('--optimize', action='store_true',
+                        help='Benchmark the module once its tests pass, and ask for a faster implementation while it '
+                             'is over the performance budget')
+    parser.add_argument('--max-seconds', type=float, default=1.0,
+                        help='The time a benchmark call may take with the largest input, with --optimize (default: 1)')
+    parser.add_argument('--max-exponent', type=float, default=1.5,
+                        help='How fast the time and memory of a benchmark call may grow with the size of its input, '
+                             'as the exponent of n, with --optimize (default: 1.5)')
+    parser.add_argument('--test-shards', type=int, default=1,
+                        help='How many processes run the unit tests of a module in parallel (default: 1)')
+    parser.add_argument('--llm-summary', action='store_true',
+                        help='Ask the model to summarize test failures instead of summarizing them locally')
+    parser.add_argument('--examples', metavar='FILE', nargs='?', const=DEFAULT_EXAMPLES_FILE,
+                        help='Keep the modules that pass their tests in FILE, and show the model the most similar '
+                             f'ones as examples (FILE defaults to {DEFAULT_EXAMPLES_FILE}). Off by default, as the '
+                             'prompts then depend on the previous runs')
+    parser.add_argument('--models', type=parse_models, default=DEFAULT_CASCADE, metavar='MODEL[,MODEL...]',
+                        help='The models every stage starts with and escalates to after a failed reply, fastest first '
+                             f'(default: {",".join(DEFAULT_CASCADE)})')
+    parser.add_argument('--route', action='append', default=[], metavar='STAGE=MODEL[,MODEL...]',
+                        help='The models of one stage (analyze, implement, write_tests, suggest_tests, fix, '
+                             'summarize, write_benchmarks or optimize) instead of --models (can be repeated)')
+    parser.add_argument('--quiet', action='store_true',
+                        help='Machine readable output: no spinners or highlighting, and the summary of the run as JSON')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='Write a Chrome trace of the run, which chrome://tracing or Perfetto can open')
+    parser.add_argument('--approval', choices=list(POLICIES),
+                        help='How the points where a stage waits for you are resolved: human (ask), auto (accept '
+                             'everything), valid (send replies that cannot be parsed back to the model), tests (valid, '
+                             'and the unit tests must load) or timeout (ask, and accept after --approval-timeout). '
+                             'Defaults to human, or auto with --batch')
+    parser.add_argument('--approval-timeout', type=float, default=60,
+                        help='Seconds to wait for an answer with --approval timeout (default: 60)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted run from its checkpoint, skipping the stages it completed')
+    parser.add_argument('--record', metavar='FILE', help='Append the replies of the API to a fixtures file')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='Answer from a fixtures file written with --record instead of calling the API')
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    requirements = Prompt.ask(f'{BOT_PREFIX} Hi! What would you like to build?\n[green_yellow]YOU[/green_yellow]')
-
-    print(
-        '\n[bold deep_sky_blue1]Analyzing Requirement[/bold deep_sky_blue1] -> [grey30]Implementing[/grey30] -> [grey30]Writing Unit Tests[/grey30] -> [grey30]Verifying Tests Are Passing[/grey30]\n')
-    module = Analyzer(requirements).analyze()
-
-    print(
-        '\n[green3]Analyzing Requirement[/green3] -> [bold deep_sky_blue1]Implementing[/bold deep_sky_blue1] -> [grey30]Writing Unit Tests[/grey30] -> [grey30]Verifying Tests Are Passing[/grey30]\n')
-    implementation = Implementor(module).implement()
-    write_file(f'{module.name}.py', implementation)
-    print(f'{BOT_PREFIX} I have written the file {module.name}.py')
-
-    print(
-        '\n[green3]Analyzing Requirement[/green3] -> [green3]Implementing[/green3] -> [bold deep_sky_blue1]Writing Unit Tests[/bold deep_sky_blue1] -> [grey30]Verifying Tests Are Passing[/grey30]\n')
-    tests = Tester(f'{module.name}.py').write_tests()
-    write_file(f'test_{module.name}.py', tests)
-    print(f'{BOT_PREFIX} I have written the file test_{module.name}.py')
-
-    Prompt.ask(
-        '[light_goldenrod3]BOT:[/light_goldenrod3] Review the module and tests, then press Enter to run the tests and fix the module if necessary')
-    print(
-        '\n[green3]Analyzing Requirement[/green3] -> [green3]Implementing[/green3] -> [green3]Writing Unit Tests[/green3] -> [bold deep_sky_blue1]Verifying Tests Are Passing[/bold deep_sky_blue1]')
-    Fixer(module.name).run_tests_and_fix_if_needed()
+    args = parse_args()
+    terminal.quiet = args.quiet
+    serving = args.serve is not None or args.socket is not None
+    concurrent = args.batch or serving
+    approval = approval_policy(args.approval or ('auto' if concurrent else 'human'), args.approval_timeout)
+    if args.package and concurrent:
+        print(f'{BOT_PREFIX} --package runs a single requirement, so it cannot be used with --batch or the service')
+        exit(1)
+    if concurrent and approval.interactive:
+        mode = '--batch' if args.batch else 'The service'
+        print(f'{BOT_PREFIX} {mode} runs pipelines concurrently, so it cannot be used with --approval {approval.name}')
+        exit(1)
+
+    try:
+        chat.model_router = ModelRouter(args.models, parse_routes(args.route))
+    except ValueError as e:
+        print(f'{BOT_PREFIX} {e}')
+        exit(1)
+
+    if args.replay:
+        chat.llm_client = LLMClient(backend=ReplayBackend.from_file(args.replay))
+    elif args.record:
+        chat.llm_client = LLMClient(backend=RecordingBackend(OpenAIBackend(), args.record))
+
+    performance = PerformanceBudget(args.max_seconds, args.max_exponent) if args.optimize else None
+    pipeline_options = {'approval': approval, 'fix_candidates': args.fix_candidates, 'llm_summary': args.llm_summary,
+                        'resume': args.resume, 'suggest_tests': args.suggest_tests,
+                        'install_dependencies': args.install_dependencies, 'test_shards': args.test_shards,
+                        'patch_fixes': args.patch_fixes,
+                        'performance': performance,
+                        'examples': ExampleIndex(args.examples) if args.examples else None}
+    # The stages import most of the dependencies, so they are only imported once the arguments are known to be valid
+    from batch import run_batch
+    from package import PackagePipeline
+    from pipeline import Pipeline
+
+    try:
+        if serving:
+            from service import serve
+            serve(args.output_dir, port=args.serve, socket_path=args.socket, workers=args.workers, **pipeline_options)
+        elif args.batch:
+            run_batch(args.batch, args.output_dir, workers=args.workers, **pipeline_options)
+        else:
+            checkpoint = Checkpoint.load('.') if args.resume else None
+            if checkpoint is not None:
+                requirements = checkpoint.requirement
+                print(f'{BOT_PREFIX} Resuming: {requirements}')
+            else:
+                with tracer.human_wait('requirements'):
+                    requirements = Prompt.ask(
+                        f'{BOT_PREFIX} Hi! What would you like to build?\n[green_yellow]YOU[/green_yellow]')
+            if args.package:
+                PackagePipeline(requirements, max_parallel=args.workers, **pipeline_options).run()
+            else:
+                Pipeline(requirements, **pipeline_options).run()
+    except MissingAPIKeyError as e:
+        print(f'{BOT_PREFIX} {e}')
+        exit(1)
+
+    if args.trace:
+        tracer.export_chrome_trace(args.trace)
+    if args.quiet:
+        # Written as is, as rich would wrap and color it
+        sys.stdout.write(json.dumps(summary()) + '\n')
+    else:
+        print_summary()
+        if chat.completion_cache is not None:
+            stats = chat.completion_cache.stats
+            print(f'{BOT_PREFIX} Completion cache: {stats.hits} hits, {stats.misses} misses')
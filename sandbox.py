@@ -0,0 +1,75 @@
+import filecmp
+import glob
+import os
+import resource
+import shutil
+import tempfile
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class Limits:
+    """
+    The resources a test run may use. None means no limit.
+
+    Attributes:
+        cpu_seconds: The CPU time of a run.
+        memory_bytes: The address space of the process running the tests.
+        test_seconds: The wall time of a single test, or of loading the tests.
+        wall_seconds: The wall time of a run.
+    """
+    cpu_seconds: Optional[int] = 60
+    memory_bytes: Optional[int] = 2 * 1024 ** 3
+    test_seconds: Optional[float] = 10.0
+    wall_seconds: Optional[float] = 120.0
+
+
+DEFAULT_LIMITS = Limits()
+NO_LIMITS = Limits(cpu_seconds=None, memory_bytes=None, test_seconds=None, wall_seconds=None)
+
+
+def _set_soft_limit(kind: int, value: Optional[int]) -> None:
+    _, hard = resource.getrlimit(kind)
+    if value is None:
+        value = hard
+    elif hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(kind, (value, hard))
+
+
+def apply_limits(cpu_seconds: Optional[int], memory_bytes: Optional[int]) -> None:
+    """
+    Limits the CPU time and memory of the calling process, and of the processes it starts. Called by the process that
+    runs the tests, before every run. The CPU time a process used is never reset, so the CPU limit is set relative to
+    what the process used so far. A process that goes over it is killed with SIGXCPU.
+    """
+    if cpu_seconds is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu_seconds = int(usage.ru_utime + usage.ru_stime) + cpu_seconds
+    _set_soft_limit(resource.RLIMIT_CPU, cpu_seconds)
+    _set_soft_limit(resource.RLIMIT_AS, memory_bytes)
+
+
+class Sandbox:
+    """
+    A temporary directory holding a copy of the python files of a source directory, where generated code can run
+    without writing to the source directory. sync copies the files that changed since the previous sync.
+    """
+
+    def __init__(self, source_dir: str):
+        self.source_dir = source_dir
+        self._directory = tempfile.TemporaryDirectory(prefix='impllmentors-sandbox-')
+
+    @property
+    def path(self) -> str:
+        return self._directory.name
+
+    def sync(self) -> None:
+        for file_name in glob.glob(os.path.join(self.source_dir, '*.py')):
+            copy = os.path.join(self.path, os.path.basename(file_name))
+            if not os.path.exists(copy) or not filecmp.cmp(file_name, copy, shallow=False):
+                shutil.copyfile(file_name, copy)
+
+    def cleanup(self) -> None:
+        self._directory.cleanup()
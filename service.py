@@ -0,0 +1,329 @@
+import json
+import os
+import queue
+import re
+import signal
+import socketserver
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Union
+
+from rich import print
+
+from approvals import AutoApproval
+from common import BOT_PREFIX
+from instrumentation import LLM, STAGE, TESTS, Span, tracer
+from pipeline import Pipeline, PipelineResult
+
+JOB_ID = re.compile(r'^[\w-]{1,64}$')
+# The pipeline options a job can set for itself, the others are the same for every job of the service
+JOB_OPTIONS = {'fix_candidates': int, 'llm_summary': bool, 'suggest_tests': bool, 'patch_fixes': bool,
+               'test_shards': int}
+FINISHED = ('passed', 'failed', 'error', 'cancelled')
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+@dataclass
+class Job:
+    """
+    A requirement submitted to the service.
+
+    Attributes:
+        status: queued, running, or once the job is finished, the status of its pipeline (passed, failed or error), or
+            cancelled.
+        metrics: The completions, tokens and test runs of the job, once it is finished.
+    """
+    id: str
+    requirement: str
+    options: dict = field(default_factory=dict)
+    status: str = 'queued'
+    submitted: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    result: Optional[PipelineResult] = None
+    metrics: dict = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        now = time.time()
+        data = asdict(self)
+        data['queued_seconds'] = (self.started or self.finished or now) - self.submitted
+        data['run_seconds'] = (self.finished or now) - self.started if self.started else None
+        return data
+
+
+def job_metrics(spans: list[Span]) -> dict:
+    llm_spans = [span for span in spans if span.category == LLM]
+    test_spans = [span for span in spans if span.category == TESTS]
+    return {
+        'calls': len(llm_spans),
+        'cache_hits': sum(1 for span in llm_spans if span.attributes.get('cache_hit')),
+        'retries': sum(span.attributes.get('retries', 0) for span in llm_spans),
+        'llm_latency': sum(span.duration for span in llm_spans),
+        'prompt_tokens': sum(span.attributes.get('prompt_tokens', 0) for span in llm_spans),
+        'completion_tokens': sum(span.attributes.get('completion_tokens', 0) for span in llm_spans),
+        'models': dict(Counter(span.attributes.get('model', 'unknown') for span in llm_spans)),
+        'test_runs': len(test_spans),
+        'tests_duration': sum(span.duration for span in test_spans),
+        'stages': {span.name: span.duration for span in spans if span.category == STAGE},
+    }
+
+
+class PipelineService:
+    """
+    Runs the pipelines of submitted jobs on a fixed pool of worker threads, each job in its own directory under
+    output_dir, in the order they were submitted.
+
+    The workers live as long as the service, and share the process: the connections of the LLM client, the completion
+    cache, the virtualenvs of the dependencies and the examples index stay warm between jobs, and workers bounds how
+    many pipelines run at once. At most max_queued jobs wait for a worker.
+
+    Any pipeline_options are passed to every Pipeline, and a job can override the ones in JOB_OPTIONS. The approval
+    policy must not be interactive, and defaults to accepting everything.
+    """
+
+    def __init__(self, output_dir: str, workers: int = 4, max_queued: int = 100, **pipeline_options):
+        pipeline_options.setdefault('approval', AutoApproval())
+        if pipeline_options['approval'].interactive:
+            raise ValueError('The service runs pipelines concurrently, so their approval policy cannot be interactive')
+        self.output_dir = output_dir
+        self.workers = workers
+        self.max_queued = max_queued
+        self.pipeline_options = pipeline_options
+        self.started = time.time()
+        self._jobs: dict[str, Job] = {}
+        self._queue: queue.Queue[Optional[str]] = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+
+    def start(self) -> None:
+        os.makedirs(self.output_dir, exist_ok=True)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'service-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """
+        Waits for the running jobs to finish. The jobs still queued are cancelled.
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status == 'queued':
+                    job.status, job.finished = 'cancelled', time.time()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, requirement: str, job_id: Optional[str] = None, options: Optional[dict] = None) -> Job:
+        """
+        Queues a job. Raises a ValueError for an invalid job, and a QueueFullError if max_queued jobs are waiting.
+        """
+        if not isinstance(requirement, str) or not requirement.strip():
+            raise ValueError('`requirement` must be a non empty string')
+        options = options or {}
+        for name, value in options.items():
+            if name not in JOB_OPTIONS:
+                raise ValueError(f'`{name}` is not a job option, which are: {", ".join(JOB_OPTIONS)}')
+            # bool is a subclass of int, so true is not taken for a number
+            if not isinstance(value, JOB_OPTIONS[name]) or (JOB_OPTIONS[name] is int and isinstance(value, bool)):
+                raise ValueError(f'`{name}` must be a {JOB_OPTIONS[name].__name__}')
+        job_id = job_id or uuid.uuid4().hex[:12]
+        if not isinstance(job_id, str) or not JOB_ID.match(job_id):
+            raise ValueError('`id` must be letters, digits, - and _ only')
+
+        with self._lock:
+            if job_id in self._jobs:
+                raise ValueError(f'There is already a job {job_id}')
+            # The queue still holds the ids of the cancelled jobs, which the workers skip
+            queued = sum(1 for job in self._jobs.values() if job.status == 'queued')
+            if queued >= self.max_queued:
+                raise QueueFullError(f'{self.max_queued} jobs are already queued')
+            job = Job(job_id, requirement, options)
+            self._jobs[job_id] = job
+        self._queue.put(job_id)
+        return job
+
+    def job(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def describe(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job is not None else None
+
+    def jobs(self) -> list[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancels a queued job. Returns False if the job is already running or finished.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != 'queued':
+                return False
+            job.status, job.finished = 'cancelled', time.time()
+            return True
+
+    def health(self) -> dict:
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {
+            'workers': self.workers,
+            'queued': statuses.count('queued'),
+            'running': statuses.count('running'),
+            'finished': sum(1 for status in statuses if status in FINISHED),
+            'uptime': time.time() - self.started,
+        }
+
+    def _work(self) -> None:
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            with self._lock:
+                job = self._jobs[job_id]
+                if job.status != 'queued':
+                    continue
+                job.status, job.started = 'running', time.time()
+            self._run(job)
+
+    def _run(self, job: Job) -> None:
+        print(f'{BOT_PREFIX} Starting job {job.id}: {job.requirement}')
+        with tracer.labeled(job=job.id):
+            pipeline = Pipeline(job.requirement, work_dir=os.path.join(self.output_dir, job.id),
+                                **{**self.pipeline_options, **job.options})
+            # Pipeline.run reports its errors in the result, so a job always finishes
+            result = pipeline.run()
+        metrics = job_metrics(tracer.take(job=job.id))
+        with self._lock:
+            job.result, job.metrics = result, metrics
+            job.status, job.finished = result.status, time.time()
+        print(f'{BOT_PREFIX} Finished job {job.id} with status {result.status}')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    The HTTP API of a PipelineService:
+        POST /jobs with {"requirement": ..., "id": ..., "options": {...}} queues a job, id and options are optional.
+        GET /jobs lists the jobs, and GET /jobs/<id> describes one, with its result and metrics once it finished.
+        DELETE /jobs/<id> cancels a queued job.
+        GET /health describes the workers and the queue.
+    """
+    service: PipelineService
+
+    def _reply(self, status: HTTPStatus, body: Union[dict, list]) -> None:
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _job_id(self) -> Optional[str]:
+        parts = self.path.rstrip('/').split('/')
+        return parts[2] if len(parts) == 3 and parts[1] == 'jobs' else None
+
+    def do_GET(self) -> None:
+        path = self.path.rstrip('/')
+        if path == '/health':
+            self._reply(HTTPStatus.OK, self.service.health())
+        elif path == '/jobs':
+            self._reply(HTTPStatus.OK, [{'id': job.id, 'status': job.status} for job in self.service.jobs()])
+        elif self._job_id() is not None:
+            job = self.service.describe(self._job_id())
+            if job is None:
+                self._reply(HTTPStatus.NOT_FOUND, {'error': f'There is no job {self._job_id()}'})
+            else:
+                self._reply(HTTPStatus.OK, job)
+        else:
+            self._reply(HTTPStatus.NOT_FOUND, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self) -> None:
+        if self.path.rstrip('/') != '/jobs':
+            self._reply(HTTPStatus.NOT_FOUND, {'error': f'Unknown path {self.path}'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not isinstance(body, dict):
+                raise ValueError('The body must be a JSON object')
+            job = self.service.submit(body.get('requirement'), body.get('id'), body.get('options'))
+        except QueueFullError as e:
+            self._reply(HTTPStatus.SERVICE_UNAVAILABLE, {'error': str(e)})
+        except ValueError as e:
+            self._reply(HTTPStatus.BAD_REQUEST, {'error': str(e)})
+        else:
+            self._reply(HTTPStatus.ACCEPTED, {'id': job.id, 'status': job.status})
+
+    def do_DELETE(self) -> None:
+        job_id = self._job_id()
+        job = self.service.job(job_id) if job_id is not None else None
+        if job is None:
+            self._reply(HTTPStatus.NOT_FOUND, {'error': f'There is no job {job_id}'})
+        elif self.service.cancel(job_id):
+            self._reply(HTTPStatus.OK, {'id': job_id, 'status': 'cancelled'})
+        else:
+            self._reply(HTTPStatus.CONFLICT,
+                        {'error': f'Job {job_id} is {job.status}, only queued jobs can be cancelled'})
+
+    def address_string(self) -> str:
+        # The clients of a Unix socket have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format: str, *args) -> None:
+        # The service prints when jobs start and finish, the requests polling them are noise
+        pass
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(service: PipelineService, port: Optional[int] = None,
+                  socket_path: Optional[str] = None) -> socketserver.BaseServer:
+    """
+    An HTTP server for the service, on socket_path if it is given, and on port of localhost otherwise (a free port
+    for 0).
+    """
+    handler = type('Handler', (_Handler,), {'service': service})
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return _UnixHTTPServer(socket_path, handler)
+    return ThreadingHTTPServer(('127.0.0.1', port or 0), handler)
+
+
+def _interrupt(signum, frame) -> None:
+    raise KeyboardInterrupt
+
+
+def serve(output_dir: str, port: Optional[int] = None, socket_path: Optional[str] = None, workers: int = 4,
+          max_queued: int = 100, **pipeline_options) -> None:
+    service = PipelineService(output_dir, workers=workers, max_queued=max_queued, **pipeline_options)
+    server = create_server(service, port, socket_path)
+    service.start()
+    # A service is usually stopped with SIGTERM, which should let the running jobs finish too
+    signal.signal(signal.SIGTERM, _interrupt)
+    address = socket_path or f'http://127.0.0.1:{server.server_address[1]}'
+    print(f'{BOT_PREFIX} Serving on {address} with {workers} workers, press Ctrl+C to stop')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f'{BOT_PREFIX} Stopping, waiting for the running jobs to finish')
+    finally:
+        server.server_close()
+        service.stop()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -0,0 +1,472 @@
+import contextlib
+import hashlib
+import importlib
+import io
+import json
+import os
+import select
+import signal
+import subprocess
+import sys
+import time
+import traceback
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Iterable, Iterator, Optional
+
+from instrumentation import TESTS, tracer
+from sandbox import DEFAULT_LIMITS, Limits, Sandbox, apply_limits
+
+FAILED_STATUSES = ('failed', 'error')
+# Tests slower than this are listed in the report of a run
+SLOW_TEST_SECONDS = 1.0
+
+
+@dataclass
+class CaseResult:
+    name: str
+    status: str
+    traceback: Optional[str] = None
+    duration: float = 0.0
+
+    @property
+    def failed(self) -> bool:
+        return self.status in FAILED_STATUSES
+
+
+@dataclass
+class SuiteRun:
+    """
+    The results of running a unit tests module.
+
+    Attributes:
+        cases: The results of the tests that ran.
+        complete: False if the run stopped before running all the tests, on the first failure or because a test ran
+            out of time or crashed the process running it.
+        output: Whatever the tests printed.
+    """
+    cases: list[CaseResult] = field(default_factory=list)
+    complete: bool = True
+    output: str = ''
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'SuiteRun':
+        return cls(cases=[CaseResult(**case) for case in data['cases']], complete=data['complete'],
+                   output=data['output'])
+
+    @classmethod
+    def of_crash(cls, name: str, details: str) -> 'SuiteRun':
+        return cls(cases=[CaseResult(name, 'error', details)])
+
+    @property
+    def failed_cases(self) -> list[CaseResult]:
+        return [case for case in self.cases if case.failed]
+
+    @property
+    def tests_run(self) -> int:
+        return len(self.cases)
+
+    @property
+    def failures(self) -> int:
+        return sum(1 for case in self.cases if case.status == 'failed')
+
+    @property
+    def errors(self) -> int:
+        return sum(1 for case in self.cases if case.status == 'error')
+
+    @property
+    def passed(self) -> bool:
+        return len(self.failed_cases) == 0
+
+    @property
+    def passing(self) -> int:
+        return sum(1 for case in self.cases if case.status == 'passed')
+
+    def slowest(self, count: int = 5) -> list[CaseResult]:
+        return sorted(self.cases, key=lambda case: case.duration, reverse=True)[:count]
+
+    @property
+    def stderr(self) -> str:
+        """
+        The failures formatted like the output of `python -m unittest`.
+        """
+        separator = '=' * 70
+        lines = []
+        for case in self.failed_cases:
+            lines += [separator, f'{"FAIL" if case.status == "failed" else "ERROR"}: {case.name}', '-' * 70,
+                      case.traceback or '']
+
+        slow = [case for case in self.slowest() if case.duration >= SLOW_TEST_SECONDS]
+        if slow:
+            lines += ['', 'Slowest test durations', '-' * 70]
+            lines += [f'{case.duration:.3f}s     {case.name}' for case in slow]
+
+        duration = sum(case.duration for case in self.cases)
+        lines += ['-' * 70, f'Ran {self.tests_run} test{"" if self.tests_run == 1 else "s"} in {duration:.3f}s', '']
+        if self.passed:
+            lines.append('OK')
+        else:
+            lines.append(f'FAILED (failures={self.failures}, errors={self.errors})')
+        if not self.complete:
+            lines.append('Stopped early, the remaining tests did not run.')
+        return '\n'.join(lines)
+
+
+class _RecordingResult(unittest.TestResult):
+    def __init__(self, report: Callable[[dict], None]):
+        super().__init__()
+        self.cases: list[CaseResult] = []
+        self._started: Optional[float] = None
+        self._report = report
+
+    def startTest(self, test):
+        super().startTest(test)
+        self._started = time.perf_counter()
+        self._report({'event': 'start', 'name': test.id()})
+
+    def _record(self, test, status: str, err=None) -> None:
+        duration = time.perf_counter() - self._started if self._started is not None else 0.0
+        details = self._exc_info_to_string(err, test) if err is not None else None
+        case = CaseResult(test.id(), status, details, duration)
+        self.cases.append(case)
+        self._report({'event': 'case', 'case': asdict(case)})
+
+    def addSuccess(self, test):
+        super().addSuccess(test)
+        self._record(test, 'passed')
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self._record(test, 'failed', err)
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self._record(test, 'error', err)
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self._record(test, 'skipped')
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self._record(test, 'passed')
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self._record(test, 'failed')
+
+    def addSubTest(self, test, subtest, err):
+        super().addSubTest(test, subtest, err)
+        if err is not None:
+            self._record(subtest, 'failed' if issubclass(err[0], test.failureException) else 'error', err)
+
+
+def _flatten(suite: unittest.TestSuite) -> Iterator[unittest.TestCase]:
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from _flatten(test)
+        else:
+            yield test
+
+
+def _file_signature(file_name: str) -> Optional[str]:
+    # Content based, since a fix may be written within the mtime resolution of the previous version
+    try:
+        with open(file_name, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+class _Worker:
+    """
+    The test executing side, which lives in its own process and keeps the modules it imported between runs.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = os.path.abspath(directory)
+        self.signatures: dict[str, Optional[str]] = {}
+
+    def _purge_modules(self, test_module: str) -> None:
+        # The test module always reloads, so it picks up the new versions of the modules it imports
+        for name, module in list(sys.modules.items()):
+            file_name = getattr(module, '__file__', None)
+            if not file_name or os.path.dirname(os.path.abspath(file_name)) != self.directory:
+                continue
+            if name == test_module or self.signatures.get(file_name) != _file_signature(file_name):
+                del sys.modules[name]
+
+    def _remember_modules(self) -> None:
+        for module in list(sys.modules.values()):
+            file_name = getattr(module, '__file__', None)
+            if file_name and os.path.dirname(os.path.abspath(file_name)) == self.directory:
+                self.signatures[file_name] = _file_signature(file_name)
+
+    def run(self, test_module: str, priority: Iterable[str] = (), failfast: bool = True,
+            shard: Optional[tuple[int, int]] = None, report: Callable[[dict], None] = lambda event: None) -> SuiteRun:
+        """
+        Runs the tests of test_module, or with shard=(index, count), every count-th test starting from index.
+        """
+        self._purge_modules(test_module)
+        importlib.invalidate_caches()
+
+        output = io.StringIO()
+        result = _RecordingResult(report)
+        complete = True
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            tests = list(_flatten(unittest.defaultTestLoader.loadTestsFromName(test_module)))
+            self._remember_modules()
+            if shard is not None:
+                index, count = shard
+                tests = tests[index::count]
+
+            priority = set(priority)
+            first = [test for test in tests if test.id() in priority]
+            rest = [test for test in tests if test.id() not in priority]
+            if first:
+                result.failfast = failfast
+                unittest.TestSuite(first)(result)
+                result.failfast = False
+                if result.shouldStop:
+                    complete = False
+            if complete:
+                unittest.TestSuite(rest)(result)
+
+        return SuiteRun(cases=result.cases, complete=complete, output=output.getvalue())
+
+
+def _serve(protocol) -> None:
+    def report(event: dict) -> None:
+        protocol.write(json.dumps(event) + '\n')
+        protocol.flush()
+
+    worker = _Worker(os.getcwd())
+    for line in sys.stdin:
+        request = json.loads(line)
+        test_module = request['test_module']
+        try:
+            apply_limits(request.get('cpu_seconds'), request.get('memory_bytes'))
+            shard = request.get('shard')
+            run = worker.run(test_module, request.get('priority', []), request.get('failfast', True),
+                             tuple(shard) if shard else None, report)
+        except BaseException:
+            run = SuiteRun.of_crash(test_module, traceback.format_exc())
+        report({'event': 'done', 'run': asdict(run)})
+
+
+def _module_name(test_module_file_name: str) -> str:
+    return test_module_file_name[:-3] if test_module_file_name.endswith('.py') else test_module_file_name
+
+
+class _EventReader:
+    """
+    Reads the events a worker process writes, one JSON object per line, waiting for each at most a given time.
+    """
+
+    def __init__(self, stream):
+        self._fd = stream.fileno()
+        self._buffer = b''
+
+    def read(self, timeout: Optional[float]) -> Optional[dict]:
+        """
+        Returns the next event, or None if the process closed its output. Raises a TimeoutError if it did not write
+        one within timeout seconds.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while b'\n' not in self._buffer:
+            remaining = max(deadline - time.monotonic(), 0) if deadline is not None else None
+            ready, _, _ = select.select([self._fd], [], [], remaining)
+            if not ready:
+                raise TimeoutError
+            chunk = os.read(self._fd, 65536)
+            if not chunk:
+                return None
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return json.loads(line)
+
+
+class _WorkerProcess:
+    def __init__(self, cwd: str, python: str):
+        self.process = subprocess.Popen(
+            [python, os.path.abspath(__file__), '--serve'],
+            cwd=cwd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        self.events = _EventReader(self.process.stdout)
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def send(self, request: dict) -> None:
+        try:
+            self.process.stdin.write((json.dumps(request) + '\n').encode())
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            # The process died, which collect reports
+            pass
+
+    def collect(self, test_module: str, limits: Limits) -> SuiteRun:
+        """
+        Reads the results of a run. If a test runs out of time, or the process dies, the process is stopped and the
+        test that was running is reported as an error, along with the results of the tests that ran before it.
+        """
+        cases: list[CaseResult] = []
+        current = test_module
+        started = test_started = time.monotonic()
+        deadline = started + limits.wall_seconds if limits.wall_seconds is not None else None
+        while True:
+            timeout = limits.test_seconds
+            if deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0)
+                timeout = remaining if timeout is None else min(timeout, remaining)
+            try:
+                event = self.events.read(timeout)
+            except TimeoutError:
+                self.kill()
+                if deadline is not None and time.monotonic() >= deadline:
+                    details = f'TimeoutError: The tests did not finish within {limits.wall_seconds:g}s'
+                else:
+                    details = f'TimeoutError: The test did not finish within {limits.test_seconds:g}s'
+                return self._interrupted(cases, current, details, time.monotonic() - test_started)
+            if event is None:
+                details = self._exit_reason(limits)
+                self.kill()
+                return self._interrupted(cases, current, details, time.monotonic() - test_started)
+
+            if event['event'] == 'start':
+                current, test_started = event['name'], time.monotonic()
+            elif event['event'] == 'case':
+                cases.append(CaseResult(**event['case']))
+                if event['case']['name'] == current:
+                    current = test_module
+            else:
+                return SuiteRun.from_dict(event['run'])
+
+    @staticmethod
+    def _interrupted(cases: list[CaseResult], current: str, details: str, duration: float) -> SuiteRun:
+        return SuiteRun(cases=cases + [CaseResult(current, 'error', details, duration)], complete=False)
+
+    def _exit_reason(self, limits: Limits) -> str:
+        code = self.process.wait()
+        if code == -signal.SIGXCPU:
+            return f'RuntimeError: The tests used more than {limits.cpu_seconds}s of CPU time'
+        if code < 0:
+            return f'RuntimeError: The test process was killed by {signal.Signals(-code).name}'
+        return f'RuntimeError: The test process exited unexpectedly with code {code}'
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+    def close(self) -> None:
+        self.process.stdin.close()
+        self.process.wait()
+        self.process.stdout.close()
+
+
+def _merge_shards(runs: list[SuiteRun]) -> SuiteRun:
+    # A module that can not be loaded is reported by every shard
+    cases: dict[str, CaseResult] = {}
+    for run in runs:
+        for case in run.cases:
+            cases.setdefault(case.name, case)
+    return SuiteRun(cases=list(cases.values()), complete=all(run.complete for run in runs),
+                    output=''.join(run.output for run in runs))
+
+
+class SuiteWorker:
+    """
+    Runs unit tests in persistent worker processes, so the interpreter startup and imports are paid only once.
+
+    Between runs, the workers reload only the modules of cwd whose files changed. Tests that are given as priority run
+    first, stopping on the first failure when failfast is set, and the rest of the tests run only if they all pass.
+    The workers run with the python interpreter given, e.g. of a virtualenv with the dependencies of the module.
+
+    The tests are untrusted, so they run in a sandbox, a copy of the python files of cwd, within the limits given. A
+    test that runs out of time, or kills its worker, fails without failing the tests that ran before it, and the
+    worker is replaced on the next run. With shards > 1, the tests are split between that many workers which run them
+    in parallel, and every shard runs its priority tests first.
+    """
+
+    def __init__(self, cwd: str = '.', python: str = sys.executable, limits: Limits = DEFAULT_LIMITS,
+                 shards: int = 1):
+        self.cwd = cwd
+        self.python = python
+        self.limits = limits
+        self.shards = shards
+        self._sandbox: Optional[Sandbox] = None
+        self._processes: list[Optional[_WorkerProcess]] = [None] * shards
+
+    def _ensure_started(self, shard: int) -> _WorkerProcess:
+        if self._sandbox is None:
+            self._sandbox = Sandbox(self.cwd)
+        process = self._processes[shard]
+        if process is None or not process.alive:
+            process = self._processes[shard] = _WorkerProcess(self._sandbox.path, self.python)
+        return process
+
+    def run(self, test_module_file_name: str, priority: Iterable[str] = (), failfast: bool = True) -> SuiteRun:
+        with tracer.span(test_module_file_name, TESTS, worker=True, shards=self.shards) as span:
+            suite_run = self._run(test_module_file_name, priority, failfast)
+            span.update(tests_run=suite_run.tests_run, failed=len(suite_run.failed_cases))
+            return suite_run
+
+    def _run(self, test_module_file_name: str, priority: Iterable[str], failfast: bool) -> SuiteRun:
+        test_module = _module_name(test_module_file_name)
+        processes = [self._ensure_started(shard) for shard in range(self.shards)]
+        self._sandbox.sync()
+
+        request = {'test_module': test_module, 'priority': list(priority), 'failfast': failfast,
+                   'cpu_seconds': self.limits.cpu_seconds, 'memory_bytes': self.limits.memory_bytes}
+        for shard, process in enumerate(processes):
+            process.send({**request, 'shard': [shard, self.shards] if self.shards > 1 else None})
+
+        if len(processes) == 1:
+            return processes[0].collect(test_module, self.limits)
+        # The workers run the shards in parallel, threads only wait for their results, so each is timed separately
+        with ThreadPoolExecutor(max_workers=len(processes)) as executor:
+            runs = list(executor.map(lambda process: process.collect(test_module, self.limits), processes))
+        return _merge_shards(runs)
+
+    def close(self) -> None:
+        for process in self._processes:
+            if process is not None and process.alive:
+                process.close()
+        self._processes = [None] * self.shards
+        if self._sandbox is not None:
+            self._sandbox.cleanup()
+            self._sandbox = None
+
+    def __enter__(self) -> 'SuiteWorker':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def run_unit_tests(test_module_file_name: str, cwd: str = '.', python: str = sys.executable,
+                   limits: Limits = DEFAULT_LIMITS, shards: int = 1) -> SuiteRun:
+    """
+    Runs a unit tests module once, in fresh worker processes.
+    """
+    with tracer.span(test_module_file_name, TESTS, worker=False, shards=shards) as span:
+        with SuiteWorker(cwd, python, limits, shards) as worker:
+            suite_run = worker._run(test_module_file_name, priority=(), failfast=False)
+        span.update(tests_run=suite_run.tests_run, failed=len(suite_run.failed_cases))
+        return suite_run
+
+
+if __name__ == '__main__':
+    # Tests may print or spawn processes, so the results are written to a duplicate of stdout, and fd 1 goes to stderr
+    protocol_stream = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+    sys.dont_write_bytecode = True
+    sys.path.insert(0, os.getcwd())
+    _serve(protocol_stream)
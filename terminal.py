@@ -0,0 +1,31 @@
+import contextlib
+import sys
+from typing import ContextManager
+
+# Set by the runner for machine readable output: no spinners or highlighting, even in a terminal
+quiet = False
+
+
+def rendering() -> bool:
+    """
+    Whether spinners and highlighting are rendered, which they are only for a terminal.
+    """
+    return not quiet and sys.stdout.isatty()
+
+
+def spinner(text: str = 'Thinking...') -> ContextManager:
+    if not rendering():
+        return contextlib.nullcontext()
+    # halo is only imported when a spinner is shown, which a batch worker or a piped run never does
+    from halo import Halo
+    return Halo(text=text, spinner='dots')
+
+
+def print_code(code: str, language: str = 'python') -> None:
+    if not rendering():
+        print(code)
+        return
+    from pygments import highlight
+    from pygments.formatters.terminal import TerminalFormatter
+    from pygments.lexers import get_lexer_by_name
+    print(highlight(code, get_lexer_by_name(language), TerminalFormatter()))
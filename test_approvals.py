@@ -0,0 +1,101 @@
+import os
+import tempfile
+import unittest
+
+import yaml
+
+from approvals import AutoApproval, ValidReplyApproval
+from backends import ReplayBackend, ScriptedReply
+from chat import ChatMessage, ChatWithCallback
+from replay_testing import ReplayTestCase
+from tester import check_tests_run
+
+
+class TestApprovalPolicies(ReplayTestCase):
+
+    def _chat(self, replies: list[str], approval) -> ChatWithCallback:
+        self.replay(ReplayBackend(script=[ScriptedReply(r'.', replies)]))
+        return ChatWithCallback(callback=yaml.safe_load, messages=[ChatMessage.of_user('Reply with yaml')],
+                                approval=approval)
+
+    def test_auto_approval_accepts_the_first_reply(self):
+        # Given
+        yaml_chat = self._chat(['a: 1', 'a: 2'], AutoApproval())
+
+        # When
+        result = yaml_chat.run()
+
+        # Then
+        self.assertEqual(result, {'a': 1})
+
+    def test_auto_approval_fails_on_an_invalid_reply(self):
+        # Given
+        yaml_chat = self._chat(['a: [1', 'a: 2'], AutoApproval())
+
+        # When / Then
+        with self.assertRaises(yaml.YAMLError):
+            yaml_chat.run()
+
+    def test_valid_reply_approval_sends_the_error_back(self):
+        # Given
+        yaml_chat = self._chat(['a: [1', 'a: 2'], ValidReplyApproval())
+
+        # When
+        result = yaml_chat.run()
+
+        # Then
+        self.assertEqual(result, {'a': 2})
+        self.assertIn('could not use your reply', yaml_chat.chat_history.messages[-2].content)
+
+    def test_valid_reply_approval_gives_up_after_max_repairs(self):
+        # Given
+        yaml_chat = self._chat(['a: [1'], ValidReplyApproval(max_repairs=1))
+
+        # When / Then
+        with self.assertRaises(yaml.YAMLError):
+            yaml_chat.run()
+        self.assertEqual(len([m for m in yaml_chat.chat_history.messages if m.role == 'assistant']), 2)
+
+
+class TestCheckTestsRun(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.directory.name, 'adder.py'), 'w') as f:
+            f.write('def add(a, b):\n    return a - b\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_failing_tests_are_accepted(self):
+        # Given
+        tests = 'import unittest\nfrom adder import add\n\n\nclass T(unittest.TestCase):\n' \
+                '    def test_add(self):\n        self.assertEqual(add(1, 2), 3)\n'
+
+        # When / Then
+        check_tests_run(self.directory.name, 'adder.py', tests)
+
+    def test_tests_that_cannot_be_loaded_are_rejected(self):
+        # Given
+        tests = 'import unittest\nfrom adder import subtract\n'
+
+        # When / Then
+        with self.assertRaisesRegex(ValueError, 'could not be loaded'):
+            check_tests_run(self.directory.name, 'adder.py', tests)
+
+    def test_tests_with_a_syntax_error_are_rejected(self):
+        # Given
+        tests = 'import unittest\n\n\nclass T(unittest.TestCase):\n    def test_add(self)\n        pass\n'
+
+        # When / Then
+        with self.assertRaisesRegex(ValueError, 'could not be loaded'):
+            check_tests_run(self.directory.name, 'adder.py', tests)
+
+    def test_tests_raising_when_loaded_are_rejected(self):
+        # Given
+        tests = 'import unittest\nfrom adder import add\n\nTOTAL = add(1, None)\n\n\nclass T(unittest.TestCase):\n' \
+                '    def test_add(self):\n        self.assertEqual(add(1, 2), 3)\n'
+
+        # When / Then
+        with self.assertRaisesRegex(ValueError, 'could not be loaded'):
+            check_tests_run(self.directory.name, 'adder.py', tests)
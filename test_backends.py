@@ -0,0 +1,107 @@
+import os
+import tempfile
+import unittest
+
+from approvals import AutoApproval
+from backends import RecordingBackend, ReplayBackend, ScriptedReply
+from chat import ChatMessage, ChatWithCallback
+from client import CallStats, LLMClient
+from markdown_parser import first_code_block
+from replay_testing import ReplayTestCase
+
+MESSAGES = [{'role': 'system', 'content': 'You are helpful.'}, {'role': 'user', 'content': 'Implement adder please'}]
+
+
+class TestReplayBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+
+    def _client(self, backend: ReplayBackend) -> LLMClient:
+        client = LLMClient(backend=backend, base_delay=0.001, max_delay=0.01)
+        self.clients.append(client)
+        return client
+
+    def test_scripted_reply_substitutes_named_groups(self):
+        # Given
+        client = self._client(ReplayBackend(script=[ScriptedReply(r'Implement (?P<name>\w+)', ['def {name}(): ...'])]))
+
+        # When
+        response = client.complete('gpt-3.5-turbo', MESSAGES)
+
+        # Then
+        self.assertEqual(response['choices'][0]['message']['content'], 'def adder(): ...')
+
+    def test_scripted_replies_follow_the_conversation(self):
+        # Given
+        client = self._client(ReplayBackend(script=[ScriptedReply(r'.', ['first', 'second'])]))
+        messages = MESSAGES + [{'role': 'assistant', 'content': 'first'}, {'role': 'user', 'content': 'again'}]
+
+        # When
+        deltas = list(client.stream('gpt-3.5-turbo', messages))
+
+        # Then
+        self.assertEqual(''.join(deltas), 'second')
+
+    def test_injected_errors_are_retried(self):
+        # Given
+        backend = ReplayBackend(script=[ScriptedReply(r'.', ['ok'])], error_rate=0.5, seed=1)
+        client = self._client(backend)
+        stats = CallStats()
+
+        # When
+        replies = [client.complete('gpt-3.5-turbo', MESSAGES, stats)['choices'][0]['message']['content']
+                   for _ in range(10)]
+
+        # Then
+        self.assertEqual(replies, ['ok'] * 10)
+        self.assertGreater(backend.errors, 0)
+        self.assertEqual(stats.retries, backend.errors)
+
+    def test_recorded_replies_are_replayed(self):
+        # Given
+        with tempfile.TemporaryDirectory() as directory:
+            fixtures = os.path.join(directory, 'fixtures.jsonl')
+            recording = self._client(RecordingBackend(ReplayBackend(script=[ScriptedReply(r'.', ['recorded'])]),
+                                                      fixtures))
+            recording.complete('gpt-3.5-turbo', MESSAGES, temperature=0)
+            list(recording.stream('gpt-3.5-turbo', MESSAGES))
+
+            # When
+            replay = self._client(ReplayBackend.from_file(fixtures))
+            completed = replay.complete('gpt-3.5-turbo', MESSAGES, temperature=0)
+            streamed = ''.join(replay.stream('gpt-3.5-turbo', MESSAGES))
+
+        # Then
+        self.assertEqual(completed['choices'][0]['message']['content'], 'recorded')
+        self.assertEqual(streamed, 'recorded')
+
+
+class TestRecordedChats(ReplayTestCase):
+
+    def test_stream_stopped_at_the_first_code_block_is_recorded(self):
+        # Given
+        reply = '```python\nprint("hello")\n```\nThis prints hello, and is followed by a long explanation.'
+        script = [ScriptedReply(r'.', [reply])]
+
+        def run_chat() -> str:
+            return ChatWithCallback(callback=lambda content: first_code_block(content).code, stream=True,
+                                    messages=[ChatMessage.of_user('go')], approval=AutoApproval()).run()
+
+        # When
+        with tempfile.TemporaryDirectory() as directory:
+            fixtures = os.path.join(directory, 'fixtures.jsonl')
+            self.replay(RecordingBackend(ReplayBackend(script=script, chunk_size=4, latency_per_token=0.01), fixtures))
+            recorded = run_chat()
+            # The stopped stream is recorded by the time its client is closed
+            self.close_replay()
+            self.replay(ReplayBackend.from_file(fixtures))
+            replayed = run_chat()
+
+        # Then
+        self.assertEqual(recorded, 'print("hello")')
+        self.assertEqual(replayed, 'print("hello")')
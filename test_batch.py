@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+import unittest
+
+from batch import BatchItem, load_requirements, run_batch
+from replay_testing import ReplayTestCase
+from test_checkpoint import SCRIPT
+
+
+class TestLoadRequirements(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _write(self, file_name: str, content: str) -> str:
+        path = os.path.join(self.directory.name, file_name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_jsonl_holds_a_requirement_per_line(self):
+        # Given
+        path = self._write('batch.jsonl', '"Add numbers"\n\n{"id": "sort", "requirement": "Sort numbers"}\n')
+
+        # When
+        items = load_requirements(path)
+
+        # Then
+        self.assertEqual(items, [BatchItem('0000', 'Add numbers'), BatchItem('sort', 'Sort numbers')])
+
+    def test_yaml_holds_a_list_of_requirements(self):
+        # Given
+        path = self._write('batch.yaml', '- Add numbers\n- id: sort\n  requirement: Sort numbers\n')
+
+        # When
+        items = load_requirements(path)
+
+        # Then
+        self.assertEqual(items, [BatchItem('0000', 'Add numbers'), BatchItem('sort', 'Sort numbers')])
+
+    def test_malformed_line_is_reported_with_its_number(self):
+        # Given
+        path = self._write('batch.jsonl', '"Add numbers"\n{"requirement": \n')
+
+        # When / Then
+        with self.assertRaisesRegex(ValueError, 'Line 2 of'):
+            load_requirements(path)
+
+    def test_record_without_a_requirement_is_rejected(self):
+        # Given
+        path = self._write('batch.jsonl', '{"id": "sort"}\n')
+
+        # When / Then
+        with self.assertRaisesRegex(ValueError, 'Requirement 1'):
+            load_requirements(path)
+
+    def test_duplicate_ids_are_rejected(self):
+        # Given
+        path = self._write('batch.yaml', '- {id: a, requirement: Add numbers}\n- {id: a, requirement: Sort numbers}\n')
+
+        # When / Then
+        with self.assertRaisesRegex(ValueError, 'unique'):
+            load_requirements(path)
+
+
+class TestRunBatch(ReplayTestCase):
+    script = SCRIPT
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super().tearDown()
+        self.directory.cleanup()
+
+    def test_manifest_describes_every_result(self):
+        # Given
+        file_name = os.path.join(self.directory.name, 'batch.jsonl')
+        with open(file_name, 'w') as f:
+            f.write('{"id": "first", "requirement": "Add numbers"}\n{"id": "second", "requirement": "Add more"}\n')
+        output_dir = os.path.join(self.directory.name, 'out')
+
+        # When
+        results = run_batch(file_name, output_dir, workers=2)
+
+        # Then
+        with open(os.path.join(output_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+        self.assertEqual([result.status for result in results], ['passed', 'passed'])
+        self.assertEqual([result['id'] for result in manifest['results']], ['first', 'second'])
+        self.assertEqual([result['status'] for result in manifest['results']], ['passed', 'passed'])
+        self.assertEqual(manifest['approval'], 'auto')
+        self.assertTrue(os.path.exists(os.path.join(output_dir, 'first', 'adder.py')))
@@ -0,0 +1,153 @@
+import os
+import tempfile
+import time
+import unittest
+
+import chat
+from backends import ReplayBackend, ScriptedReply
+from cache import MemoryCompletionCache, SqliteCompletionCache, completion_key
+from replay_testing import ReplayTestCase
+
+
+class TestCompletionKey(unittest.TestCase):
+
+    def test_same_request_same_key(self):
+        # Given
+        messages = [{'role': 'user', 'content': 'Write a module'}]
+
+        # When
+        first = completion_key('gpt-3.5-turbo', messages, {})
+        second = completion_key('gpt-3.5-turbo', [dict(message) for message in messages], {})
+
+        # Then
+        self.assertEqual(first, second)
+
+    def test_formatting_whitespace_is_ignored(self):
+        # Given
+        indented = [{'role': 'user', 'content': '\n        Write a module   \n        '}]
+        compact = [{'role': 'user', 'content': 'Write a module'}]
+
+        # When
+        indented_key = completion_key('gpt-3.5-turbo', indented, {})
+        compact_key = completion_key('gpt-3.5-turbo', compact, {})
+
+        # Then
+        self.assertEqual(indented_key, compact_key)
+
+    def test_model_and_params_change_key(self):
+        # Given
+        messages = [{'role': 'user', 'content': 'Write a module'}]
+
+        # When
+        keys = {
+            completion_key('gpt-3.5-turbo', messages, {}),
+            completion_key('gpt-4', messages, {}),
+            completion_key('gpt-3.5-turbo', messages, {'temperature': 0.5}),
+        }
+
+        # Then
+        self.assertEqual(len(keys), 3)
+
+
+class TestMemoryCompletionCache(unittest.TestCase):
+
+    def test_least_recently_used_is_evicted(self):
+        # Given
+        cache = MemoryCompletionCache(max_entries=2)
+        cache.put('a', ['A'])
+        cache.put('b', ['B'])
+        cache.get('a')
+
+        # When
+        cache.put('c', ['C'])
+
+        # Then
+        self.assertEqual(cache.get('a'), ['A'])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats.evictions, 1)
+
+
+class TestCachedCompletions(ReplayTestCase):
+
+    def test_stream_stopped_early_does_not_truncate_the_completion(self):
+        # Given
+        reply = '```python\nx = 1\n```\nThis sets x, and is followed by a long explanation.'
+        self.replay(ReplayBackend(script=[ScriptedReply(r'.', [reply])], chunk_size=4))
+        chat.completion_cache = MemoryCompletionCache()
+        messages = [{'role': 'user', 'content': 'go'}]
+        stream = chat.stream_completion('gpt-3.5-turbo', messages)
+        streamed = next(stream)
+        stream.close()
+
+        # When
+        completion = chat.create_completion('gpt-3.5-turbo', messages)
+
+        # Then
+        self.assertNotEqual(streamed, reply)
+        self.assertEqual(completion, reply)
+
+
+class TestSqliteCompletionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cache.sqlite')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_hits_and_misses_are_counted(self):
+        # Given
+        cache = SqliteCompletionCache(self.path)
+        cache.put('key', ['content'])
+
+        # When
+        hit = cache.get('key')
+        miss = cache.get('other')
+
+        # Then
+        self.assertEqual(hit, ['content'])
+        self.assertIsNone(miss)
+        self.assertEqual((cache.stats.hits, cache.stats.misses), (1, 1))
+        cache.close()
+
+    def test_entries_survive_reopening(self):
+        # Given
+        cache = SqliteCompletionCache(self.path)
+        cache.put('key', ['first choice', 'second choice'])
+        cache.close()
+
+        # When
+        reopened = SqliteCompletionCache(self.path)
+
+        # Then
+        self.assertEqual(reopened.get('key'), ['first choice', 'second choice'])
+        reopened.close()
+
+    def test_expired_entries_are_misses(self):
+        # Given
+        cache = SqliteCompletionCache(self.path, ttl=0.01)
+        cache.put('key', ['content'])
+        time.sleep(0.02)
+
+        # When
+        value = cache.get('key')
+
+        # Then
+        self.assertIsNone(value)
+        self.assertEqual(len(cache), 0)
+        cache.close()
+
+    def test_size_cap_evicts_least_recently_used(self):
+        # Given
+        cache = SqliteCompletionCache(self.path, max_bytes=40)
+        cache.put('old', ['x' * 10])
+        cache.put('new', ['y' * 10])
+
+        # When
+        cache.put('newest', ['z' * 10])
+
+        # Then
+        self.assertIsNone(cache.get('old'))
+        self.assertEqual(cache.get('newest'), ['z' * 10])
+        cache.close()
@@ -0,0 +1,60 @@
+import unittest
+
+from approvals import AutoApproval
+from backends import ReplayBackend, ScriptedReply
+from chat import SUPERSEDED_CODE, ChatHistory, ChatMessage, ChatWithCallback
+from markdown_parser import first_code_block
+from replay_testing import ReplayTestCase
+
+
+def _history() -> ChatHistory:
+    return ChatHistory([
+        ChatMessage.of_system('You are an experienced python software engineer.'),
+        ChatMessage.of_user('Fix the module so that the unit tests will pass.'),
+        ChatMessage.of_assistant('```python\ndef add(a, b):\n' + '    a = int(a)\n' * 50 + '    return a + b\n```'),
+        ChatMessage.of_user('The unit tests are still failing:\n' + '  File "adder.py", line 2, in add\n' * 40),
+        ChatMessage.of_assistant('```python\ndef sub(a, b):\n    return a - b\n```'),
+    ])
+
+
+class TestChatHistoryCompact(unittest.TestCase):
+
+    def test_superseded_code_is_omitted(self):
+        # Given
+        history = _history()
+
+        # When
+        history.compact(history.token_count() - 10)
+
+        # Then
+        self.assertIn(SUPERSEDED_CODE, history.messages[2].content)
+        self.assertIn('def sub', history.messages[4].content)
+
+    def test_earlier_patches_are_kept(self):
+        # Given
+        history = _history()
+
+        # When
+        history.compact(history.token_count() - 10, patches=True)
+
+        # Then
+        self.assertEqual(len(history.messages), 5)
+        self.assertIn('def add', history.messages[2].content)
+        self.assertIn('def sub', history.messages[4].content)
+
+
+class TestChatWithCallback(ReplayTestCase):
+
+    def test_stream_stops_at_the_first_block_in_the_language(self):
+        # Given
+        reply = 'Install it first:\n```bash\npip install requests\n```\n```python\nimport requests\n```\nDone.'
+        self.replay(ReplayBackend(script=[ScriptedReply(r'.', [reply])], chunk_size=4))
+        code_chat = ChatWithCallback(callback=lambda content: first_code_block(content, 'python').code, stream=True,
+                                     language='python', messages=[ChatMessage.of_user('go')], approval=AutoApproval())
+
+        # When
+        code = code_chat.run()
+
+        # Then
+        self.assertEqual(code, 'import requests')
+        self.assertNotIn('Done.', code_chat.chat_history.last_assistant_reply())
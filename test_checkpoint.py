@@ -0,0 +1,69 @@
+import os
+import tempfile
+
+from approvals import AutoApproval
+from backends import ReplayBackend, ScriptedReply
+from chat import ChatHistory, ChatMessage
+from checkpoint import Checkpoint
+from pipeline import Pipeline
+from replay_testing import ReplayTestCase
+
+SCRIPT = [
+    ScriptedReply(r'Description:', ['```yaml\nname: adder\ndescription: Adds\napi: |\n  def add(a, b): ...\n```']),
+    ScriptedReply(r'Module name:', ['```yaml\ndependencies: []\ncode: |\n  def add(a, b):\n      return a + b\n```']),
+    ScriptedReply(r'unit tests file', ['```python\nimport unittest\nfrom adder import add\n\n\n'
+                                       'class TestAdd(unittest.TestCase):\n    def test_add(self):\n'
+                                       '        self.assertEqual(add(1, 2), 3)\n```']),
+]
+
+
+class TestCheckpoint(ReplayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super().tearDown()
+        self.directory.cleanup()
+
+    def _run(self, resume: bool) -> tuple[str, ReplayBackend]:
+        backend = self.replay(ReplayBackend(script=SCRIPT))
+        result = Pipeline('Add numbers', work_dir=self.directory.name, approval=AutoApproval(), resume=resume).run()
+        return result.status, backend
+
+    def test_resumed_run_skips_completed_stages(self):
+        # Given
+        self._run(resume=False)
+
+        # When
+        status, backend = self._run(resume=True)
+
+        # Then
+        self.assertEqual(status, 'passed')
+        self.assertEqual(backend.calls, 0)
+
+    def test_stages_after_a_missing_file_are_rerun(self):
+        # Given
+        self._run(resume=False)
+        os.remove(os.path.join(self.directory.name, 'test_adder.py'))
+
+        # When
+        status, backend = self._run(resume=True)
+
+        # Then
+        self.assertEqual(status, 'passed')
+        self.assertEqual(backend.calls, 1)
+
+    def test_progress_of_an_incomplete_stage_is_restored(self):
+        # Given
+        checkpoint = Checkpoint(self.directory.name, 'Add numbers')
+        checkpoint.record_progress('fix', ChatHistory([ChatMessage.of_user('Fix it')]), attempt=2)
+
+        # When
+        restored = Checkpoint.load(self.directory.name)
+
+        # Then
+        self.assertFalse(restored.completed('fix'))
+        self.assertEqual(restored.progress('fix'), {'attempt': 2})
+        self.assertEqual(restored.chat_history('fix').to_array_of_dicts(), [{'role': 'user', 'content': 'Fix it'}])
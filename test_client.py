@@ -0,0 +1,213 @@
+import asyncio
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import openai.error
+
+from backends import ReplayBackend, ScriptedReply
+from client import CallStats, LLMClient, TokenBucket
+
+MESSAGES = [{'role': 'user', 'content': 'Implement adder please'}]
+
+
+class FailingBackend(ReplayBackend):
+    """
+    A ReplayBackend whose first requests raise the given errors, and whose streams raise stream_error after their
+    first chunk.
+    """
+
+    def __init__(self, errors=(), stream_error=None, **kwargs):
+        super().__init__(script=[ScriptedReply(r'.', ['def add(a, b):\n    return a + b\n'])], chunk_size=4, **kwargs)
+        self.pending_errors = list(errors)
+        self.stream_error = stream_error
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def acreate(self, model, messages, **params):
+        if self.pending_errors:
+            self.calls += 1
+            raise self.pending_errors.pop(0)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            response = await super().acreate(model, messages, **params)
+        finally:
+            self.in_flight -= 1
+        if params.get('stream') and self.stream_error is not None:
+            return self._failing_stream(response)
+        return response
+
+    async def _failing_stream(self, chunks):
+        async for chunk in chunks:
+            yield chunk
+            raise self.stream_error
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_acquire_waits_for_the_refill(self):
+        # Given
+        bucket = TokenBucket(rate_per_minute=600, capacity=1)
+
+        async def acquire_twice() -> float:
+            await bucket.acquire(1)
+            start = time.monotonic()
+            await bucket.acquire(1)
+            return time.monotonic() - start
+
+        # When
+        waited = asyncio.run(acquire_twice())
+
+        # Then
+        self.assertGreaterEqual(waited, 0.08)
+
+    def test_consumed_usage_is_a_debt_waited_out(self):
+        # Given
+        bucket = TokenBucket(rate_per_minute=600, capacity=10)
+        bucket.consume(11)
+
+        # When
+        start = time.monotonic()
+        asyncio.run(bucket.acquire(1))
+        waited = time.monotonic() - start
+
+        # Then
+        self.assertGreaterEqual(waited, 0.15)
+
+    def test_amounts_over_the_capacity_do_not_wait_forever(self):
+        # Given
+        bucket = TokenBucket(rate_per_minute=60_000, capacity=10)
+
+        # When
+        asyncio.run(bucket.acquire(1000))
+
+        # Then
+        self.assertLessEqual(bucket.available, 0)
+
+
+class TestLLMClient(unittest.TestCase):
+
+    def setUp(self):
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+
+    def _client(self, backend: ReplayBackend, **kwargs) -> LLMClient:
+        client = LLMClient(backend=backend, **{'base_delay': 0.001, 'max_delay': 0.01, **kwargs})
+        self.clients.append(client)
+        return client
+
+    def test_requests_in_flight_are_limited(self):
+        # Given
+        backend = FailingBackend(latency=0.05)
+        client = self._client(backend, max_concurrency=2)
+
+        # When
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            list(executor.map(lambda _: client.complete('gpt-3.5-turbo', MESSAGES), range(6)))
+
+        # Then
+        self.assertEqual(backend.max_in_flight, 2)
+
+    def test_requests_per_minute_are_limited(self):
+        # Given
+        client = self._client(FailingBackend(), requests_per_minute=600)
+        client.complete('gpt-3.5-turbo', MESSAGES)
+        client._request_bucket.available = 0
+
+        # When
+        start = time.monotonic()
+        client.complete('gpt-3.5-turbo', MESSAGES)
+
+        # Then
+        self.assertGreaterEqual(time.monotonic() - start, 0.08)
+
+    def test_rate_limit_is_retried_after_the_delay_it_asks_for(self):
+        # Given
+        error = openai.error.RateLimitError('Slow down', http_status=429, headers={'retry-after': '0.2'})
+        backend = FailingBackend(errors=[error])
+        client = self._client(backend)
+        stats = CallStats()
+
+        # When
+        start = time.monotonic()
+        response = client.complete('gpt-3.5-turbo', MESSAGES, stats)
+
+        # Then
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertIn('def add', response['choices'][0]['message']['content'])
+        self.assertEqual(stats.retries, 1)
+
+    def test_backoff_is_capped_at_max_delay(self):
+        # Given
+        backend = FailingBackend(errors=[openai.error.ServiceUnavailableError('Down')] * 3)
+        client = self._client(backend, base_delay=10, max_delay=0.05)
+
+        # When
+        start = time.monotonic()
+        client.complete('gpt-3.5-turbo', MESSAGES)
+
+        # Then
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(client.retries, 3)
+
+    def test_errors_are_raised_once_the_retries_are_used_up(self):
+        # Given
+        backend = FailingBackend(errors=[openai.error.ServiceUnavailableError('Down')] * 3)
+        client = self._client(backend, max_retries=2)
+
+        # When / Then
+        with self.assertRaises(openai.error.ServiceUnavailableError):
+            client.complete('gpt-3.5-turbo', MESSAGES)
+        self.assertEqual(backend.calls, 3)
+
+    def test_invalid_requests_are_not_retried(self):
+        # Given
+        backend = ReplayBackend()
+        client = self._client(backend)
+
+        # When / Then
+        with self.assertRaises(openai.error.InvalidRequestError):
+            client.complete('gpt-3.5-turbo', MESSAGES)
+        self.assertEqual(client.retries, 0)
+
+    def test_stream_failing_before_its_first_delta_is_retried(self):
+        # Given
+        backend = FailingBackend(errors=[openai.error.APIConnectionError('Reset')])
+        client = self._client(backend)
+
+        # When
+        streamed = ''.join(client.stream('gpt-3.5-turbo', MESSAGES))
+
+        # Then
+        self.assertEqual(streamed, 'def add(a, b):\n    return a + b\n')
+        self.assertEqual(client.retries, 1)
+
+    def test_stream_failing_after_its_first_delta_is_not_retried(self):
+        # Given
+        backend = FailingBackend(stream_error=openai.error.APIConnectionError('Reset'))
+        client = self._client(backend)
+        deltas = []
+
+        # When / Then
+        with self.assertRaises(openai.error.APIConnectionError):
+            for delta in client.stream('gpt-3.5-turbo', MESSAGES):
+                deltas.append(delta)
+        self.assertEqual(deltas, ['def '])
+        self.assertEqual(client.retries, 0)
+
+    def test_closed_client_stops_its_loop_and_restarts_on_use(self):
+        # Given
+        client = self._client(FailingBackend())
+        client.complete('gpt-3.5-turbo', MESSAGES)
+        thread = client._thread
+
+        # When
+        client.close()
+
+        # Then
+        self.assertFalse(thread.is_alive())
+        self.assertIn('def add', client.complete('gpt-3.5-turbo', MESSAGES)['choices'][0]['message']['content'])
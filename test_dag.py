@@ -0,0 +1,94 @@
+import threading
+import time
+import unittest
+
+from dag import Stage, StageGraph
+
+
+class TestStageGraph(unittest.TestCase):
+
+    def test_outputs_are_passed_to_dependent_stages(self):
+        # Given
+        graph = StageGraph([
+            Stage('a', lambda: 2),
+            Stage('b', lambda a: a * 3, ['a']),
+            Stage('c', lambda a, b: a + b, ['a', 'b']),
+        ])
+
+        # When
+        outputs = graph.run()
+
+        # Then
+        self.assertEqual(outputs, {'a': 2, 'b': 6, 'c': 8})
+
+    def test_independent_stages_run_concurrently(self):
+        # Given
+        barrier = threading.Barrier(2, timeout=5)
+        graph = StageGraph([
+            Stage('a', lambda: None),
+            Stage('b', lambda a: barrier.wait(), ['a']),
+            Stage('c', lambda a: barrier.wait(), ['a']),
+        ])
+
+        # When
+        outputs = graph.run(max_workers=2)
+
+        # Then both stages reached the barrier at the same time
+        self.assertEqual(sorted([outputs['b'], outputs['c']]), [0, 1])
+
+    def test_single_worker_runs_stages_in_the_given_order(self):
+        # Given
+        order = []
+        graph = StageGraph([
+            Stage('a', lambda: order.append('a')),
+            Stage('b', lambda a: order.append('b'), ['a']),
+            Stage('c', lambda a: order.append('c'), ['a']),
+        ])
+
+        # When
+        graph.run(max_workers=1)
+
+        # Then
+        self.assertEqual(order, ['a', 'b', 'c'])
+
+    def test_failing_stage_stops_its_dependents(self):
+        # Given
+        ran = []
+
+        def fail(a):
+            time.sleep(0.01)
+            raise RuntimeError('failed')
+
+        graph = StageGraph([
+            Stage('a', lambda: None),
+            Stage('b', fail, ['a']),
+            Stage('c', lambda b: ran.append('c'), ['b']),
+        ])
+
+        # When / Then
+        with self.assertRaisesRegex(RuntimeError, 'failed'):
+            graph.run()
+        self.assertEqual(ran, [])
+
+    def test_cycles_are_rejected(self):
+        # Given
+        stages = [Stage('a', lambda b: None, ['b']), Stage('b', lambda a: None, ['a'])]
+
+        # When / Then
+        with self.assertRaisesRegex(ValueError, 'depend on each other'):
+            StageGraph(stages)
+
+    def test_dependents_are_transitive(self):
+        # Given
+        graph = StageGraph([
+            Stage('d', lambda c: None, ['c']),
+            Stage('a', lambda: None),
+            Stage('b', lambda: None),
+            Stage('c', lambda a: None, ['a']),
+        ])
+
+        # When
+        dependents = graph.dependents('a')
+
+        # Then
+        self.assertEqual(dependents, ['d', 'c'])
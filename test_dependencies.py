@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sysconfig
+import tempfile
+import unittest
+import venv
+
+from dependencies import DependencyManager, normalize_requirements, requirements_key
+
+
+class CountingDependencyManager(DependencyManager):
+    def __init__(self, root: str):
+        super().__init__(root)
+        self.checks = 0
+
+    def unsatisfied(self, python: str, requirements: list[str]) -> list[str]:
+        self.checks += 1
+        return super().unsatisfied(python, requirements)
+
+
+class TestDependencyManager(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.manager = CountingDependencyManager(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_equivalent_requirements_share_a_key(self):
+        # Given
+        requirements = ['rich', ' PyYAML', 'rich', '']
+
+        # When
+        normalized = normalize_requirements(requirements)
+
+        # Then
+        self.assertEqual(normalized, ['PyYAML', 'rich'])
+        self.assertEqual(requirements_key(requirements), requirements_key(['pyyaml', 'rich']))
+
+    def test_satisfied_requirements_are_available_without_installing(self):
+        # Given
+        requirements = ['rich', 'PyYAML']
+
+        # When
+        environment = self.manager.install(requirements)
+
+        # Then
+        self.assertTrue(environment.path.startswith(self.directory.name))
+        self.assertFalse(os.path.exists(self.manager.wheel_cache))
+        subprocess.run([environment.python, '-c', 'import rich, yaml'], check=True)
+
+    def test_environment_is_reused(self):
+        # Given
+        first = self.manager.install(['rich'])
+
+        # When
+        second = self.manager.install(['rich'])
+
+        # Then
+        self.assertEqual(first, second)
+        self.assertEqual(self.manager.checks, 1)
+
+    def test_environment_sees_the_packages_of_the_running_virtualenv(self):
+        # Given a virtualenv with a package that the base interpreter does not have
+        running = os.path.join(self.directory.name, 'running')
+        venv.create(running, system_site_packages=True, with_pip=False)
+        site_packages = sysconfig.get_path('purelib', vars={'base': running, 'platbase': running})
+        with open(os.path.join(site_packages, 'impllmentors_marker.py'), 'w') as f:
+            f.write('MARKER = 1\n')
+        script = ('import sys; from dependencies import DependencyManager; '
+                  'print(DependencyManager(sys.argv[1]).install([]).python)')
+
+        # When
+        output = subprocess.run([os.path.join(running, 'bin', 'python'), '-c', script,
+                                 os.path.join(self.directory.name, 'envs')], capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+        # Then
+        python = output.stdout.strip().splitlines()[-1]
+        subprocess.run([python, '-c', 'import impllmentors_marker'], check=True)
+        subprocess.run([python, '-m', 'pip', '--version'], check=True, capture_output=True)
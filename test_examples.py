@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+import yaml
+
+from analyzer import Analyzer
+from common import ModuleDetails
+from examples import Example, ExampleIndex, analysis_yaml
+
+
+def _example(requirement: str, name: str) -> Example:
+    return Example(requirement, ModuleDetails(name, f'{name}: utilities', f'def {name}(): ...'), f'def {name}(): ...',
+                   [], '')
+
+
+class TestExampleIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.directory.name, 'examples.jsonl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_nearest_examples_come_first(self):
+        # Given
+        index = ExampleIndex(self.file_name)
+        index.add(_example('Parse a CSV file into a list of dictionaries', 'csv_reader'))
+        index.add(_example('Compute the median of a list of numbers', 'median'))
+        index.add(_example('Compute the mean and the standard deviation of a list of numbers', 'stats'))
+
+        # When
+        nearest = index.nearest('Compute the standard deviation of numbers')
+
+        # Then
+        self.assertEqual([example.module.name for example in nearest], ['stats', 'median'])
+
+    def test_unrelated_examples_are_not_returned(self):
+        # Given
+        index = ExampleIndex(self.file_name)
+        index.add(_example('Parse a CSV file into a list of dictionaries', 'csv_reader'))
+
+        # When
+        nearest = index.nearest('Send an email over SMTP')
+
+        # Then
+        self.assertEqual(nearest, [])
+
+    def test_examples_are_persisted(self):
+        # Given
+        ExampleIndex(self.file_name).add(_example('Compute the median of a list of numbers', 'median'))
+
+        # When
+        index = ExampleIndex(self.file_name)
+
+        # Then
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.nearest('median of numbers')[0].module.name, 'median')
+
+    def test_examples_are_shown_in_the_prompt_as_valid_yaml(self):
+        # Given
+        example = _example('Compute the median of a list of numbers', 'median')
+
+        # When
+        analyzer = Analyzer('Compute the mode of a list of numbers', examples=[example])
+
+        # Then
+        prompt = analyzer.analyze_and_review_chat.chat_history.messages[-1].content
+        self.assertIn('Compute the median of a list of numbers', prompt)
+        self.assertNotIn('markdown_utils', prompt)
+        self.assertEqual(yaml.safe_load(analysis_yaml(example.module))['description'], 'median: utilities')
@@ -0,0 +1,101 @@
+import unittest
+
+from failure_report import failure_from_traceback, parse_pytest_output, parse_unittest_output
+
+UNITTEST_OUTPUT = '''F
+======================================================================
+FAIL: test_positive (test_adder.TestAdd.test_positive)
+----------------------------------------------------------------------
+Traceback (most recent call last):
+  File "/tmp/work/test_adder.py", line 6, in test_positive
+    self.assertEqual(add(1, 2), 3)
+AssertionError: -1 != 3
+
+----------------------------------------------------------------------
+Ran 1 test in 0.001s
+
+FAILED (failures=1)
+'''
+
+PYTEST_OUTPUT = '''F                                                                        [100%]
+=================================== FAILURES ===================================
+_______________________________ test_positive __________________________________
+
+    def test_positive():
+>       assert add(1, 2) == 3
+E       assert -1 == 3
+E        +  where -1 = add(1, 2)
+
+test_adder.py:5: AssertionError
+=========================== short test summary info ============================
+FAILED test_adder.py::test_positive - assert -1 == 3
+1 failed in 0.01s
+'''
+
+ERROR_TRACEBACK = '''Traceback (most recent call last):
+  File "/usr/lib/python3.11/unittest/case.py", line 57, in testPartExecutor
+    yield
+  File "/tmp/work/test_adder.py", line 9, in test_divide
+    divide(1, 0)
+  File "/tmp/work/adder.py", line 5, in divide
+    return a / b
+ZeroDivisionError: division by zero
+'''
+
+
+class TestParseUnittestOutput(unittest.TestCase):
+
+    def test_failure_details_are_extracted(self):
+        # Given
+        output = UNITTEST_OUTPUT
+
+        # When
+        failures = parse_unittest_output(output)
+
+        # Then
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(failures[0].test_id, 'test_adder.TestAdd.test_positive')
+        self.assertEqual(failures[0].kind, 'failure')
+        self.assertEqual((failures[0].expected, failures[0].actual), ('3', '-1'))
+
+    def test_no_failures(self):
+        # Given
+        output = '.\n----------------------------------------------------------------------\nRan 1 test in 0.001s\n\nOK\n'
+
+        # When
+        failures = parse_unittest_output(output)
+
+        # Then
+        self.assertEqual(failures, [])
+
+
+class TestParsePytestOutput(unittest.TestCase):
+
+    def test_failure_details_are_extracted(self):
+        # Given
+        output = PYTEST_OUTPUT
+
+        # When
+        failures = parse_pytest_output(output)
+
+        # Then
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(failures[0].test_id, 'test_positive')
+        self.assertEqual(failures[0].message, 'assert -1 == 3')
+        self.assertEqual((failures[0].expected, failures[0].actual), ('3', '-1'))
+        self.assertEqual(failures[0].frame, 'test_adder.py:5')
+
+
+class TestFailureFromTraceback(unittest.TestCase):
+
+    def test_relevant_frame_is_deepest_outside_standard_library(self):
+        # Given
+        traceback_text = ERROR_TRACEBACK
+
+        # When
+        failure = failure_from_traceback('test_adder.TestAdd.test_divide', 'error', traceback_text)
+
+        # Then
+        self.assertEqual(failure.message, 'ZeroDivisionError: division by zero')
+        self.assertEqual(failure.frame, 'adder.py:5 in divide: return a / b')
+        self.assertIsNone(failure.expected)
@@ -0,0 +1,104 @@
+import os
+import tempfile
+
+from approvals import AutoApproval
+from backends import ReplayBackend
+from fixer import Fixer
+from replay_testing import ReplayTestCase
+
+TESTS = '''import unittest
+from adder import add
+
+
+class TestAdd(unittest.TestCase):
+    def test_add(self):
+        self.assertEqual(add(1, 2), 3)
+
+    def test_add_zeros(self):
+        self.assertEqual(add(0, 0), 0)
+'''
+CORRECT = 'def add(a, b):\n    return a + b\n'
+# Passes test_add_zeros only
+PARTIAL = 'def add(a, b):\n    return a * b\n'
+# Fails both tests, and would leave a file behind in the directory it is tested in
+WRONG = "open('touched', 'w').close()\n\n\ndef add(a, b):\n    return a - b + 1\n"
+INVALID = 'def add(a, b)\n    return a + b\n'
+
+
+class CandidatesBackend(ReplayBackend):
+    """
+    Replies to every request with the given candidates, one per completion.
+    """
+
+    def __init__(self, candidates: list[str]):
+        super().__init__()
+        self.candidates = candidates
+
+    def _choices(self, model, messages, params):
+        return [f'```python\n{candidate}```' for candidate in self.candidates]
+
+
+class TestFixCandidates(ReplayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.directory.name, 'adder.py'), 'w') as f:
+            f.write(WRONG.replace("open('touched', 'w').close()\n\n\n", ''))
+        with open(os.path.join(self.directory.name, 'test_adder.py'), 'w') as f:
+            f.write(TESTS)
+
+    def tearDown(self):
+        super().tearDown()
+        self.directory.cleanup()
+
+    def _fix(self, candidates: list[str]) -> tuple[bool, str]:
+        self.replay(CandidatesBackend(candidates))
+        fixer = Fixer('adder', max_tries=2, work_dir=self.directory.name, approval=AutoApproval(),
+                      candidates=len(candidates))
+        result = fixer.run_tests_and_fix_if_needed()
+        with open(os.path.join(self.directory.name, 'adder.py')) as f:
+            return result.passed, f.read()
+
+    def test_the_passing_candidate_is_picked(self):
+        # Given
+        candidates = [WRONG, CORRECT, INVALID]
+
+        # When
+        passed, module = self._fix(candidates)
+
+        # Then
+        self.assertTrue(passed)
+        self.assertEqual(module.strip(), CORRECT.strip())
+
+    def test_candidates_are_tested_apart_from_the_module(self):
+        # Given
+        candidates = [INVALID, WRONG, CORRECT]
+
+        # When
+        self._fix(candidates)
+
+        # Then
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, 'touched')))
+
+    def test_candidate_passing_the_most_tests_is_kept_when_none_passes(self):
+        # Given
+        candidates = [INVALID, WRONG, PARTIAL]
+
+        # When
+        passed, module = self._fix(candidates)
+
+        # Then
+        self.assertFalse(passed)
+        self.assertEqual(module.strip(), PARTIAL.strip())
+
+    def test_first_of_tied_candidates_is_kept(self):
+        # Given
+        candidates = [PARTIAL, PARTIAL.replace('a * b', 'b * a'), WRONG]
+
+        # When
+        passed, module = self._fix(candidates)
+
+        # Then
+        self.assertFalse(passed)
+        self.assertEqual(module.strip(), PARTIAL.strip())
@@ -0,0 +1,95 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import HUMAN, LLM, STAGE, Tracer, propagate
+
+
+class TestTracer(unittest.TestCase):
+
+    def test_nested_span_is_within_its_outer_span(self):
+        # Given
+        tracer = Tracer()
+
+        # When
+        with tracer.span('implement', STAGE):
+            with tracer.span('implement', LLM, model='gpt-4') as attributes:
+                attributes['retries'] = 2
+
+        # Then
+        inner, outer = tracer.spans
+        self.assertEqual((inner.category, outer.category), (LLM, STAGE))
+        self.assertLessEqual(outer.start, inner.start)
+        self.assertLessEqual(inner.end, outer.end)
+        self.assertEqual(inner.attributes, {'model': 'gpt-4', 'retries': 2})
+
+    def test_human_wait_is_not_machine_time(self):
+        # Given
+        tracer = Tracer()
+
+        def wait_in_another_thread():
+            with tracer.human_wait('elsewhere'):
+                time.sleep(0.05)
+
+        # When
+        with tracer.span('analyze', STAGE):
+            with tracer.human_wait('review'):
+                time.sleep(0.1)
+            thread = threading.Thread(target=wait_in_another_thread)
+            thread.start()
+            thread.join()
+
+        # Then
+        row, = tracer.stage_summary()
+        human, = [span.duration for span in tracer.spans if span.category == HUMAN and span.name == 'review']
+        self.assertEqual(row['human'], human)
+        self.assertAlmostEqual(row['machine'], row['wall'] - human)
+        self.assertGreaterEqual(row['wall'] - row['machine'], 0.1)
+
+    def test_labels_are_propagated_to_other_threads(self):
+        # Given
+        tracer = Tracer()
+
+        def record(name: str) -> None:
+            with tracer.span(name, STAGE):
+                pass
+
+        # When
+        with tracer.labeled(job='adder'):
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                executor.submit(propagate(record), 'propagated').result()
+                executor.submit(record, 'not_propagated').result()
+
+        # Then
+        spans = {span.name: span for span in tracer.spans}
+        self.assertEqual(spans['propagated'].attributes, {'job': 'adder'})
+        self.assertEqual(spans['not_propagated'].attributes, {})
+        self.assertEqual([span.name for span in tracer.take(job='adder')], ['propagated'])
+        self.assertEqual([span.name for span in tracer.spans], ['not_propagated'])
+
+    def test_chrome_trace_has_a_complete_event_per_span(self):
+        # Given
+        tracer = Tracer()
+        with tracer.span('fix', STAGE, attempt=1):
+            time.sleep(0.01)
+
+        # When
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, 'trace.json')
+            tracer.export_chrome_trace(file_name)
+            with open(file_name) as f:
+                trace = json.load(f)
+
+        # Then
+        event, thread_name = trace['traceEvents']
+        span, = tracer.spans
+        self.assertEqual((event['name'], event['cat'], event['ph']), ('fix', STAGE, 'X'))
+        self.assertAlmostEqual(event['ts'], span.start * 1_000_000)
+        self.assertGreaterEqual(event['dur'], 10_000)
+        self.assertEqual(event['args'], {'attempt': 1})
+        self.assertEqual(thread_name, {'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': event['tid'],
+                                       'args': {'name': threading.current_thread().name}})
@@ -1,5 +1,6 @@
 import unittest
-from markdown_parser import parse_code_blocks, CodeBlock
+from markdown_parser import parse_code_blocks, CodeBlock, IncrementalCodeBlockParser, first_code_block, \
+    replace_code_blocks
 
 
 class TestParseCodeBlocks(unittest.TestCase):
@@ -62,4 +63,114 @@ class TestParseCodeBlocks(unittest.TestCase):
         code_blocks = parse_code_blocks(markdown_text)
 
         # Then
-        self.assertEqual(len(code_blocks), 0)
\ No newline at end of file
+        self.assertEqual(len(code_blocks), 0)
+
+    def test_tilde_fences_and_info_strings(self):
+        # Given
+        markdown_text = "~~~python3 title='adder.py'\r\ndef add(a, b):\r\n    return a + b\r\n~~~\r\n"
+
+        # When
+        code_blocks = parse_code_blocks(markdown_text)
+
+        # Then
+        self.assertEqual(code_blocks, [CodeBlock("python3", "def add(a, b):\n    return a + b")])
+
+    def test_longer_fence_contains_shorter_fences(self):
+        # Given
+        markdown_text = "````markdown\nSome text\n```python\nprint('hello world')\n```\n````\n" \
+                        "~~~\n```\n~~~"
+
+        # When
+        code_blocks = parse_code_blocks(markdown_text)
+
+        # Then
+        self.assertEqual(code_blocks, [CodeBlock("markdown", "Some text\n```python\nprint('hello world')\n```"),
+                                       CodeBlock(None, "```")])
+
+    def test_blocks_are_selected_by_language(self):
+        # Given
+        markdown_text = "```text\nadd(1, 2) == 3\n```\n```py\ndef add(a, b):\n    return a + b\n```"
+
+        # When
+        python_blocks = parse_code_blocks(markdown_text, language="python")
+        first_yaml_block = first_code_block(markdown_text, "yaml")
+
+        # Then
+        self.assertEqual(python_blocks, [CodeBlock("py", "def add(a, b):\n    return a + b")])
+        self.assertEqual(first_yaml_block, CodeBlock("text", "add(1, 2) == 3"))
+        self.assertIsNone(first_code_block("No code here", "python"))
+
+    def test_replace_code_blocks_keeps_fences_and_text(self):
+        # Given
+        markdown_text = "Before\n```python\nprint('hello world')\n```\nAfter\n```\nnot closed\n"
+
+        # When
+        replaced = replace_code_blocks(markdown_text, lambda block: f"# {block.language} code")
+
+        # Then
+        self.assertEqual(replaced, "Before\n```python\n# python code\n```\nAfter\n```\nnot closed\n")
+
+
+class TestIncrementalCodeBlockParser(unittest.TestCase):
+
+    def test_block_is_emitted_when_closing_fence_arrives(self):
+        # Given
+        parser = IncrementalCodeBlockParser()
+        parser.feed("Here is the code:\n```pyth")
+        parser.feed("on\nprint('hello world')\n``")
+
+        # When
+        code_blocks = parser.feed("`\nSome explanation")
+
+        # Then
+        self.assertEqual(code_blocks, [CodeBlock("python", "print('hello world')")])
+
+    def test_no_block_before_closing_fence(self):
+        # Given
+        parser = IncrementalCodeBlockParser()
+
+        # When
+        code_blocks = parser.feed("```python\nprint('hello world')\n")
+
+        # Then
+        self.assertEqual(len(code_blocks), 0)
+
+    def test_chunks_yield_same_blocks_as_whole_text(self):
+        # Given
+        markdown_text = "This is a markdown text. \n" \
+                        "```python\nprint('hello world')\n```\n" \
+                        " This is another markdown text. ```javascript\nconsole.log('hello world')\n```"
+        parser = IncrementalCodeBlockParser()
+
+        # When
+        for i in range(0, len(markdown_text), 3):
+            parser.feed(markdown_text[i:i + 3])
+
+        # Then
+        self.assertEqual(parser.code_blocks, parse_code_blocks(markdown_text))
+
+    def test_only_blocks_in_the_language_are_emitted(self):
+        # Given
+        parser = IncrementalCodeBlockParser('python')
+        other_block = parser.feed("```bash\npip install requests\n```\n")
+
+        # When
+        code_blocks = parser.feed("```python\nimport requests\n```")
+
+        # Then
+        self.assertEqual(other_block, [])
+        self.assertEqual(code_blocks, [CodeBlock("python", "import requests")])
+        self.assertEqual(parser.code_blocks, code_blocks)
+
+    def test_longer_closing_fence_is_not_closed_early(self):
+        # Given
+        parser = IncrementalCodeBlockParser()
+        parser.feed("````markdown\n```python\nprint('hello world')\n``")
+
+        # When
+        inner_fence = parser.feed("`\n")
+        code_blocks = parser.feed("````")
+
+        # Then
+        self.assertEqual(inner_fence, [])
+        self.assertEqual(code_blocks, [CodeBlock("markdown", "```python\nprint('hello world')\n```")])
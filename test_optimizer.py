@@ -0,0 +1,78 @@
+import os
+import tempfile
+
+from approvals import AutoApproval
+from backends import ReplayBackend, ScriptedReply
+from optimizer import Optimizer
+from profiler import PerformanceBudget
+from replay_testing import ReplayTestCase
+from test_profiler import BENCHMARKS, QUADRATIC_MODULE
+
+TESTS = '''import unittest
+from duplicates import duplicates
+
+
+class TestDuplicates(unittest.TestCase):
+    def test_duplicates(self):
+        self.assertEqual(duplicates([1, 2, 1, 3, 2]), [1, 2])
+'''
+BROKEN_MODULE = '''def duplicates(items):
+    return []
+'''
+LINEAR_MODULE = '''def duplicates(items):
+    seen, found = set(), {}
+    for item in items:
+        if item in seen:
+            found[item] = None
+        seen.add(item)
+    return list(found)
+'''
+
+
+class TestOptimizer(ReplayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.benchmarks = BENCHMARKS.split('\n\n\ndef bench_without_setup')[0]
+
+    def tearDown(self):
+        super().tearDown()
+        self.directory.cleanup()
+
+    def _write(self, module: str) -> None:
+        for file_name, content in [('duplicates.py', module), ('test_duplicates.py', TESTS),
+                                   ('bench_duplicates.py', self.benchmarks)]:
+            with open(os.path.join(self.directory.name, file_name), 'w') as f:
+                f.write(content)
+
+    def _optimizer(self, backend: ReplayBackend) -> Optimizer:
+        self.replay(backend)
+        return Optimizer('duplicates', budget=PerformanceBudget(sizes=[500, 1000, 2000]),
+                         work_dir=self.directory.name, approval=AutoApproval())
+
+    def test_only_a_faster_module_that_passes_the_tests_is_kept(self):
+        # Given
+        self._write(QUADRATIC_MODULE)
+        replies = [f'```python\n{BROKEN_MODULE}```', f'```python\n{LINEAR_MODULE}```']
+        optimizer = self._optimizer(ReplayBackend(script=[ScriptedReply(r'.', replies)]))
+
+        # When
+        result = optimizer.run()
+
+        # Then
+        self.assertEqual((result.status, result.attempts), ('optimized', 2))
+        with open(os.path.join(self.directory.name, 'duplicates.py'), 'r') as f:
+            self.assertEqual(f.read(), LINEAR_MODULE.strip())
+
+    def test_module_within_the_budget_is_not_changed(self):
+        # Given
+        self._write(LINEAR_MODULE)
+        backend = ReplayBackend()
+
+        # When
+        result = self._optimizer(backend).run()
+
+        # Then
+        self.assertEqual(result.status, 'within_budget')
+        self.assertEqual(backend.calls, 0)
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import unittest
+
+from analyzer import parse_package
+from approvals import AutoApproval
+from backends import ReplayBackend, ScriptedReply
+from common import ModuleDetails
+from package import PackagePipeline
+from pipeline import PipelineResult
+from replay_testing import ReplayTestCase
+from replies import ReplyError
+
+PACKAGE_REPLY = '''```yaml
+name: adder
+description: Adds numbers
+api: |
+  def add(a, b): ...
+```
+
+```yaml
+name: calculator
+description: Evaluates sums
+requires: [adder]
+api: |
+  def total(numbers): ...
+```'''
+
+SCRIPT = [
+    ScriptedReply(r'Package description:', [PACKAGE_REPLY]),
+    ScriptedReply(r'Module name: adder', ['```yaml\ncode: |\n  def add(a, b):\n      return a + b\n```']),
+    ScriptedReply(r'Module name: calculator', ['```yaml\ncode: |\n  from adder import add\n\n\n'
+                                               '  def total(numbers):\n      result = 0\n      for number in numbers:\n'
+                                               '          result = add(result, number)\n      return result\n```']),
+    ScriptedReply(r'module adder\.py', ['```python\nimport unittest\nfrom adder import add\n\n\n'
+                                        'class TestAdd(unittest.TestCase):\n    def test_add(self):\n'
+                                        '        self.assertEqual(add(1, 2), 3)\n```']),
+    ScriptedReply(r'module calculator\.py', ['```python\nimport unittest\nfrom calculator import total\n\n\n'
+                                             'class TestTotal(unittest.TestCase):\n    def test_total(self):\n'
+                                             '        self.assertEqual(total([1, 2, 3]), 6)\n```']),
+]
+
+
+class TestPackagePipeline(ReplayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super().tearDown()
+        self.directory.cleanup()
+
+    def test_modules_are_implemented_after_the_modules_they_require(self):
+        # Given
+        self.replay(ReplayBackend(script=SCRIPT))
+        package = PackagePipeline('Sum numbers', work_dir=self.directory.name, approval=AutoApproval())
+
+        # When
+        result = package.run()
+
+        # Then
+        self.assertEqual(result.status, 'passed')
+        self.assertEqual([module.module for module in result.modules], ['adder', 'calculator'])
+        self.assertEqual(sorted(name for name in os.listdir(self.directory.name) if name.endswith('.py')),
+                         ['adder.py', 'calculator.py', 'test_adder.py', 'test_calculator.py'])
+
+    def test_module_requiring_a_failed_module_is_skipped(self):
+        # Given
+        package = PackagePipeline('Sum numbers', work_dir=self.directory.name, approval=AutoApproval())
+        calculator = ModuleDetails('calculator', 'Evaluates sums', 'def total(numbers): ...', requires=['adder'])
+        adder = PipelineResult('Adds numbers', self.directory.name, status='failed', module='adder')
+
+        # When
+        result = package._module_stage(calculator)(adder=adder)
+
+        # Then
+        self.assertEqual(result.status, 'skipped')
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, 'calculator.py')))
+
+
+class TestParsePackage(unittest.TestCase):
+
+    def test_modules_requiring_each_other_are_rejected(self):
+        # Given
+        reply = PACKAGE_REPLY.replace('description: Adds numbers', 'description: Adds numbers\nrequires: [calculator]')
+
+        # When / Then
+        self.assertEqual([module.requires for module in parse_package(PACKAGE_REPLY)], [[], ['adder']])
+        with self.assertRaises(ReplyError):
+            parse_package(reply)
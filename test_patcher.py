@@ -0,0 +1,86 @@
+import unittest
+
+from patcher import PatchError, apply_diff, apply_reply, replace_definitions
+
+MODULE = '''import math
+
+
+def add(a, b):
+    return a - b
+
+
+class Stack:
+    def __init__(self):
+        self.items = []
+
+    def push(self, item):
+        self.items.insert(0, item)
+
+    def pop(self):
+        return self.items.pop()
+'''
+
+
+class TestPatcher(unittest.TestCase):
+
+    def test_changed_function_is_replaced(self):
+        # Given
+        code = 'import os\n\n\ndef add(a, b):\n    return a + b\n'
+
+        # When
+        patched = replace_definitions(MODULE, code)
+
+        # Then
+        self.assertIn('    return a + b', patched)
+        self.assertIn('import math\nimport os\n', patched)
+        self.assertIn('self.items.insert(0, item)', patched)
+
+    def test_class_given_in_part_is_changed_method_by_method(self):
+        # Given
+        code = 'class Stack:\n    def push(self, item):\n        self.items.append(item)\n'
+
+        # When
+        patched = replace_definitions(MODULE, code)
+
+        # Then
+        self.assertIn('        self.items.append(item)', patched)
+        self.assertIn('def pop(self):', patched)
+        self.assertIn('def __init__(self):', patched)
+
+    def test_method_given_without_its_class_is_replaced_in_it(self):
+        # When
+        patched = apply_reply(MODULE, '```python\ndef push(self, item):\n    self.items.append(item)\n```')
+
+        # Then
+        self.assertIn('    def push(self, item):\n        self.items.append(item)\n', patched)
+
+    def test_indented_method_is_replaced_in_its_class(self):
+        # When
+        patched = apply_reply(MODULE, '```python\n    def push(self, item):\n        self.items.append(item)\n```')
+
+        # Then
+        self.assertIn('    def push(self, item):\n        self.items.append(item)\n', patched)
+        self.assertIn('    def pop(self):', patched)
+
+    def test_diff_with_wrong_line_numbers_is_applied(self):
+        # Given
+        diff = '--- a.py\n+++ b.py\n@@ -40,2 +40,2 @@\n def add(a, b):\n-    return a - b\n+    return a + b\n'
+
+        # When
+        patched = apply_diff(MODULE, diff)
+
+        # Then
+        self.assertIn('    return a + b', patched)
+
+    def test_diff_of_missing_lines_is_rejected(self):
+        # Given
+        reply = '```diff\n@@ -1,1 +1,1 @@\n-def subtract(a, b):\n+def sub(a, b):\n```'
+
+        # When / Then
+        with self.assertRaisesRegex(PatchError, 'not in the module'):
+            apply_reply(MODULE, reply)
+
+    def test_invalid_python_is_rejected(self):
+        # When / Then
+        with self.assertRaisesRegex(PatchError, 'SyntaxError'):
+            apply_reply(MODULE, '```python\ndef add(a, b:\n    return a + b\n```')
@@ -0,0 +1,88 @@
+import os
+import sys
+import sysconfig
+import tempfile
+import unittest
+import venv
+
+from preflight import check_module
+
+API = '''
+def add(a: int, b: int) -> int:
+    pass
+
+
+class Calculator:
+    def total(self, values: list[int]) -> int:
+        pass
+'''
+
+
+class TestPreflight(unittest.TestCase):
+
+    def test_syntax_error_is_fatal(self):
+        # Given
+        code = 'def add(a, b)\n    return a + b\n'
+
+        # When
+        problems = check_module(code)
+
+        # Then
+        self.assertEqual([problem.kind for problem in problems], ['syntax'])
+        self.assertTrue(problems[0].fatal)
+        self.assertEqual(problems[0].line, 1)
+
+    def test_unresolved_import_is_reported(self):
+        # Given
+        code = 'import os\nimport not_a_real_package_xyz\n\n\ndef add(a, b):\n    return a + b\n'
+
+        # When
+        problems = check_module(code)
+        declared = check_module(code, dependencies=['not-a-real-package-xyz'])
+
+        # Then
+        self.assertEqual([(problem.kind, problem.line) for problem in problems], [('import', 2)])
+        self.assertIn('not_a_real_package_xyz', problems[0].message)
+        self.assertEqual(declared, [])
+
+    def test_signature_drift_from_api_is_reported(self):
+        # Given
+        code = ('def add(a, b, c):\n    return a + b + c\n\n\n'
+                'class Calculator:\n    def total(self, values):\n        return sum(values)\n')
+
+        # When
+        problems = check_module(code, api=API)
+
+        # Then
+        self.assertEqual([problem.kind for problem in problems], ['signature'])
+        self.assertIn('`add` takes (a, b, c)', problems[0].message)
+        self.assertFalse(problems[0].fatal)
+
+    def test_missing_api_method_is_reported(self):
+        # Given
+        code = 'def add(a, b):\n    return a + b\n\n\nclass Calculator:\n    pass\n'
+
+        # When
+        problems = check_module(code, api=API)
+
+        # Then
+        self.assertEqual([(problem.kind, problem.message) for problem in problems],
+                         [('missing', 'The function `Calculator.total` of the api is not defined')])
+
+    def test_module_installed_after_a_check_resolves(self):
+        # Given
+        with tempfile.TemporaryDirectory() as directory:
+            venv.create(directory, with_pip=False)
+            python = os.path.join(directory, 'Scripts' if sys.platform == 'win32' else 'bin', 'python')
+            site_packages = sysconfig.get_path('purelib', vars={'base': directory, 'platbase': directory})
+            code = 'import impllmentors_installed\n'
+            before = check_module(code, python=python)
+
+            # When
+            with open(os.path.join(site_packages, 'impllmentors_installed.py'), 'w') as f:
+                f.write('')
+            after = check_module(code, python=python)
+
+        # Then
+        self.assertEqual([problem.kind for problem in before], ['import'])
+        self.assertEqual(after, [])
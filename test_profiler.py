@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+
+from profiler import CaseProfile, PerformanceBudget, Profile, growth_exponent, measure
+
+QUADRATIC_MODULE = '''def duplicates(items):
+    found = []
+    for i, item in enumerate(items):
+        if item in items[i + 1:] and item not in found:
+            found.append(item)
+    return found
+'''
+BENCHMARKS = '''from duplicates import duplicates
+
+
+def setup_distinct(size):
+    return list(range(size))
+
+
+def bench_distinct(data):
+    duplicates(data)
+
+
+def bench_without_setup(data):
+    duplicates(data)
+'''
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_growth_exponent_ignores_values_below_the_floor(self):
+        # Given
+        sizes = [1, 2, 4, 8]
+        values = [0.5, 4, 16, 64]
+
+        # When
+        exponent = growth_exponent(sizes, values, floor=1)
+
+        # Then
+        self.assertAlmostEqual(exponent, 2.0)
+        self.assertIsNone(growth_exponent(sizes, values, floor=100))
+
+    def test_quadratic_module_is_over_the_budget(self):
+        # Given
+        with tempfile.TemporaryDirectory() as directory:
+            for file_name, content in [('duplicates.py', QUADRATIC_MODULE), ('bench_duplicates.py', BENCHMARKS)]:
+                with open(os.path.join(directory, file_name), 'w') as f:
+                    f.write(content)
+
+            # When
+            profile = measure('bench_duplicates.py', cwd=directory, sizes=[500, 1000, 2000])
+
+        # Then
+        self.assertEqual(profile.errors, ['bench_without_setup: There is no setup_without_setup function'])
+        violations = profile.violations(PerformanceBudget())
+        self.assertEqual(len(violations), 1)
+        self.assertIn('The time of bench_distinct grows as', violations[0])
+
+    def test_profiles_are_compared_at_the_largest_size_both_measured(self):
+        # Given a slow module that stopped at the smallest size, and a faster one measured up to the largest
+        slow = Profile([CaseProfile('bench_distinct', sizes=[500], seconds=[1.5], peak_bytes=[0])])
+        faster = Profile([CaseProfile('bench_distinct', sizes=[500, 2000, 8000], seconds=[0.05, 0.4, 3.0],
+                                      peak_bytes=[0, 0, 0])])
+
+        # When / Then
+        self.assertTrue(faster.faster_than(slow))
+        self.assertFalse(slow.faster_than(faster))
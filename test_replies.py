@@ -0,0 +1,73 @@
+import unittest
+
+import replies
+from replies import IMPLEMENTATION_SCHEMA, MODULE_SCHEMA, RepairStats, ReplyError, module_name, parse_reply
+
+
+class TestParseReply(unittest.TestCase):
+
+    def setUp(self):
+        self.repair_stats = replies.repair_stats
+        replies.repair_stats = RepairStats()
+
+    def tearDown(self):
+        replies.repair_stats = self.repair_stats
+
+    def test_valid_reply_is_parsed(self):
+        # Given
+        reply = '```yaml\ndependencies:\n  - requests\ncode: |\n  import requests\n```'
+
+        # When
+        values = parse_reply(reply, IMPLEMENTATION_SCHEMA)
+
+        # Then
+        self.assertEqual(values, {'dependencies': ['requests'], 'code': 'import requests'})
+        self.assertEqual(replies.repair_stats.summary(), {'implementation': {'valid': 1}})
+
+    def test_text_around_unclosed_fence_is_dropped(self):
+        # Given
+        reply = 'Sure, here is the api:\n```yaml\nname: adder\ndescription: Adds\napi: |\n  def add(a, b): ...\n'
+
+        # When
+        values = parse_reply(reply, MODULE_SCHEMA)
+
+        # Then
+        self.assertEqual(values['api'], 'def add(a, b): ...')
+        self.assertEqual(replies.repair_stats.summary(), {'module': {'fences': 1}})
+
+    def test_code_not_indented_under_its_key_is_recovered(self):
+        # Given
+        reply = '```yaml\ndependencies: []\ncode: |\ndef add(a, b):\n    return a + b\n```'
+
+        # When
+        values = parse_reply(reply, IMPLEMENTATION_SCHEMA)
+
+        # Then
+        self.assertEqual(values['code'], 'def add(a, b):\n    return a + b')
+        self.assertEqual(replies.repair_stats.summary(), {'implementation': {'keys': 1}})
+
+    def test_description_with_colon_is_recovered(self):
+        # Given
+        reply = '```yaml\nname: adder\ndescription: Adds: two numbers\napi: |\n  def add(a, b): ...\n```'
+
+        # When
+        values = parse_reply(reply, MODULE_SCHEMA)
+
+        # Then
+        self.assertEqual(values['description'], 'Adds: two numbers')
+
+    def test_missing_key_is_reported(self):
+        # Given
+        reply = '```yaml\nname: adder\napi: [def add(a, b)\n```'
+
+        # When / Then
+        with self.assertRaisesRegex(ReplyError, 'no `description` key'):
+            parse_reply(reply, MODULE_SCHEMA)
+        self.assertEqual(replies.repair_stats.summary(), {'module': {'failed': 1}})
+
+    def test_module_name_is_made_valid(self):
+        # When
+        name = module_name('Markdown-Utils.py')
+
+        # Then
+        self.assertEqual(name, 'markdown_utils')
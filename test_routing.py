@@ -0,0 +1,62 @@
+import unittest
+
+import yaml
+
+import chat
+from approvals import ValidReplyApproval
+from backends import ReplayBackend, ScriptedReply
+from chat import ChatMessage, ChatWithCallback
+from instrumentation import LLM, tracer
+from replay_testing import ReplayTestCase
+from routing import ModelRouter, parse_routes
+
+
+class TestModelRouter(unittest.TestCase):
+
+    def test_stage_escalates_after_failures(self):
+        # Given
+        router = ModelRouter(['fast', 'strong'], failures_per_model=2)
+
+        # When
+        models = [router.model('implement', failures) for failures in range(5)]
+
+        # Then
+        self.assertEqual(models, ['fast', 'fast', 'strong', 'strong', 'strong'])
+
+    def test_routes_override_the_cascade(self):
+        # Given
+        router = ModelRouter(['fast', 'strong'], parse_routes(['fix=medium,strong']))
+
+        # When / Then
+        self.assertEqual(router.models('fix'), ['medium', 'strong'])
+        self.assertEqual(router.models('summarize'), ['fast'])
+        self.assertEqual(router.models('analyze'), ['fast', 'strong'])
+        with self.assertRaises(ValueError):
+            parse_routes(['fix'])
+
+
+class TestRoutedChat(ReplayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.model_router = chat.model_router
+        chat.model_router = ModelRouter(['fast', 'strong'])
+
+    def tearDown(self):
+        super().tearDown()
+        chat.model_router = self.model_router
+
+    def test_invalid_reply_escalates_to_the_next_model(self):
+        # Given
+        self.replay(ReplayBackend(script=[ScriptedReply(r'.', ['a: [1', 'a: 2'])]))
+        yaml_chat = ChatWithCallback(callback=yaml.safe_load, messages=[ChatMessage.of_user('Reply with yaml')],
+                                     approval=ValidReplyApproval(), stage='analyze')
+        first_span = len(tracer.spans)
+
+        # When
+        result = yaml_chat.run()
+
+        # Then
+        self.assertEqual(result, {'a': 2})
+        models = [span.attributes['model'] for span in tracer.spans[first_span:] if span.category == LLM]
+        self.assertEqual(models, ['fast', 'strong'])
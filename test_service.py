@@ -0,0 +1,95 @@
+import json
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from replay_testing import ReplayTestCase
+from service import PipelineService, QueueFullError, create_server
+from test_checkpoint import SCRIPT
+
+
+class TestPipelineService(ReplayTestCase):
+    script = SCRIPT
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        super().tearDown()
+        self.directory.cleanup()
+
+    def _request(self, url: str, method: str = 'GET', body=None) -> tuple[int, dict]:
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(url, data=data, method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def test_submitted_job_runs_and_reports_its_metrics(self):
+        # Given
+        service = PipelineService(self.directory.name, workers=2)
+        server = create_server(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        service.start()
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+
+        # When
+        status, submitted = self._request(f'{url}/jobs', 'POST', {'requirement': 'Add numbers', 'id': 'adder'})
+        invalid_status, _ = self._request(f'{url}/jobs', 'POST', {'requirement': ''})
+        deadline = time.monotonic() + 30
+        job = submitted
+        while job['status'] in ('queued', 'running') and time.monotonic() < deadline:
+            time.sleep(0.05)
+            _, job = self._request(f'{url}/jobs/adder')
+        server.shutdown()
+        server.server_close()
+        service.stop()
+
+        # Then
+        self.assertEqual((status, invalid_status), (202, 400))
+        self.assertEqual(job['status'], 'passed')
+        self.assertEqual(job['result']['module'], 'adder')
+        self.assertEqual(job['metrics']['calls'], 3)
+        self.assertGreaterEqual(job['metrics']['test_runs'], 1)
+
+    def test_only_queued_jobs_are_cancelled(self):
+        # Given
+        service = PipelineService(self.directory.name, workers=0, max_queued=1)
+        service.submit('Add numbers', 'adder')
+
+        # When
+        cancelled = service.cancel('adder')
+        cancelled_again = service.cancel('adder')
+
+        # Then
+        self.assertTrue(cancelled)
+        self.assertFalse(cancelled_again)
+        self.assertEqual(service.job('adder').status, 'cancelled')
+
+    def test_cancelled_jobs_do_not_fill_the_queue(self):
+        # Given
+        service = PipelineService(self.directory.name, workers=0, max_queued=1)
+        service.submit('Add numbers', 'adder')
+        service.cancel('adder')
+
+        # When
+        service.submit('Subtract numbers', 'subtractor')
+
+        # Then
+        with self.assertRaises(QueueFullError):
+            service.submit('Multiply numbers', 'multiplier')
+
+    def test_booleans_are_not_numeric_options(self):
+        # Given
+        service = PipelineService(self.directory.name, workers=0)
+
+        # When / Then
+        with self.assertRaisesRegex(ValueError, 'fix_candidates'):
+            service.submit('Add numbers', 'adder', {'fix_candidates': True})
+        self.assertEqual(service.submit('Add numbers', 'adder', {'fix_candidates': 2, 'patch_fixes': True}).options,
+                         {'fix_candidates': 2, 'patch_fixes': True})
@@ -0,0 +1,40 @@
+import io
+import json
+import subprocess
+import sys
+import unittest
+from contextlib import redirect_stdout
+
+import terminal
+
+# Slow to import, and only needed once a request is made or output is rendered to a terminal
+DEFERRED_MODULES = {'openai', 'aiohttp', 'halo', 'pygments', 'yaml', 'tiktoken', 'pipeline', 'batch', 'package'}
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_runner_defers_heavy_imports(self):
+        # Given
+        script = 'import json, sys, runner; print(json.dumps(sorted(sys.modules)))'
+
+        # When
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+
+        # Then
+        imported = {name.split('.')[0] for name in json.loads(output.stdout)}
+        self.assertEqual(imported & DEFERRED_MODULES, set())
+
+    def test_code_is_not_highlighted_when_quiet(self):
+        # Given
+        quiet, terminal.quiet = terminal.quiet, True
+        output = io.StringIO()
+
+        # When
+        try:
+            with redirect_stdout(output), terminal.spinner():
+                terminal.print_code('print("hello world")')
+        finally:
+            terminal.quiet = quiet
+
+        # Then
+        self.assertEqual(output.getvalue(), 'print("hello world")\n')
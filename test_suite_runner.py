@@ -0,0 +1,142 @@
+import os
+import tempfile
+import textwrap
+import time
+import unittest
+
+from sandbox import Limits
+from suite_runner import SuiteWorker, run_unit_tests
+
+TESTS = '''
+import unittest
+from adder import add
+
+
+class TestAdd(unittest.TestCase):
+    def test_positive(self):
+        self.assertEqual(add(1, 2), 3)
+
+    def test_zero(self):
+        self.assertEqual(add(0, 0), 0)
+
+    def test_negative(self):
+        self.assertEqual(add(-1, -2), -3)
+'''
+
+
+class TestSuiteRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self._write('test_adder.py', TESTS)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _write(self, file_name: str, content: str) -> None:
+        with open(os.path.join(self.directory.name, file_name), 'w') as f:
+            f.write(textwrap.dedent(content))
+
+    def test_results_are_reported_per_test(self):
+        # Given
+        self._write('adder.py', 'def add(a, b):\n    return a * b\n')
+
+        # When
+        suite_run = run_unit_tests('test_adder.py', cwd=self.directory.name)
+
+        # Then
+        statuses = {case.name.rsplit('.', 1)[-1]: case.status for case in suite_run.cases}
+        self.assertEqual(statuses, {'test_positive': 'failed', 'test_zero': 'passed', 'test_negative': 'failed'})
+        self.assertIn('AssertionError', suite_run.failed_cases[0].traceback)
+
+    def test_import_error_is_reported_as_error(self):
+        # Given
+        self._write('adder.py', 'def add(a, b)\n    return a + b\n')
+
+        # When
+        suite_run = run_unit_tests('test_adder.py', cwd=self.directory.name)
+
+        # Then
+        self.assertFalse(suite_run.passed)
+        self.assertEqual(suite_run.errors, 1)
+
+    def test_worker_reloads_changed_module(self):
+        # Given
+        worker = SuiteWorker(self.directory.name)
+        self._write('adder.py', 'def add(a, b):\n    return a - b\n')
+        first_run = worker.run('test_adder.py')
+        self._write('adder.py', 'def add(a, b):\n    return a + b\n')
+
+        # When
+        second_run = worker.run('test_adder.py')
+        worker.close()
+
+        # Then
+        self.assertFalse(first_run.passed)
+        self.assertTrue(second_run.passed)
+        self.assertEqual(second_run.tests_run, 3)
+
+    def test_worker_stops_on_first_failing_priority_test(self):
+        # Given
+        worker = SuiteWorker(self.directory.name)
+        self._write('adder.py', 'def add(a, b):\n    return a * b\n')
+        priority = ['test_adder.TestAdd.test_negative', 'test_adder.TestAdd.test_positive']
+
+        # When
+        suite_run = worker.run('test_adder.py', priority=priority)
+        worker.close()
+
+        # Then
+        self.assertFalse(suite_run.complete)
+        self.assertEqual([case.name for case in suite_run.cases], ['test_adder.TestAdd.test_negative'])
+
+    def test_test_that_runs_out_of_time_fails_alone(self):
+        # Given
+        self._write('adder.py', 'def add(a, b):\n    while a < 0:\n        pass\n    return a + b\n')
+        limits = Limits(test_seconds=1, wall_seconds=30)
+
+        # When
+        started = time.monotonic()
+        suite_run = run_unit_tests('test_adder.py', cwd=self.directory.name, limits=limits)
+
+        # Then
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertFalse(suite_run.complete)
+        self.assertEqual(suite_run.failed_cases[0].name, 'test_adder.TestAdd.test_negative')
+        self.assertIn('TimeoutError', suite_run.failed_cases[0].traceback)
+
+    def test_cpu_limit_kills_runaway_test(self):
+        # Given
+        self._write('adder.py', 'def add(a, b):\n    while a < 0:\n        pass\n    return a + b\n')
+        limits = Limits(cpu_seconds=1, test_seconds=None, wall_seconds=30)
+
+        # When
+        suite_run = run_unit_tests('test_adder.py', cwd=self.directory.name, limits=limits)
+
+        # Then
+        self.assertEqual(suite_run.errors, 1)
+        self.assertIn('CPU time', suite_run.failed_cases[0].traceback)
+
+    def test_tests_run_in_a_sandbox(self):
+        # Given
+        self._write('adder.py', 'def add(a, b):\n    open("written.txt", "w").close()\n    return a + b\n')
+
+        # When
+        suite_run = run_unit_tests('test_adder.py', cwd=self.directory.name)
+
+        # Then
+        self.assertTrue(suite_run.passed)
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, 'written.txt')))
+
+    def test_shards_run_every_test_once(self):
+        # Given
+        self._write('adder.py', 'def add(a, b):\n    return a * b\n')
+
+        # When
+        with SuiteWorker(self.directory.name, shards=2) as worker:
+            suite_run = worker.run('test_adder.py', failfast=False)
+
+        # Then
+        statuses = {case.name.rsplit('.', 1)[-1]: case.status for case in suite_run.cases}
+        self.assertEqual(statuses, {'test_positive': 'failed', 'test_zero': 'passed', 'test_negative': 'failed'})
+        self.assertTrue(suite_run.complete)
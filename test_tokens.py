@@ -0,0 +1,93 @@
+import unittest
+
+from tokens import TokenUsage, count_message_tokens, count_tokens, prompt_budget, truncate_lines
+
+
+class TestCountTokens(unittest.TestCase):
+
+    def test_empty_text(self):
+        # Given
+        text = ''
+
+        # When
+        tokens = count_tokens(text)
+
+        # Then
+        self.assertEqual(tokens, 0)
+
+    def test_longer_text_has_more_tokens(self):
+        # Given
+        short_text = 'def add(a, b):\n    return a + b\n'
+        long_text = short_text * 10
+
+        # When
+        short_tokens = count_tokens(short_text)
+        long_tokens = count_tokens(long_text)
+
+        # Then
+        self.assertGreater(short_tokens, 0)
+        self.assertGreater(long_tokens, short_tokens * 5)
+
+    def test_special_tokens_are_counted_as_text(self):
+        # Given
+        text = 'The model stops at <|endoftext|>, e.g. in a tokenizer module'
+
+        # When
+        tokens = count_tokens(text)
+
+        # Then
+        self.assertGreater(tokens, count_tokens('The model stops at'))
+
+    def test_messages_include_per_message_overhead(self):
+        # Given
+        messages = [{'role': 'system', 'content': 'Hello'}, {'role': 'user', 'content': 'Hello'}]
+
+        # When
+        tokens = count_message_tokens(messages)
+
+        # Then
+        self.assertGreater(tokens, 2 * count_tokens('Hello'))
+
+
+class TestPromptBudget(unittest.TestCase):
+
+    def test_reserve_is_subtracted_from_context_window(self):
+        # Given
+        model = 'gpt-4'
+
+        # When
+        budget = prompt_budget(model, completion_reserve=1000)
+
+        # Then
+        self.assertEqual(budget, 8192 - 1000)
+
+
+class TestTokenUsage(unittest.TestCase):
+
+    def test_usage_is_accumulated_per_stage(self):
+        # Given
+        usage = TokenUsage()
+
+        # When
+        usage.record('fix', 100, 10)
+        usage.record('fix', 50, 5)
+        usage.record('analyze', 20, 2)
+
+        # Then
+        self.assertEqual(usage.stages['fix'].calls, 2)
+        self.assertEqual(usage.stages['fix'].total_tokens, 165)
+        self.assertEqual(usage.total().prompt_tokens, 170)
+
+
+class TestTruncateLines(unittest.TestCase):
+
+    def test_long_text_is_truncated_with_note(self):
+        # Given
+        text = '\n'.join(f'line {i}' for i in range(20))
+
+        # When
+        truncated = truncate_lines(text, 5)
+
+        # Then
+        self.assertEqual(truncated.splitlines()[:5], [f'line {i}' for i in range(5)])
+        self.assertEqual(truncated.splitlines()[5], '... (15 more lines omitted)')
@@ -1,31 +1,103 @@
+import os
+import shutil
+import sys
+import tempfile
+from typing import Optional
+
 import rich
-from pygments import highlight
-from pygments.formatters.terminal import TerminalFormatter
-from pygments.lexers.python import PythonLexer
 
 import markdown_parser
+from approvals import ApprovalPolicy, HumanApproval
 from chat import ChatMessage, ChatWithCallback
-from common import BOT_PREFIX
+from common import BOT_PREFIX, ModuleDetails, format_apis
+from failure_report import failures_from_suite_run, format_report
+from suite_runner import run_unit_tests
+from terminal import print_code
 
 
 def parse_and_print(content: str) -> str:
-    blocks = markdown_parser.parse_code_blocks(content)
-    code = blocks[0].code
+    block = markdown_parser.first_code_block(content, 'python')
+    if block is None:
+        raise ValueError('The reply has no code block with the unit tests')
+    code = block.code
     rich.print(f'{BOT_PREFIX} I wrote some unit tests to verify the modules behavior.')
-    print(highlight(code, PythonLexer(), TerminalFormatter()))
+    print_code(code)
     return code
 
 
+def print_suggestions(content: str) -> str:
+    rich.print(f'{BOT_PREFIX} These are the cases I think the unit tests should cover.')
+    print(content)
+    return content
+
+
+def check_tests_run(work_dir: str, file_name: str, tests: str, python: str = sys.executable,
+                    requires: Optional[list[str]] = None) -> None:
+    """
+    Runs the unit tests against the module, and the modules it requires, in a temporary copy of work_dir, and raises a
+    ValueError if they could not be loaded, e.g. because of a syntax error or an import of a name the module does not
+    define.
+    """
+    test_file_name = f'test_{file_name}'
+    with tempfile.TemporaryDirectory() as directory:
+        for name in [file_name] + [f'{module}.py' for module in requires or []]:
+            shutil.copy(os.path.join(work_dir, name), directory)
+        with open(os.path.join(directory, test_file_name), 'w') as f:
+            f.write(tests)
+        suite_run = run_unit_tests(test_file_name, cwd=directory, python=python)
+
+    # An ImportError is reported as a unittest.loader case, while any other error the module raises when it is loaded,
+    # e.g. a SyntaxError, crashes the run with a case named after the module
+    test_module = os.path.splitext(test_file_name)[0]
+    load_errors = [case for case in suite_run.failed_cases
+                   if case.name.startswith('unittest.loader.') or case.name == test_module]
+    if load_errors:
+        report = format_report(failures_from_suite_run(suite_run))
+        raise ValueError(f'The unit tests could not be loaded:\n{report}')
+    if suite_run.tests_run == 0:
+        raise ValueError('The unit tests file does not contain any tests')
+
+
 class Tester:
-    def __init__(self, file_name: str):
+    """
+    Writes unit tests for a module. The tests are written from the content of the module, or when api is given, from
+    the api of the module, which allows writing them while the module is being implemented. suggestions are test
+    cases the tests should cover, as returned by suggest_tests. requires are the modules of its package that the
+    module imports.
+    """
+
+    def __init__(self, file_name: str, work_dir: str = '.', approval: Optional[ApprovalPolicy] = None,
+                 api: Optional[str] = None, suggestions: Optional[str] = None, python: str = sys.executable,
+                 requires: Optional[list[ModuleDetails]] = None):
         self.file_name = file_name
-        self.file_content: str = self._load_content()
+        self.work_dir = work_dir
+        self.approval = approval or HumanApproval()
+        self.api = api
+        self.suggestions = suggestions
+        self.python = python
+        self.requires = requires or []
+        self.file_content: str = api if api is not None else self._load_content()
         self.write_tests_and_review_chat: ChatWithCallback = self._create_write_tests_and_review_chat()
 
     def _load_content(self) -> str:
-        with open(self.file_name, 'r') as f:
+        with open(os.path.join(self.work_dir, self.file_name), 'r') as f:
             return f.read()
 
+    def _describe_module(self) -> str:
+        if self.api is not None:
+            return 'This is the api of the module, whose implementation is not written yet:'
+        return 'This is the content of the module:'
+
+    def _describe_cases(self) -> str:
+        if not self.suggestions:
+            return ''
+        return f'Make sure the unit tests cover these cases:\n{self.suggestions}\n'
+
+    def _describe_requires(self) -> str:
+        if not self.requires:
+            return ''
+        return f'The module imports these modules of its package:\n{format_apis(self.requires)}\n'
+
     def _create_write_tests_and_review_chat(self):
         prompt = f'''
         Write a unit tests file for the module {self.file_name}.
@@ -46,11 +118,11 @@ class Tester:
             <assertions>
         ```
         
-        This is the content of the module:
+        {self._describe_module()}
         ```python
         {self.file_content}
         ```
-        
+        {self._describe_requires()}{self._describe_cases()}
         Provide code only without explanations:
         ```python
         <unit tests>
@@ -60,7 +132,9 @@ class Tester:
         return ChatWithCallback(callback=parse_and_print, messages=[
             ChatMessage.of_system('You are an experienced python software engineer.'),
             ChatMessage.of_user(prompt)
-        ])
+        ], stream=True, language='python', approval=self.approval, stage='write_tests',
+            check=lambda tests: check_tests_run(self.work_dir, self.file_name, tests, self.python,
+                                                [module.name for module in self.requires]))
 
     def _create_suggest_cases_chat(self):
         prompt = f'''
@@ -68,7 +142,7 @@ class Tester:
         Each item in the list should be a short description (one or two sentences at most) of the unit tests.
         Don't forget to consider edge cases and inputs.
 
-        This is the content of the module:
+        {self._describe_module()}
         ```python
         {self.file_content}
         ```
@@ -79,10 +153,13 @@ class Tester:
         ...
         '''
 
-        return ChatWithCallback(callback=print, messages=[
+        return ChatWithCallback(callback=print_suggestions, messages=[
             ChatMessage.of_system('You are an experienced python software engineer.'),
             ChatMessage.of_user(prompt)
-        ])
+        ], approval=self.approval, stage='suggest_tests')
 
     def write_tests(self) -> str:
         return self.write_tests_and_review_chat.run()
+
+    def suggest_tests(self) -> str:
+        return self._create_suggest_cases_chat().run()
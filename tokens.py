@@ -0,0 +1,124 @@
+import re
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+CONTEXT_WINDOWS = {
+    'gpt-3.5-turbo': 4096,
+    'gpt-3.5-turbo-16k': 16384,
+    'gpt-4': 8192,
+    'gpt-4-32k': 32768,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+# Dollars per 1000 prompt and completion tokens
+PRICES = {
+    'gpt-3.5-turbo': (0.0015, 0.002),
+    'gpt-3.5-turbo-16k': (0.003, 0.004),
+    'gpt-4': (0.03, 0.06),
+    'gpt-4-32k': (0.06, 0.12),
+}
+TOKENS_PER_MESSAGE = 4
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]|\s+')
+
+_encodings = {}
+
+
+@lru_cache(maxsize=None)
+def _tiktoken():
+    # tiktoken is optional, and slow to import, so it is imported when the first tokens are counted
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken
+
+
+def _encoding(model: str):
+    if model not in _encodings:
+        try:
+            _encodings[model] = _tiktoken().encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = _tiktoken().get_encoding('cl100k_base')
+    return _encodings[model]
+
+
+def count_tokens(text: str, model: str = 'gpt-3.5-turbo') -> int:
+    """
+    Counts the tokens of a text, using tiktoken if it is installed, and a local estimate otherwise.
+
+    The estimate counts words, punctuation and whitespace runs, with long words split every 4 characters, which is
+    close to (and usually a little above) the real count for english text and code.
+    """
+    if _tiktoken() is not None:
+        # A text may contain special tokens, e.g. <|endoftext|> in a module about tokenizers, which are counted as text
+        return len(_encoding(model).encode(text, disallowed_special=()))
+    return sum((len(token) + 3) // 4 if token[0].isalnum() else 1 for token in TOKEN_PATTERN.findall(text))
+
+
+def count_message_tokens(messages: list[dict[str, str]], model: str = 'gpt-3.5-turbo') -> int:
+    return sum(count_tokens(message['content'], model) + TOKENS_PER_MESSAGE for message in messages) + 2
+
+
+def prompt_budget(model: str, completion_reserve: int = 1024) -> int:
+    """
+    The number of prompt tokens that leaves completion_reserve tokens of the model's context window for the reply.
+    """
+    return CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW) - completion_reserve
+
+
+def cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    """
+    The price in dollars of a completion, or None for a model whose prices are unknown.
+    """
+    if model not in PRICES:
+        return None
+    prompt_price, completion_price = PRICES[model]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+@dataclass
+class StageUsage:
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+class TokenUsage:
+    """
+    Accumulates the tokens sent to and received from the API, per pipeline stage.
+    """
+
+    def __init__(self):
+        self.stages: dict[str, StageUsage] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, prompt_tokens: int, completion_tokens: int) -> None:
+        with self._lock:
+            usage = self.stages.setdefault(stage, StageUsage())
+            usage.calls += 1
+            usage.prompt_tokens += prompt_tokens
+            usage.completion_tokens += completion_tokens
+
+    def total(self) -> StageUsage:
+        with self._lock:
+            return StageUsage(
+                calls=sum(usage.calls for usage in self.stages.values()),
+                prompt_tokens=sum(usage.prompt_tokens for usage in self.stages.values()),
+                completion_tokens=sum(usage.completion_tokens for usage in self.stages.values()),
+            )
+
+
+token_usage = TokenUsage()
+
+
+def truncate_lines(text: str, max_lines: int, note: Optional[str] = None) -> str:
+    lines = text.splitlines()
+    if len(lines) <= max_lines:
+        return text
+    omitted = len(lines) - max_lines
+    return '\n'.join(lines[:max_lines] + [note or f'... ({omitted} more lines omitted)'])